@@ -0,0 +1,96 @@
+"""
+TBOS API caches
+"""
+
+from collections import OrderedDict
+import threading
+
+
+class TrackCache:
+
+    """
+    Process-wide LRU cache of decoded GPX tracks, keyed by ride_uuid, capped by bytes
+
+    Tracks are tuples of read-only arrays, so are shared as is across requests and threads.  Rides without a
+    track are cached as None, so non-GPX rides do not query for one on each access.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def sizeof(track):
+        if track is None:
+            return 0
+        return sum(array.nbytes for array in track)
+
+    def get(self, ride_uuid, loader):
+
+        """
+        Return track for ride, loading and caching on a miss
+
+        :param loader: callable, returns track or None for ride_uuid
+        """
+
+        with self.lock:
+            if ride_uuid in self.entries:
+                self.entries.move_to_end(ride_uuid)
+                self.hits += 1
+                return self.entries[ride_uuid]
+            self.misses += 1
+
+        # load outside lock, a concurrent miss for the same ride loads twice and the last put wins
+        track = loader(ride_uuid)
+        self.put(ride_uuid, track)
+        return track
+
+    def put(self, ride_uuid, track):
+        size = self.sizeof(track)
+        with self.lock:
+            self._pop(ride_uuid)
+            if size > self.max_bytes:
+                return
+            self.entries[ride_uuid] = track
+            self.bytes += size
+
+            # evict least recently used
+            while self.bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= self.sizeof(evicted)
+                self.evictions += 1
+
+    def _pop(self, ride_uuid):
+        if ride_uuid in self.entries:
+            self.bytes -= self.sizeof(self.entries.pop(ride_uuid))
+
+    def invalidate(self, ride_uuid):
+
+        """
+        Drop track for ride, next access will reload
+        """
+
+        with self.lock:
+            self._pop(ride_uuid)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "tracks": sum(1 for track in self.entries.values() if track is not None),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,81 @@
+"""
+TBOS API active context
+"""
+
+import threading
+
+
+class ActiveContext:
+
+    """
+    Process-wide cache of the current Bike and Ride, with derived values
+
+    Instances are loaded once in a private session, then detached, so they are shared across requests and
+    background threads without lookup queries.  Changes are written via write-behind persistence, which sets
+    them on these instances as well.  Invalidate whenever the current Bike or Ride changes, or is updated
+    outside the heartbeat path.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.lock = threading.RLock()
+        self.loaded = False
+        self.bike = None
+        self.ride = None
+        self.bike_config = None
+        self.ride_type = None
+        self.total_distance = None
+
+    def load(self):
+
+        """
+        Load current Bike and Ride, if not already loaded
+        """
+
+        if self.loaded:
+            return
+
+        from api.models import Bike, Ride
+
+        with self.lock:
+            if self.loaded:
+                return
+
+            session = self.app.db.create_session({})()
+            try:
+                bike = session.query(Bike).filter(Bike.is_current == True).one_or_none()
+                ride = session.query(Ride).filter(Ride.is_current == True).one_or_none()
+                session.expunge_all()
+            finally:
+                session.close()
+
+            # derived
+            self.bike_config = bike._config if bike is not None else None
+            self.ride_type = ride.ride_type if ride is not None else None
+            self.total_distance = ride.total_distance if ride is not None else None
+
+            self.bike, self.ride = bike, ride
+            self.loaded = True
+            print(f"active context loaded: {bike}, {ride}")
+
+    def get_bike(self):
+        self.load()
+        return self.bike
+
+    def get_ride(self):
+        self.load()
+        return self.ride
+
+    def invalidate(self):
+
+        """
+        Drop cached Bike and Ride, next access will reload
+        """
+
+        with self.lock:
+            self.loaded = False
+            self.bike = None
+            self.ride = None
+            self.bike_config = None
+            self.ride_type = None
+            self.total_distance = None
@@ -0,0 +1,273 @@
+"""
+TBOS API device connections
+"""
+
+import threading
+import time
+import traceback
+
+import pyboard
+from rshell.main import is_micropython_usb_device
+import serial
+import serial.tools.list_ports
+
+from api.exceptions import DeviceUnavailable
+
+# errors that mean the serial connection itself is gone, e.g. unplugged or reset
+CONNECTION_ERRORS = (serial.SerialException, OSError, pyboard.PyboardError)
+
+
+class DeviceConnection:
+
+    """
+    Open pyboard connection to one device, identified by USB serial number
+    """
+
+    def __init__(self, serial_number, port, client):
+        self.serial_number = serial_number
+        self.port = port
+        self.client = client
+        self.timestamp_connected = time.time()
+        self.commands = 0
+
+    @property
+    def is_open(self):
+
+        """
+        True if the serial handle is open and still answers, without talking to the device
+
+        Queries bytes waiting on the handle, which raises once the device is gone, e.g. unplugged, on any platform.
+        """
+
+        if self.client.pyb is None or not self.client.pyb.serial.is_open:
+            return False
+        try:
+            self.client.pyb.serial.in_waiting
+        except (serial.SerialException, OSError):
+            return False
+        return True
+
+    def close(self):
+        try:
+            self.client.pyb.close()
+        except Exception as e:
+            print(f"error closing pyboard connection @ {self.port}: {e}")
+
+    def to_dict(self):
+        return {
+            "serial_number": self.serial_number,
+            "port": self.port,
+            "is_open": self.is_open,
+            "timestamp_connected": self.timestamp_connected,
+            "commands": self.commands,
+        }
+
+
+class DeviceManager:
+
+    """
+    Long-lived pyboard connections, one per device, shared by all device commands
+
+    Ports are cached by USB serial number, so a connection is opened without scanning serial ports unless the
+    device has moved.  Commands that fail because the connection was lost, e.g. the device was unplugged or
+    reset, are retried once on a fresh connection.  Commands are serialized per manager by a lock, as the
+    pyboard protocol is strictly request / response.
+    """
+
+    def __init__(self, app, baudrate=115200, serial_timeout=20):
+        self.app = app
+        self.baudrate = baudrate
+        self.serial_timeout = serial_timeout
+
+        # serial number -> DeviceConnection, and serial number -> last known port
+        self.connections = {}
+        self.ports = {}
+        self.default_serial_number = None
+        self.lock = threading.RLock()
+
+        # stats
+        self.scans = 0
+        self.connects = 0
+        self.reconnects = 0
+        self.commands = 0
+        self.errors = 0
+        self.last_error = None
+        self.last_connect_elapsed = None
+
+    def scan(self):
+
+        """
+        Scan serial ports for MicroPython USB devices
+
+        Inspired by rshell code:
+        https://github.com/dhylands/rshell/blob/master/rshell/main.py#L350-L366
+
+        :return: dict, USB serial number (or port, if none reported) -> port
+        """
+
+        self.scans += 1
+        return {
+            port.serial_number or port.device: port.device
+            for port in serial.tools.list_ports.comports()
+            if port.vid and is_micropython_usb_device(port)
+        }
+
+    def _open(self, port):
+        pyb = pyboard.Pyboard(port, self.baudrate)
+        pyb.serial.timeout = self.serial_timeout
+        return pyb
+
+    def connect(self, serial_number=None):
+
+        """
+        Return open connection to device, opening one if needed
+
+        :param serial_number: str, USB serial number, defaults to first device found
+        :return: DeviceConnection
+        """
+
+        from api.models import PyboardClient
+
+        with self.lock:
+            serial_number = serial_number or self.default_serial_number
+            conn = self.connections.get(serial_number)
+            if conn is not None:
+                return conn
+
+            t0 = time.time()
+
+            # try cached port first, then rescan as device may have moved
+            pyb = None
+            port = self.ports.get(serial_number)
+            if port is not None:
+                try:
+                    pyb = self._open(port)
+                except CONNECTION_ERRORS as e:
+                    print(f"cached port {port} for pyboard {serial_number} unavailable: {e}")
+            if pyb is None:
+                present = self.scan()
+                self.ports.update(present)
+                if serial_number is None and present:
+                    serial_number = next(iter(present))
+                port = present.get(serial_number)
+                if port is None:
+                    raise DeviceUnavailable(f"pyboard not found: {serial_number or 'no MicroPython device'}")
+                try:
+                    pyb = self._open(port)
+                except CONNECTION_ERRORS as e:
+                    raise DeviceUnavailable(f"cannot access pyboard {serial_number} @ {port}: {e}")
+
+            conn = DeviceConnection(serial_number, port, PyboardClient(pyb=pyb))
+            self.connections[serial_number] = conn
+            if self.default_serial_number is None:
+                self.default_serial_number = serial_number
+            self.connects += 1
+            self.last_connect_elapsed = time.time() - t0
+            print(f"pyboard {serial_number} connected @ {port}: {self.last_connect_elapsed}")
+            return conn
+
+    def disconnect(self, serial_number=None):
+
+        """
+        Close connection to device, if open
+        """
+
+        with self.lock:
+            conn = self.connections.pop(serial_number or self.default_serial_number, None)
+            if conn is not None:
+                conn.close()
+                print(f"pyboard {conn.serial_number} disconnected @ {conn.port}")
+            return conn is not None
+
+    def close(self):
+
+        """
+        Close all connections
+        """
+
+        with self.lock:
+            for serial_number in list(self.connections):
+                self.disconnect(serial_number)
+
+    def run(self, func, serial_number=None):
+
+        """
+        Run func(client) with a connected PyboardClient, reconnecting and retrying once if the connection was lost
+
+        :param func: callable, passed a PyboardClient
+        :return: result of func
+        """
+
+        with self.lock:
+            for attempt in range(2):
+                conn = self.connect(serial_number)
+                t0 = time.perf_counter()
+                try:
+                    result = func(conn.client)
+                    self.app.metrics.observe("device_command", time.perf_counter() - t0)
+                    conn.commands += 1
+                    self.commands += 1
+                    return result
+                except Exception as e:
+                    self.errors += 1
+                    self.last_error = str(e)
+                    lost = isinstance(e.__cause__ or e, CONNECTION_ERRORS) or not conn.is_open
+                    if not lost:
+                        raise e
+                    print({"error": str(e), "traceback": traceback.format_exc()})
+                    self.disconnect(conn.serial_number)
+                    if attempt > 0:
+                        raise DeviceUnavailable(f"lost connection to pyboard {conn.serial_number}: {e}")
+                    print(f"connection to pyboard {conn.serial_number} lost, reconnecting")
+                    self.reconnects += 1
+
+    def execute(self, cmds, resp_idx=None, serial_number=None):
+
+        """
+        Issue command(s) to device, see PyboardClient.execute
+        """
+
+        return self.run(lambda client: client.execute(cmds, resp_idx=resp_idx), serial_number=serial_number)
+
+    def check(self):
+
+        """
+        Passive health check, closing connections whose device is no longer present
+
+        Does not talk to the device, so does not wait on a running command.
+
+        :return: dict, per device health
+        """
+
+        present = self.scan()
+        health = {serial_number: None for serial_number in present}
+        for serial_number, conn in list(self.connections.items()):
+            health[serial_number] = conn.is_open and present.get(serial_number) == conn.port
+
+        # close stale connections, unless a command is running, which reconnects as needed
+        if self.lock.acquire(blocking=False):
+            try:
+                self.ports.update(present)
+                for serial_number, healthy in health.items():
+                    if healthy is False:
+                        self.disconnect(serial_number)
+            finally:
+                self.lock.release()
+        return health
+
+    def stats(self):
+        with self.lock:
+            connections = [conn.to_dict() for conn in self.connections.values()]
+        return {
+            "default_serial_number": self.default_serial_number,
+            "connections": connections,
+            "ports": dict(self.ports),
+            "scans": self.scans,
+            "connects": self.connects,
+            "reconnects": self.reconnects,
+            "commands": self.commands,
+            "errors": self.errors,
+            "last_error": self.last_error,
+            "last_connect_elapsed": self.last_connect_elapsed,
+            "latency": self.app.metrics.histogram("device_command").to_dict(),
+        }
@@ -0,0 +1,141 @@
+"""
+TBOS API downsampling
+"""
+
+MODES = ("lttb", "minmax")
+
+
+def lttb(values, threshold):
+
+    """
+    Largest-Triangle-Three-Buckets downsampling of a series, where x is the index
+
+    The first and last points are always kept.  Each bucket between keeps the point forming the largest
+    triangle with the previously kept point and the average of the next bucket.  None points are skipped,
+    unless a bucket has no other points.
+
+    A single pass over the values; plain loops are faster here than numpy, as buckets are small.
+
+    :param values: list of values, None for gaps
+    :param threshold: int, number of points to keep
+    :return: list of kept indices, ascending
+    """
+
+    n = len(values)
+    if threshold >= n or n <= 2:
+        return list(range(n))
+    if threshold < 3:
+        return [0, n - 1][:threshold]
+
+    every = (n - 2) / (threshold - 2)
+    kept = [0]
+    a = 0
+    ay = values[0] if values[0] is not None else 0.0
+
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+
+        # average of next bucket, which for the last bucket is the last point
+        next_start, next_end = end, min(int((i + 2) * every) + 1, n)
+        sum_x, sum_y, count = 0.0, 0.0, 0
+        for j in range(next_start, next_end):
+            y = values[j]
+            if y is not None:
+                sum_x += j
+                sum_y += y
+                count += 1
+        if count:
+            avg_x, avg_y = sum_x / count, sum_y / count
+        else:
+            avg_x, avg_y = (next_start + next_end - 1) / 2, ay
+
+        # point of bucket forming largest triangle
+        best, best_area = start, -1.0
+        dx, dy = a - avg_x, avg_y - ay
+        for j in range(start, end):
+            y = values[j]
+            if y is None:
+                continue
+            area = abs(dx * (y - ay) - (a - j) * dy)
+            if area > best_area:
+                best, best_area = j, area
+
+        kept.append(best)
+        a = best
+        if values[a] is not None:
+            ay = values[a]
+
+    kept.append(n - 1)
+    return kept
+
+
+def minmax(values, threshold):
+
+    """
+    Min/max bucket downsampling of a series, keeping the lowest and highest point of each bucket
+
+    Keeps spikes that LTTB may smooth over, at the cost of two points per bucket.
+
+    :param values: list of values, None for gaps
+    :param threshold: int, maximum number of points to keep
+    :return: list of kept indices, ascending
+    """
+
+    n = len(values)
+    if threshold >= n or n <= 2:
+        return list(range(n))
+    if threshold < 4:
+        return [0, n - 1][:threshold]
+
+    buckets = (threshold - 2) // 2
+    every = (n - 2) / buckets
+    kept = [0]
+    for i in range(buckets):
+        start, end = int(i * every) + 1, int((i + 1) * every) + 1
+        lo = hi = None
+        for j in range(start, end):
+            y = values[j]
+            if y is None:
+                continue
+            if lo is None or y < values[lo]:
+                lo = j
+            if hi is None or y > values[hi]:
+                hi = j
+        if lo is None:
+            kept.append(start)
+        else:
+            kept.extend(sorted({lo, hi}))
+    kept.append(n - 1)
+    return kept
+
+
+def select_indices(series, max_points, mode="lttb"):
+
+    """
+    Select indices shared by several series plotted on one axis, keeping at most max_points
+
+    Each series is downsampled with an equal share of max_points, then kept indices are merged.  Shares too
+    small to downsample into keep the first and last indices only, or just the first if max_points is 1.
+
+    :param series: list of lists, of equal length
+    :param max_points: int
+    :param mode: str, one of MODES
+    :return: list of kept indices, ascending
+    """
+
+    if mode not in MODES:
+        raise ValueError(f"downsample mode must be one of {MODES}, not {mode}")
+
+    length = len(series[0]) if series else 0
+    if max_points is None or length <= max_points:
+        return list(range(length))
+
+    func = {"lttb": lttb, "minmax": minmax}[mode]
+    share = max_points // len(series)
+    if share < 2:
+        return [0, length - 1][:max_points]
+    kept = set()
+    for values in series:
+        kept.update(func(values, share))
+    return sorted(kept)
@@ -0,0 +1,103 @@
+"""
+TBOS API event broker
+"""
+
+import json
+import queue
+import threading
+import time
+
+
+class EventBroker:
+
+    """
+    Fan out of server-sent events to subscribers
+
+    Events are encoded once on publish.  Each subscriber has a bounded queue; a subscriber that falls behind
+    drops its oldest events rather than holding up the publisher.
+    """
+
+    def __init__(self, max_queued=30):
+        self.max_queued = max_queued
+        self.subscribers = set()
+        self.lock = threading.Lock()
+
+        # when the last subscriber left, None while any are subscribed
+        self.idle_since = time.time()
+
+    def subscribe(self):
+
+        """
+        Return new subscriber queue
+        """
+
+        subscriber = queue.Queue(maxsize=self.max_queued)
+        with self.lock:
+            self.subscribers.add(subscriber)
+            self.idle_since = None
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+            if not self.subscribers and self.idle_since is None:
+                self.idle_since = time.time()
+
+    def idle_for(self):
+
+        """
+        Return seconds without any subscribers, 0.0 while any are subscribed
+        """
+
+        with self.lock:
+            return 0.0 if self.idle_since is None else time.time() - self.idle_since
+
+    @staticmethod
+    def encode(event, data):
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+    def publish(self, event, data):
+
+        """
+        Publish event to all subscribers
+
+        :return: int, count of subscribers
+        """
+
+        message = self.encode(event, data)
+        with self.lock:
+            subscribers = list(self.subscribers)
+
+        for subscriber in subscribers:
+            while True:
+                try:
+                    subscriber.put_nowait(message)
+                    break
+                except queue.Full:
+                    try:
+                        subscriber.get_nowait()
+                    except queue.Empty:
+                        pass
+
+        return len(subscribers)
+
+    def stream(self, keepalive=15.0, initial=None):
+
+        """
+        Generator of server-sent event messages for a new subscriber, unsubscribing when closed
+
+        :param initial: list of (event, data) tuples, sent before any published events
+        """
+
+        subscriber = self.subscribe()
+        try:
+            yield ": connected\n\n"
+            for event, data in initial or []:
+                yield self.encode(event, data)
+            while True:
+                try:
+                    yield subscriber.get(timeout=keepalive)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+        finally:
+            self.unsubscribe(subscriber)
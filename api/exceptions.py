@@ -9,3 +9,11 @@ class PybReplCmdError(Exception):
 
 class PybReplRespError(Exception):
     pass
+
+
+class DeviceJobTimeout(Exception):
+    pass
+
+
+class DeviceUnavailable(Exception):
+    pass
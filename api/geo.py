@@ -0,0 +1,352 @@
+"""
+TBOS API geo
+"""
+
+from collections import namedtuple
+import math
+
+import numpy as np
+
+METHODS = ("haversine", "vincenty")
+
+FEET_PER_METER = 1 / 0.3048
+
+# mean earth radius, meters
+EARTH_RADIUS = 6371008.8
+
+# WGS-84 ellipsoid, meters
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_B = WGS84_A * (1 - WGS84_F)
+
+# spans of up to this many points are simplified with a plain loop
+SHORT_SPAN = 32
+
+
+def haversine(lat1, lon1, lat2, lon2):
+
+    """
+    Great circle distance between points on a sphere of mean earth radius, in feet
+
+    Within about 0.5% of the ellipsoidal distance, typically much closer over the short steps of a track.
+
+    :param lat1, lon1, lat2, lon2: arrays of degrees
+    :return: array of distances, feet
+    """
+
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(x, dtype=float)) for x in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0))) * FEET_PER_METER
+
+
+def vincenty(lat1, lon1, lat2, lon2, tolerance=1e-12, max_iterations=200):
+
+    """
+    Ellipsoidal (WGS-84) distance by Vincenty's inverse formula, in feet
+
+    All pairs are iterated together, each until converged; sub-millimeter agreement with geopy's geodesic
+    distance.  Nearly antipodal pairs that do not converge fall back to haversine.
+
+    :param lat1, lon1, lat2, lon2: arrays of degrees
+    :return: array of distances, feet
+    """
+
+    lat1, lon1, lat2, lon2 = (np.atleast_1d(np.asarray(x, dtype=float)) for x in (lat1, lon1, lat2, lon2))
+    f = WGS84_F
+
+    u1 = np.arctan((1 - f) * np.tan(np.radians(lat1)))
+    u2 = np.arctan((1 - f) * np.tan(np.radians(lat2)))
+    sin_u1, cos_u1, sin_u2, cos_u2 = np.sin(u1), np.cos(u1), np.sin(u2), np.cos(u2)
+    lon_delta = np.radians(lon2 - lon1)
+
+    lam = lon_delta.copy()
+    active = np.ones(lam.shape, dtype=bool)
+    sin_sigma = cos_sigma = sigma = cos_sq_alpha = cos_2sigma_m = np.zeros(lam.shape)
+    for _ in range(max_iterations):
+        sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+        sin_sigma = np.hypot(cos_u2 * sin_lam, cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lam)
+        cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lam
+        sigma = np.arctan2(sin_sigma, cos_sigma)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            sin_alpha = np.where(sin_sigma == 0, 0.0, cos_u1 * cos_u2 * sin_lam / sin_sigma)
+            cos_sq_alpha = 1 - sin_alpha ** 2
+            cos_2sigma_m = np.where(cos_sq_alpha == 0, 0.0, cos_sigma - 2 * sin_u1 * sin_u2 / cos_sq_alpha)
+        c = f / 16 * cos_sq_alpha * (4 + f * (4 - 3 * cos_sq_alpha))
+        lam_next = lon_delta + (1 - c) * f * sin_alpha * (
+            sigma + c * sin_sigma * (cos_2sigma_m + c * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2))
+        )
+
+        # only iterate pairs not yet converged
+        lam_next = np.where(active, lam_next, lam)
+        active = np.abs(lam_next - lam) > tolerance
+        lam = lam_next
+        if not active.any():
+            break
+
+    u_sq = cos_sq_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+    a = 1 + u_sq / 16384 * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+    b = u_sq / 1024 * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+    delta_sigma = (
+        b
+        * sin_sigma
+        * (
+            cos_2sigma_m
+            + b
+            / 4
+            * (
+                cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)
+                - b / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)
+            )
+        )
+    )
+    distance = WGS84_B * a * (sigma - delta_sigma) * FEET_PER_METER
+
+    # fall back to haversine where not converged
+    if active.any():
+        distance = np.where(active, haversine(lat1, lon1, lat2, lon2), distance)
+    return distance
+
+
+def step_distances(latitudes, longitudes, method="haversine"):
+
+    """
+    Distance from each point of a track to the next, in feet, where the first step is 0.0
+
+    :param latitudes: array of degrees
+    :param longitudes: array of degrees
+    :param method: str, one of METHODS
+    :return: array of distances, feet
+    """
+
+    if method not in METHODS:
+        raise ValueError(f"distance method must be one of {METHODS}, not {method}")
+
+    latitudes = np.asarray(latitudes, dtype=float)
+    longitudes = np.asarray(longitudes, dtype=float)
+    steps = np.zeros(len(latitudes))
+    if len(latitudes) > 1:
+        func = {"haversine": haversine, "vincenty": vincenty}[method]
+        steps[1:] = func(latitudes[:-1], longitudes[:-1], latitudes[1:], longitudes[1:])
+    return steps
+
+
+def douglas_peucker_importance(latitudes, longitudes):
+
+    """
+    Douglas-Peucker importance of each point of a track, in meters
+
+    A point's importance is the largest tolerance at which Douglas-Peucker simplification keeps it, so the
+    track simplified at any tolerance is the points with importance >= tolerance.  The first and last
+    points are always kept, with infinite importance.  Importance is capped by that of the point that split
+    its span, so that simplification is nested across tolerances.
+
+    Distances are measured on a local equirectangular projection, fine at the scale of a ride.
+
+    :param latitudes: array of degrees
+    :param longitudes: array of degrees
+    :return: array of importances, meters
+    """
+
+    latitudes = np.asarray(latitudes, dtype=float)
+    longitudes = np.asarray(longitudes, dtype=float)
+    n = len(latitudes)
+    importance = np.zeros(n)
+    if n == 0:
+        return importance
+    importance[0] = importance[-1] = np.inf
+    if n < 3:
+        return importance
+
+    # project to meters
+    lat0 = np.radians(np.nanmean(latitudes))
+    x = np.radians(longitudes) * EARTH_RADIUS * np.cos(lat0)
+    y = np.radians(latitudes) * EARTH_RADIUS
+
+    # spans of (start, end, importance of splitting point), end inclusive
+    spans = [(0, n - 1, np.inf)]
+    xs, ys = x.tolist(), y.tolist()
+    while spans:
+        start, end, cap = spans.pop()
+        if end - start < 2:
+            continue
+
+        # perpendicular distance of interior points to chord, or distance to start if chord is a point
+        dx, dy = xs[end] - xs[start], ys[end] - ys[start]
+        chord = math.hypot(dx, dy)
+        if end - start <= SHORT_SPAN:
+            # plain loop, cheaper than numpy for the many short spans
+            split, distance = start + 1, -1.0
+            for idx in range(start + 1, end):
+                px, py = xs[idx] - xs[start], ys[idx] - ys[start]
+                d = abs(dx * py - dy * px) / chord if chord > 0 else math.hypot(px, py)
+                if d > distance:
+                    split, distance = idx, d
+        else:
+            px, py = x[start + 1 : end] - x[start], y[start + 1 : end] - y[start]
+            if chord > 0:
+                distances = np.abs(dx * py - dy * px) / chord
+            else:
+                distances = np.hypot(px, py)
+            idx = int(np.argmax(distances))
+            split, distance = start + 1 + idx, float(distances[idx])
+
+        value = min(distance, cap)
+        importance[split] = value
+        spans.append((start, split, value))
+        spans.append((split, end, value))
+
+    return importance
+
+
+def simplify(importance, tolerance=0.0, max_points=None):
+
+    """
+    Return indices of track points kept for a tolerance and / or point budget
+
+    :param importance: array, from douglas_peucker_importance()
+    :param tolerance: float, meters
+    :param max_points: int, keep at most this many of the most important points
+    :return: array of indices, ascending
+    """
+
+    kept = np.flatnonzero(importance >= tolerance) if tolerance > 0 else np.arange(len(importance))
+    if max_points is not None and len(kept) > max_points:
+        top = np.argpartition(-importance[kept], max_points - 1)[:max_points]
+        kept = np.sort(kept[top])
+    return kept
+
+
+def meters_per_pixel(zoom, latitude):
+
+    """
+    Ground resolution of a web mercator map at zoom level and latitude, for 256 pixel tiles
+    """
+
+    return 2 * np.pi * WGS84_A * np.cos(np.radians(latitude)) / (256 * 2 ** zoom)
+
+
+def initial_bearing(lat1, lon1, lat2, lon2):
+
+    """
+    Initial great circle bearing from first to second point, in degrees clockwise from north, [0, 360)
+
+    Scalar, with math rather than numpy, as it is called per position.
+
+    :param lat1, lon1, lat2, lon2: degrees
+    """
+
+    lat1, lon1, lat2, lon2 = (math.radians(x) for x in (lat1, lon1, lat2, lon2))
+    lon_delta = lon2 - lon1
+    y = math.sin(lon_delta) * math.cos(lat2)
+    x = math.cos(lat1) * math.sin(lat2) - math.sin(lat1) * math.cos(lat2) * math.cos(lon_delta)
+    return math.degrees(math.atan2(y, x)) % 360
+
+
+# position along a track, where segment is the index of the point starting the bracketing segment, and
+# fraction how far along that segment
+TrackPosition = namedtuple(
+    "TrackPosition", ["mark", "distance", "latitude", "longitude", "altitude", "segment", "fraction", "bearing"]
+)
+
+
+class TrackPositioner:
+
+    """
+    Positions along a track by time or distance, in O(log n)
+
+    The bracketing points are found by binary search over the monotonic mark or cumulative distance arrays,
+    and the position interpolated linearly between them.  Where mark is None, points are one second apart,
+    and the bracketing points for a time are a direct index.
+
+    Nothing is precomputed, so a positioner is cheap to create over a cached track.
+    """
+
+    def __init__(self, cum_distance, latitude, longitude, altitude=None, mark=None):
+        self.cum_distance = cum_distance
+        self.latitude = latitude
+        self.longitude = longitude
+        self.altitude = altitude
+        self.mark = mark
+        self.count = len(latitude)
+
+    def _mark(self, idx):
+        return float(idx) if self.mark is None else float(self.mark[idx])
+
+    def at_mark(self, mark):
+
+        """
+        Return position at seconds since start of track
+
+        :return: TrackPosition, or None if track has no points
+        """
+
+        if self.count == 0:
+            return None
+        if self.mark is None:
+            idx = int(np.floor(mark))
+        else:
+            idx = int(np.searchsorted(self.mark, mark, side="right")) - 1
+        idx = min(max(idx, 0), max(self.count - 2, 0))
+
+        fraction = 0.0
+        if idx + 1 < self.count:
+            span = self._mark(idx + 1) - self._mark(idx)
+            fraction = min(max((mark - self._mark(idx)) / span, 0.0), 1.0) if span > 0 else 0.0
+        return self._position(idx, fraction)
+
+    def at_distance(self, distance):
+
+        """
+        Return position at distance along track, where a stop is positioned at its arrival
+
+        :return: TrackPosition, or None if track has no points
+        """
+
+        if self.count == 0:
+            return None
+        idx = int(np.searchsorted(self.cum_distance, distance, side="left")) - 1
+        idx = min(max(idx, 0), max(self.count - 2, 0))
+
+        fraction = 0.0
+        if idx + 1 < self.count:
+            span = self.cum_distance[idx + 1] - self.cum_distance[idx]
+            fraction = min(max((distance - self.cum_distance[idx]) / span, 0.0), 1.0) if span > 0 else 0.0
+        return self._position(idx, fraction)
+
+    def _interpolate(self, values, idx, fraction):
+        if fraction == 0.0 or idx + 1 >= self.count:
+            return float(values[idx])
+        return float(values[idx] + (values[idx + 1] - values[idx]) * fraction)
+
+    def bearing(self, idx):
+
+        """
+        Bearing of segment starting at point idx, in degrees
+
+        For a segment without movement, e.g. a stop, the bearing is that of the last movement into it.
+
+        :return: float, or None if track has not moved by this segment
+        """
+
+        end = min(idx + 1, self.count - 1)
+        if self.cum_distance[end] <= self.cum_distance[idx]:
+            # last point before reaching this distance
+            end = idx
+            idx = int(np.searchsorted(self.cum_distance, self.cum_distance[end], side="left")) - 1
+            if idx < 0:
+                return None
+        return initial_bearing(
+            float(self.latitude[idx]), float(self.longitude[idx]), float(self.latitude[end]), float(self.longitude[end])
+        )
+
+    def _position(self, idx, fraction):
+        return TrackPosition(
+            mark=self._interpolate(self.mark, idx, fraction) if self.mark is not None else idx + fraction,
+            distance=self._interpolate(self.cum_distance, idx, fraction),
+            latitude=self._interpolate(self.latitude, idx, fraction),
+            longitude=self._interpolate(self.longitude, idx, fraction),
+            altitude=self._interpolate(self.altitude, idx, fraction) if self.altitude is not None else None,
+            segment=idx,
+            fraction=fraction,
+            bearing=self.bearing(idx),
+        )
@@ -0,0 +1,239 @@
+"""
+TBOS API GPX
+"""
+
+from collections import namedtuple
+import datetime
+import xml.etree.ElementTree as ET
+import zlib
+
+import numpy as np
+
+from api.geo import FEET_PER_METER
+
+# track points as parallel arrays, where time is seconds since epoch
+GPXTrack = namedtuple("GPXTrack", ["time", "latitude", "longitude", "altitude"])
+
+# stored track point columns and their little-endian dtypes, see RideTrack
+POINT_DTYPES = {
+    "time": "<i8",
+    "latitude": "<f8",
+    "longitude": "<f8",
+    "altitude": "<f8",
+    "step_distance": "<f8",
+    "cum_distance": "<f8",
+    "mark": "<i8",
+    "importance": "<f4",
+}
+
+# point columns also stored resampled to one point per second of mark, as "resampled_<column>"
+RESAMPLED_COLUMNS = ["latitude", "longitude", "altitude", "cum_distance"]
+RESAMPLED_DTYPES = {f"resampled_{name}": "<f8" for name in RESAMPLED_COLUMNS}
+
+# all stored track columns
+TRACK_DTYPES = {**POINT_DTYPES, **RESAMPLED_DTYPES}
+Track = namedtuple("Track", list(TRACK_DTYPES))
+
+
+def _local_name(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def parse_time(text):
+
+    """
+    Parse GPX (ISO 8601) time to seconds since epoch, where times without an offset are UTC
+    """
+
+    text = text.strip()
+    if text.endswith("Z"):
+        text = text[:-1] + "+00:00"
+
+    # fromisoformat only accepts 3 or 6 fractional digits
+    if "." in text:
+        head, _, tail = text.partition(".")
+        digits = len(tail) - len(tail.lstrip("0123456789"))
+        fraction = tail[:digits][:6].ljust(6, "0")
+        text = f"{head}.{fraction}{tail[digits:]}"
+
+    dt = datetime.datetime.fromisoformat(text)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return dt.timestamp()
+
+
+class GrowableArrays:
+
+    """
+    Parallel float arrays, preallocated and doubled as needed
+    """
+
+    def __init__(self, names, capacity=4096):
+        self.names = names
+        self.length = 0
+        self.arrays = {name: np.empty(capacity, dtype=float) for name in names}
+
+    def append(self, *values):
+        if self.length == len(self.arrays[self.names[0]]):
+            for name in self.names:
+                array = np.empty(len(self.arrays[name]) * 2, dtype=float)
+                array[: self.length] = self.arrays[name][: self.length]
+                self.arrays[name] = array
+        for name, value in zip(self.names, values):
+            self.arrays[name][self.length] = value
+        self.length += 1
+
+    def trimmed(self):
+
+        """
+        Return arrays trimmed to length, as copies so the spare capacity is released
+        """
+
+        return {name: self.arrays[name][: self.length].copy() for name in self.names}
+
+
+def parse_gpx(fileobj, capacity=4096):
+
+    """
+    Parse track points of a GPX file, streaming
+
+    The file is read incrementally with iterparse, and each track point is cleared and detached from its
+    segment once read, so memory grows with the point arrays rather than the XML document.
+
+    :param fileobj: binary file-like object, e.g. an uploaded file's stream
+    :param capacity: int, initial capacity of point arrays
+    :return: GPXTrack, where missing elevations are NaN
+    """
+
+    points = GrowableArrays(GPXTrack._fields, capacity=capacity)
+    parents = []
+    for event, elem in ET.iterparse(fileobj, events=("start", "end")):
+        name = _local_name(elem.tag)
+        if event == "start":
+            if name == "trkseg":
+                parents.append(elem)
+            continue
+
+        if name == "trkpt":
+            time = altitude = None
+            for child in elem:
+                child_name = _local_name(child.tag)
+                if child_name == "time" and child.text:
+                    time = parse_time(child.text)
+                elif child_name == "ele" and child.text:
+                    altitude = float(child.text)
+            if time is None:
+                raise ValueError(f"GPX track point {points.length} has no time")
+            points.append(
+                time,
+                float(elem.attrib["lat"]),
+                float(elem.attrib["lon"]),
+                np.nan if altitude is None else altitude,
+            )
+
+            # drop point, keeping the segment from accumulating children
+            elem.clear()
+            if parents:
+                parents[-1].remove(elem)
+
+        elif name == "trkseg":
+            parents.pop()
+
+    return GPXTrack(**points.trimmed())
+
+
+def resample_track(mark, columns):
+
+    """
+    Resample track columns to a uniform grid of one point per second of mark, by linear interpolation
+
+    Where several points share a second, the first is used.  The value at second t is then index t of each
+    resampled array, for t from 0 to the last mark.
+
+    :param mark: array of seconds since start of track
+    :param columns: mapping of column name to array, aligned with mark
+    :return: dict of "resampled_<column>" to array
+    """
+
+    mark = np.asarray(mark)
+    if len(mark) == 0:
+        return {f"resampled_{name}": np.empty(0) for name in columns}
+
+    # first point of each second, in time order
+    order = np.argsort(mark, kind="stable")
+    seconds, first = np.unique(mark[order], return_index=True)
+    points = order[first]
+
+    grid = np.arange(int(seconds[-1]) + 1)
+    return {
+        f"resampled_{name}": np.interp(grid, seconds, np.asarray(values, dtype=float)[points])
+        for name, values in columns.items()
+    }
+
+
+def summarize_track(latitude, longitude, altitude, cum_distance):
+
+    """
+    Summary of a track, stored on its ride so rides can be listed without loading tracks
+
+    Elevation gain is the sum of climbs between consecutive points.
+
+    :return: dict of point_count, total_distance (feet), bbox ([[north, west], [south, east]]), elevation_gain
+        (feet)
+    """
+
+    if len(latitude) == 0:
+        return {"point_count": 0, "total_distance": 0.0, "bbox": None, "elevation_gain": 0.0}
+
+    latitude, longitude = np.asarray(latitude, dtype=float), np.asarray(longitude, dtype=float)
+    climbs = np.diff(np.asarray(altitude, dtype=float))
+    return {
+        "point_count": len(latitude),
+        "total_distance": float(cum_distance[-1]),
+        "bbox": [[float(latitude.max()), float(longitude.min())], [float(latitude.min()), float(longitude.max())]],
+        "elevation_gain": float(climbs[climbs > 0].sum() * FEET_PER_METER),
+    }
+
+
+def encode_array(values, dtype):
+
+    """
+    Encode array as zlib compressed bytes of dtype
+    """
+
+    return zlib.compress(np.ascontiguousarray(values, dtype=dtype).tobytes())
+
+
+def decode_array(blob, dtype):
+
+    """
+    Decode zlib compressed bytes as array of dtype
+
+    The array is a read-only view over the decompressed bytes, not a copy.
+    """
+
+    return np.frombuffer(zlib.decompress(blob), dtype=dtype)
+
+
+def encode_track(columns):
+
+    """
+    Encode track columns for storage
+
+    :param columns: mapping of column name to array, for each of TRACK_DTYPES, see resample_track()
+    :return: dict of column name to bytes
+    """
+
+    return {name: encode_array(columns[name], dtype) for name, dtype in TRACK_DTYPES.items()}
+
+
+def decode_track(row):
+
+    """
+    Decode stored track columns
+
+    :param row: mapping of column name to bytes, e.g. a gpx_track row
+    :return: Track
+    """
+
+    return Track(**{name: decode_array(row[name], dtype) for name, dtype in TRACK_DTYPES.items()})
@@ -0,0 +1,195 @@
+"""
+TBOS API ride ingestion
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+
+INGEST_STATUSES = ["queued", "running", "complete", "failed"]
+
+
+class ProgressReader:
+
+    """
+    Binary file wrapper reporting fraction of bytes read, for progress while streaming a parse
+    """
+
+    def __init__(self, fileobj, size, callback):
+        self.fileobj = fileobj
+        self.size = max(size, 1)
+        self.callback = callback
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.bytes_read += len(data)
+        self.callback(min(self.bytes_read / self.size, 1.0))
+        return data
+
+
+class IngestJob:
+
+    """
+    Ingestion of an uploaded ride, tracked by stage and percent complete
+    """
+
+    def __init__(self, ride_uuid, ride_type, name=None):
+        self.job_id = str(uuid.uuid4())
+        self.ride_uuid = ride_uuid
+        self.ride_type = ride_type
+        self.name = name
+        self.status = "queued"
+        self.stage = "queued"
+        self.percent = 0.0
+        self.error = None
+        self.timestamp_added = time.time()
+        self.timestamp_started = None
+        self.timestamp_finished = None
+
+    def update(self, stage, percent=None):
+
+        """
+        Set current stage, and percent complete overall
+        """
+
+        self.stage = stage
+        if percent is not None:
+            self.percent = round(max(self.percent, min(percent, 100.0)), 1)
+
+    @property
+    def finished(self):
+        return self.status in ("complete", "failed")
+
+    @property
+    def elapsed(self):
+        if self.timestamp_started is None:
+            return None
+        return (self.timestamp_finished or time.time()) - self.timestamp_started
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_id,
+            "ride_uuid": self.ride_uuid,
+            "ride_type": self.ride_type,
+            "name": self.name,
+            "status": self.status,
+            "stage": self.stage,
+            "percent": self.percent,
+            "error": self.error,
+            "timestamp_added": self.timestamp_added,
+            "timestamp_started": self.timestamp_started,
+            "timestamp_finished": self.timestamp_finished,
+            "elapsed": self.elapsed,
+        }
+
+
+class IngestManager:
+
+    """
+    Runs ride ingestion off the request thread, in a small pool of worker threads
+
+    Uploads are spooled in memory, rolling over to a temporary file past spool_max_bytes, as the request stream
+    does not outlive the request, and the ride is only saved once its pipeline completes, so it is not
+    selectable until then.  Jobs are kept in memory, the most recent max_jobs of them.
+    """
+
+    def __init__(self, app, max_workers=1, max_jobs=100, spool_max_bytes=16 * 1024 * 1024):
+        self.app = app
+        self.max_workers = max_workers
+        self.max_jobs = max_jobs
+        self.spool_max_bytes = spool_max_bytes
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def _executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="tbos-ingest")
+            return self.executor
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list(self):
+        with self.lock:
+            return list(reversed(self.jobs.values()))
+
+    def _add(self, job):
+        with self.lock:
+            self.jobs[job.job_id] = job
+
+            # drop oldest finished jobs
+            for job_id in [job_id for job_id, job in self.jobs.items() if job.finished]:
+                if len(self.jobs) <= self.max_jobs:
+                    break
+                self.jobs.pop(job_id)
+
+    def submit_gpx(self, ride_uuid, payload, upload):
+
+        """
+        Queue GPX ride ingestion
+
+        :param ride_uuid: str
+        :param payload: mapping, ride form fields
+        :param upload: werkzeug FileStorage, uploaded GPX file
+        :return: IngestJob
+        """
+
+        # spool upload, the worker closes it, which removes any file rolled over to
+        spool = tempfile.SpooledTemporaryFile(max_size=self.spool_max_bytes, prefix="tbos-ingest-", suffix=".gpx")
+        try:
+            upload.save(spool)
+            size = spool.tell()
+            spool.seek(0)
+
+            job = IngestJob(ride_uuid, "gpx", name=payload.get("name", None))
+            self._executor().submit(self._run_gpx, job, dict(payload), spool, size)
+        except Exception:
+            spool.close()
+            raise
+        self._add(job)
+        print(f"queued GPX ingestion {job.job_id} for ride {ride_uuid}")
+        return job
+
+    def _run_gpx(self, job, payload, spool, size):
+
+        from api.models import Ride
+
+        job.status = "running"
+        job.timestamp_started = time.time()
+        try:
+            with self.app.app_context():
+
+                # parsing reports progress by bytes read, as the first half of the job
+                reader = ProgressReader(spool, size, lambda fraction: job.update("parsing", fraction * 50))
+                ride = Ride.create_gpx_ride(job.ride_uuid, payload, reader, progress=job.update)
+
+                job.update("saving", 95)
+                ride.save()
+
+            job.update("complete", 100)
+            job.status = "complete"
+            print(f"GPX ingestion {job.job_id} complete: {job.elapsed}")
+
+        except Exception as e:
+            print({"error": str(e), "traceback": traceback.format_exc()})
+            job.error = str(e)
+            job.stage = "failed"
+            job.status = "failed"
+
+        finally:
+            job.timestamp_finished = time.time()
+            spool.close()
+
+    def shutdown(self, wait=False):
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
@@ -0,0 +1,131 @@
+"""
+TBOS API metrics
+"""
+
+from bisect import bisect_left
+from contextlib import contextmanager
+import threading
+import time
+
+# bucket upper bounds, in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+
+    """
+    Fixed bucket histogram of observed values
+
+    Quantiles are estimated by linear interpolation within the bucket they fall in.
+    """
+
+    def __init__(self, name, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = None
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        idx = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[idx] += 1
+            self.count += 1
+            self.sum += value
+            if self.max is None or value > self.max:
+                self.max = value
+
+    def quantile(self, q):
+
+        """
+        Estimate quantile q, 0.0 - 1.0, of observed values
+        """
+
+        if self.count == 0:
+            return None
+
+        rank = q * self.count
+        cumulative = 0
+        for idx, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                lower = self.buckets[idx - 1] if idx > 0 else 0.0
+                upper = self.buckets[idx] if idx < len(self.buckets) else self.max
+                return lower + (upper - lower) * ((rank - cumulative) / count)
+            cumulative += count
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else None,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], self.counts)),
+        }
+
+
+class Metrics:
+
+    """
+    Registry of named stage timers, each backed by a Histogram
+    """
+
+    def __init__(self, prefix="tbos_stage_seconds", buckets=DEFAULT_BUCKETS):
+        self.prefix = prefix
+        self.buckets = buckets
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(name, Histogram(name, buckets=self.buckets))
+        return histogram
+
+    def observe(self, name, value):
+        self.histogram(name).observe(value)
+
+    @contextmanager
+    def timer(self, name):
+
+        """
+        Context manager to time a named stage
+        """
+
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t0)
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+
+    def to_dict(self):
+        return {name: histogram.to_dict() for name, histogram in sorted(self.histograms.items())}
+
+    def to_prometheus(self):
+
+        """
+        Return histograms in Prometheus text exposition format
+        """
+
+        lines = [
+            f"# HELP {self.prefix} TBOS stage latency in seconds",
+            f"# TYPE {self.prefix} histogram",
+        ]
+        for name, histogram in sorted(self.histograms.items()):
+            cumulative = 0
+            for bound, count in zip(list(histogram.buckets) + ["+Inf"], histogram.counts):
+                cumulative += count
+                lines.append(f'{self.prefix}_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'{self.prefix}_sum{{stage="{name}"}} {histogram.sum}')
+            lines.append(f'{self.prefix}_count{{stage="{name}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
@@ -3,12 +3,15 @@ TBOS API models
 """
 
 import ast
+from bisect import bisect_right
 from collections import namedtuple
+import copy
 import datetime
 import json
 import os
 import random
 
+import numpy as np
 import pandas as pd
 import serial
 import time
@@ -17,20 +20,30 @@ import uuid
 
 import boto3
 import flask
-import geopy.distance as geopy_distance
-from gpx_converter import Converter
 from marshmallow.decorators import pre_dump, pre_load
 from marshmallow import fields
 from marshmallow_sqlalchemy import SQLAlchemyAutoSchema, auto_field
 
 import pyboard
 from rshell.main import is_micropython_usb_device
-from sqlalchemy import asc, desc, ForeignKey
-from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import relationship
+from sqlalchemy import and_, desc, event, ForeignKey, func, or_
+from sqlalchemy.orm import relationship, validates
+from sqlalchemy.orm.attributes import set_committed_value
 import sqlite3
 
-from api.utils import parse_query_payload
+from api.downsample import select_indices
+from api.geo import TrackPositioner, douglas_peucker_importance, meters_per_pixel, simplify, step_distances
+from api.gpx import (
+    POINT_DTYPES,
+    RESAMPLED_COLUMNS,
+    decode_track,
+    encode_track,
+    parse_gpx,
+    resample_track,
+    summarize_track,
+)
+from api.scheduler import PRIORITY_HIGH, PRIORITY_LOW
+from api.utils import parse_query_payload, validate_max_points
 from .db import db
 from .exceptions import PybReplCmdError, PybReplRespError
 
@@ -47,7 +60,16 @@ class PyboardClient:
     Client to interface with Pyboard via pyboard / rshell
     """
 
-    def __init__(self):
+    def __init__(self, pyb=None):
+
+        # set serial timeouts
+        self.serial_timeout = 20
+
+        # use already open connection, e.g. from DeviceManager
+        if pyb is not None:
+            self.pyb = pyb
+            self.pyboard_port = pyb.serial.port
+            return
 
         # DEBUG
         t0 = time.time()
@@ -55,9 +77,6 @@ class PyboardClient:
         # automatically detect port
         self.pyboard_port = self.detect_pyboard_port()
 
-        # set serial timeouts
-        self.serial_timeout = 20
-
         # setup pyb interface
         try:
             self.pyb = pyboard.Pyboard(self.pyboard_port, 115200)
@@ -91,30 +110,45 @@ class PyboardClient:
 
         return self.execute([("from main import repl_ping", None), ("repl_ping()", "string")], resp_idx=0)
 
-    def execute(self, cmds, resp_idx=None, debug=True):
+    def execute(self, cmds, resp_idx=None, debug=True, batch=True):
 
         """
         Issue passed command(s), aggregating responses and returning
+
+        Multiple commands are sent as one batch frame, a JSON array the embedded controller runs in sequence,
+        answered with one array of responses, so cost one round trip.
+
         :param cmds: list of commands (each a dict)
         :param resp_ids: int, optional, if present return only that response from the response list
+        :param batch: bool, send multiple commands as one batch frame, else one round trip per command
         """
 
-        # loop through commands, execute, and handle response
-        responses = []
-
-        for cmd in cmds:
+        # send multiple commands as one batch frame
+        if batch and len(cmds) > 1:
             try:
+                responses = self.write_serial(list(cmds))
+                if debug:
+                    print(responses)
+            except Exception as e:
+                raise Exception("ERROR WITH SERIAL JOB WRITE") from e  # TODO: error handling for bad serial write
 
-                response = self.write_serial(cmd)
+        # else, loop through commands, execute, and handle response
+        else:
+            responses = []
 
-                if debug:
-                    print(response)
+            for cmd in cmds:
+                try:
 
-                # append to responses
-                responses.append(response)
+                    response = self.write_serial(cmd)
 
-            except Exception as e:
-                raise Exception("ERROR WITH SERIAL JOB WRITE")  # TODO: error handling for bad serial write
+                    if debug:
+                        print(response)
+
+                    # append to responses
+                    responses.append(response)
+
+                except Exception as e:
+                    raise Exception("ERROR WITH SERIAL JOB WRITE") from e  # TODO: error handling for bad serial write
 
         # return responses
         if resp_idx is not None:
@@ -141,11 +175,12 @@ class PyboardClient:
         """
         Write serial data to pyboard, assuming all writes will be encoded JSON
 
-        :param msg_dict: dictionary to write
+        :param msg_dict: dictionary to write, or list of dictionaries as a batch frame
         """
 
         # append sender
-        msg_dict["sender"] = "client"
+        for msg in msg_dict if isinstance(msg_dict, list) else [msg_dict]:
+            msg["sender"] = "client"
 
         # clear buffer
         self.pyb.serial.flushInput()
@@ -196,10 +231,11 @@ class PyboardClient:
             response = response.rstrip("EOM")
             response = json.loads(response)
 
-            # note handled error
-            if response.get("error", None) is not None:
-                # print(f"ERROR DETECTED: {response['error']}")
-                raise Exception({"response_error": response["error"]})
+            # note handled error, from any response in a batch frame
+            for item in response if isinstance(response, list) else [response]:
+                if item.get("error", None) is not None:
+                    # print(f"ERROR DETECTED: {item['error']}")
+                    raise Exception({"response_error": item["error"]})
 
         except Exception as e:
             print(raw_response)
@@ -263,11 +299,14 @@ class Bike(db.Model):
             # set self to current and commit
             self.is_current = True
             app.db.session.commit()
-            return True
         except Exception as e:
             app.db.session.rollback()
             raise e
 
+        # reload active context
+        app.active.invalidate()
+        return True
+
     @classmethod
     def current(cls):
         """
@@ -277,9 +316,16 @@ class Bike(db.Model):
 
     @property
     def _config(self):
-        return json.loads(
-            json.dumps(self.config), object_hook=lambda d: namedtuple("BikeConfig", d.keys())(*d.values())
-        )
+
+        """
+        Config parsed as namedtuples, parsed once per instance
+        """
+
+        if getattr(self, "_parsed_config", None) is None:
+            self._parsed_config = json.loads(
+                json.dumps(self.config), object_hook=lambda d: namedtuple("BikeConfig", d.keys())(*d.values())
+            )
+        return self._parsed_config
 
     @property
     def is_virtual(self):
@@ -320,10 +366,12 @@ class Bike(db.Model):
         # app.db.session.commit()
         return virtual_status
 
-    def get_status(self, raise_exceptions=False, simulate_rpm=None):
+    def get_status(self, raise_exceptions=False, simulate_rpm=None, lcd=None):
 
         """
         Get status report from embedded controller about Bike
+
+        :param lcd: optional tuple, (l1, l2) written to the LCD in the same batch frame as the status request
         """
 
         # create and run job
@@ -333,34 +381,67 @@ class Bike(db.Model):
             if self.last_status is None:
                 response = self._generate_virtual_status()
             else:
-                response = self.last_status
+                # copy, as the sampler's detached Bike is shared across threads
+                response = copy.deepcopy(self.last_status)
             # random rpm
             response["rpm"]["rpm"] = self.random_virtual_rpm
 
         else:
-            response = PybJobQueue.create_and_run_job(
-                [
-                    {
-                        "level": None,
-                        "lower_bound": self._config.rm.lower_bound,
-                        "upper_bound": self._config.rm.upper_bound,
-                    }
-                ],
-                resp_idx=0,
-                raise_exceptions=raise_exceptions,
-            )
+            cmds = [
+                {
+                    "level": None,
+                    "lower_bound": self._config.rm.lower_bound,
+                    "upper_bound": self._config.rm.upper_bound,
+                }
+            ]
+
+            # LCD last, as the embedded controller shows the last request's lines
+            if lcd is not None:
+                l1, l2 = lcd
+                cmds.append({"lcd": {"l1": l1, "l2": l2}})
+
+            response = app.scheduler.run_job(cmds, resp_idx=0, raise_exceptions=raise_exceptions)
 
         # update level
         self._level = response["rm"]["level"]
 
+        # publish as latest sample
+        app.sampler.publish(self.bike_uuid, response)
+
         # DEBUG: artificially simulate rpm
         if simulate_rpm is not None:
             response["rpm"]["rpm"] = simulate_rpm
 
-        # save to db
-        self.last_status = response
-        app.db.session.add(self)
-        app.db.session.commit()
+        # queue save to db
+        app.persistence.update(self, last_status=response)
+
+        # return
+        return response
+
+    def get_sampled_status(self, max_age=None, raise_exceptions=False, simulate_rpm=None):
+
+        """
+        Get latest status from device sampler, without waiting on embedded controller
+
+        Falls back to get_status() if the sampler has no sample for this Bike, younger than max_age seconds.
+        """
+
+        sample = app.sampler.get_latest(self.bike_uuid, max_age=max_age)
+        if sample is None:
+            print("no device sample available, retrieving")
+            return self.get_status(raise_exceptions=raise_exceptions, simulate_rpm=simulate_rpm)
+
+        # copy, as samples are shared
+        response = copy.deepcopy(sample.status)
+
+        # update level, and last status if cleared, in memory only as the sampler persists it
+        self._level = response["rm"]["level"]
+        if self.last_status is None:
+            set_committed_value(self, "last_status", copy.deepcopy(sample.status))
+
+        # DEBUG: artificially simulate rpm
+        if simulate_rpm is not None:
+            response["rpm"]["rpm"] = simulate_rpm
 
         # return
         return response
@@ -375,42 +456,44 @@ class Bike(db.Model):
             raise Exception(f"level {level} is not between 0 to 20")
 
         # create and run job
-        t0 = time.time()
-        if self.is_virtual:
-            time.sleep(abs(self.last_status["rm"]["level"] - level))
-            response = self._generate_virtual_status(level)
-        else:
+        with app.metrics.timer("level_adjust"):
+            if self.is_virtual:
+                time.sleep(abs(self.level - level))
+                response = self._generate_virtual_status(level)
+            else:
 
-            # get explicit target is present
-            print(f"DEBUG: level from adjust_level: {level}")
-            explicit_target = self.config["rm"].get("explicit_targets")[int(level) - 1]
-            print(f"EXPLICIT TARGET: {explicit_target}")
-
-            # send job
-            response = PybJobQueue.create_and_run_job(
-                [
-                    {
-                        "level": level,
-                        "lower_bound": self._config.rm.lower_bound,
-                        "upper_bound": self._config.rm.upper_bound,
-                        "pwm": self._config.rm.pwm_level,
-                        "sweep_delay": self._config.rm.sweep_delay,
-                        "settle_threshold": self._config.rm.settled_threshold,
-                        "explicit_target": explicit_target,
-                    }
-                ],
-                resp_idx=0,
-                raise_exceptions=raise_exceptions,
-            )
-        print(f"level adjust elapsed: {time.time()-t0}")
+                # get explicit target is present
+                print(f"DEBUG: level from adjust_level: {level}")
+                explicit_target = self.config["rm"].get("explicit_targets")[int(level) - 1]
+                print(f"EXPLICIT TARGET: {explicit_target}")
+
+                # send job, ahead of status polling, replacing any level change still queued
+                response = app.scheduler.run_job(
+                    [
+                        {
+                            "level": level,
+                            "lower_bound": self._config.rm.lower_bound,
+                            "upper_bound": self._config.rm.upper_bound,
+                            "pwm": self._config.rm.pwm_level,
+                            "sweep_delay": self._config.rm.sweep_delay,
+                            "settle_threshold": self._config.rm.settled_threshold,
+                            "explicit_target": explicit_target,
+                        }
+                    ],
+                    resp_idx=0,
+                    priority=PRIORITY_HIGH,
+                    key="level",
+                    raise_exceptions=raise_exceptions,
+                )
 
         # update level
         self._level = response["rm"]["level"]
 
-        # save to db
-        self.last_status = response
-        app.db.session.add(self)
-        app.db.session.commit()
+        # publish as latest sample
+        app.sampler.publish(self.bike_uuid, response)
+
+        # queue save to db
+        app.persistence.update(self, last_status=response)
 
         # return
         return response
@@ -458,6 +541,40 @@ class Bike(db.Model):
         return response
 
 
+# per second arrays of a Ride, see Ride.parse_recorded_timeseries()
+RecordedTimeseries = namedtuple("RecordedTimeseries", ["program", "recorded", "rpm", "mph"])
+
+
+class ProgramIndex:
+
+    """
+    Program segments compiled for lookup by mark
+
+    Segment starts are sorted once, so a lookup is a bisect rather than a scan of the program.  Windows are
+    expected to be non-overlapping, as generated.
+    """
+
+    def __init__(self, program):
+        order = sorted(range(len(program)), key=lambda seg_num: (program[seg_num][1][0], seg_num))
+        self.starts = [program[seg_num][1][0] for seg_num in order]
+        self.ends = [program[seg_num][1][1] for seg_num in order]
+        self.seg_nums = order
+
+    def __len__(self):
+        return len(self.seg_nums)
+
+    def lookup(self, mark):
+
+        """
+        Return segment number containing mark, or None
+        """
+
+        idx = bisect_right(self.starts, mark) - 1
+        if idx >= 0 and mark < self.ends[idx]:
+            return self.seg_nums[idx]
+        return None
+
+
 class Ride(db.Model):
 
     """
@@ -475,41 +592,62 @@ class Ride(db.Model):
     program = db.Column(db.JSON, nullable=True)
     last_segment = db.Column(db.JSON, nullable=True)
 
+    # summary, set at creation, see api.gpx.summarize_track()
+    ride_type = db.Column(db.String, nullable=False, default="random_duration")
+    point_count = db.Column(db.Integer, nullable=True)
+    total_distance = db.Column(db.Float, nullable=False, default=0.0)
+    bbox = db.Column(db.JSON, nullable=True)
+    elevation_gain = db.Column(db.Float, nullable=True)
+
     heartbeats = relationship("Heartbeat", back_populates="ride")
 
+    @validates("program")
+    def validate_program(self, key, program):
+
+        """
+        Drop compiled program index when program is set
+        """
+
+        self.__dict__.pop("_program_index", None)
+        return program
+
     @property
-    def total_distance(self):
+    def program_index(self):
 
         """
-        If GPX ride, provide total distance
+        Return program compiled for segment lookup, built once per instance
+
+        :return: ProgramIndex, or None if no program
         """
-        if self.gpx_df is not None:
-            return self.gpx_df.iloc[-1].cum_distance
-        else:
-            return 0.0
+
+        if "_program_index" not in self.__dict__:
+            self._program_index = ProgramIndex(self.program) if self.program is not None else None
+        return self._program_index
+
+    @property
+    def gpx_track(self):
+
+        """
+        Return GPX track as arrays, via the process-wide track cache
+
+        :return: Track, or None if not a GPX ride
+        """
+
+        return app.gpx_cache.get(str(self.ride_uuid), RideTrack.load_track)
 
     @property
     def gpx_df(self):
 
         """
-        Return GPX data as parsed dataframe
+        Return GPX track points as dataframe
         """
 
-        # if not yet retrieved, retrieve
-        if getattr(self, "_gpx_df", None) is None:
-            print("loading GPX data as dataframe")
-            df = pd.read_sql(
-                f"""
-                select * from gpx_data
-                where ride_uuid='{str(self.ride_uuid)}'
-                order by time;
-                """,
-                con=db.engine,
+        # if not yet retrieved, build from track
+        if "_gpx_df" not in self.__dict__:
+            track = self.gpx_track
+            self._gpx_df = (
+                pd.DataFrame({name: getattr(track, name) for name in POINT_DTYPES}) if track is not None else None
             )
-            if len(df) == 0:
-                self._gpx_df = None
-            else:
-                self._gpx_df = df
 
         return self._gpx_df
 
@@ -519,33 +657,97 @@ class Ride(db.Model):
         Generate data for front-end maps from GPX dataset
         """
 
-        if self.gpx_df is None:
+        if self.ride_type != "gpx":
             return None
 
-        # get bounding box for all points
-        bbox = [
-            [self.gpx_df.latitude.max(), self.gpx_df.longitude.min()],
-            [self.gpx_df.latitude.min(), self.gpx_df.longitude.max()],
-        ]
-
-        # get center point
+        # get center point of bounding box for all points
+        bbox = self.bbox
         cp = ((bbox[0][0] + bbox[1][0]) / 2, (bbox[1][1] + bbox[0][1]) / 2)
 
         # initial marker
-        marker = [self.gpx_df.iloc[0].latitude, self.gpx_df.iloc[0].longitude]
+        track = self.gpx_track
+        marker = [float(track.latitude[0]), float(track.longitude[0])]
+
+        # route points are retrieved separately, simplified for zoom, see get_gpx_route()
+        return {"bbox": bbox, "cp": cp, "marker": marker, "point_count": self.point_count}
+
+    def get_gpx_route(self, zoom=None, max_points=None):
+
+        """
+        Return GPX route simplified for map rendering
+
+        Points are kept by Douglas-Peucker importance, computed at ingest: at a zoom level, points that deviate
+        from the simplified route by less than a pixel are dropped; max_points then keeps only the most
+        important points.
+
+        :param zoom: int, map zoom level
+        :param max_points: int, maximum points to return
+        """
 
-        # all points
-        route_points = [[row.latitude, row.longitude] for row in self.gpx_df.itertuples()]
+        track = self.gpx_track
+        if track is None:
+            return None
+
+        # tolerance of one pixel at zoom, at center of route
+        tolerance = 0.0
+        if zoom is not None:
+            latitude = (float(track.latitude.max()) + float(track.latitude.min())) / 2
+            tolerance = float(meters_per_pixel(zoom, latitude))
 
-        return {"bbox": bbox, "cp": cp, "marker": marker, "route_points": route_points}
+        kept = simplify(track.importance, tolerance=tolerance, max_points=max_points)
+        return {
+            "zoom": zoom,
+            "tolerance": tolerance,
+            "point_count": len(track.latitude),
+            "route_points": np.column_stack([track.latitude[kept], track.longitude[kept]]).tolist(),
+        }
 
     @property
-    def ride_type(self):
+    def gpx_positioner(self):
+
+        """
+        Positioner over the 1 Hz resampled GPX track, cached on instance
+
+        :return: TrackPositioner, or None if not a GPX ride
+        """
+
+        if "_gpx_positioner" not in self.__dict__:
+            track = self.gpx_track
+            self._gpx_positioner = (
+                TrackPositioner(
+                    track.resampled_cum_distance,
+                    track.resampled_latitude,
+                    track.resampled_longitude,
+                    altitude=track.resampled_altitude,
+                )
+                if track is not None
+                else None
+            )
+        return self._gpx_positioner
 
-        ride_type = "random_duration"
-        if self.gpx_df is not None:
-            ride_type = "gpx"
-        return ride_type
+    def get_gpx_position_at_mark(self, mark):
+
+        """
+        Return GPX track position at a second of the ride
+
+        :param mark: seconds since start of ride
+        :return: TrackPosition, or None if not a GPX ride
+        """
+
+        positioner = self.gpx_positioner
+        return positioner.at_mark(mark) if positioner is not None else None
+
+    def get_gpx_position_at_distance(self, distance):
+
+        """
+        Return GPX track position at a distance along the track
+
+        :param distance: float, feet since start of ride
+        :return: TrackPosition, or None if not a GPX ride
+        """
+
+        positioner = self.gpx_positioner
+        return positioner.at_distance(distance) if positioner is not None else None
 
     def set_as_current(self):
 
@@ -568,11 +770,16 @@ class Ride(db.Model):
             # set self to current and commit
             self.is_current = True
             app.db.session.commit()
-            return True
         except Exception as e:
             app.db.session.rollback()
             raise e
 
+        # stop running previous ride, reload active context, and seed timeseries buffer
+        app.ride_runner.stop()
+        app.active.invalidate()
+        app.timeseries.seed(self)
+        return True
+
     @classmethod
     def current(cls):
         """
@@ -580,14 +787,16 @@ class Ride(db.Model):
         """
         return cls.query.filter(cls.is_current == True).one_or_none()
 
-    def serialize(self, include_heartbeats=False):
+    def serialize(self, include_heartbeats=False, max_points=None):
 
         """
         Custom serialization for Ride
+
+        :param max_points: int, downsample included heartbeats to at most this many
         """
 
         # init base as serialized data from db
-        ser = RideSchema().dump(self)
+        ser = ride_schema.dump(self)
 
         # add remaining node
         remaining = self.duration - self.completed
@@ -595,16 +804,31 @@ class Ride(db.Model):
             remaining = 0
         ser["remaining"] = remaining
 
-        # include heartbeats data
+        # include heartbeats data, flushing any pending
         if include_heartbeats:
+            app.persistence.flush()
             hb_data = [(hb.timestamp_added, hb.level, hb.rpm, hb.mark) for hb in self.heartbeats]
+            if max_points is not None and len(hb_data) > max_points:
+                indices = select_indices([[hb[1] for hb in hb_data], [hb[2] for hb in hb_data]], max_points)
+                hb_data = [hb_data[idx] for idx in indices]
             ser["hb_data"] = hb_data
 
         # return
         return ser
 
+    @property
+    def timeseries(self):
+
+        """
+        Return in-process timeseries buffer for Ride
+        """
+
+        return app.timeseries.get(self)
+
     def save(self):
         try:
+            # flush pending writes first, so they do not overwrite these changes
+            app.persistence.flush()
             app.db.session.add(self)
             app.db.session.commit()
         except Exception as e:
@@ -706,39 +930,32 @@ class Ride(db.Model):
 
         print("generating program for GPX data")
 
-        # calc altitude delta
-        step_distance_mean = gpx_df.step_distance.mean()
-        gpx_df["altitude_delta"] = 0.0
-        for i, r in enumerate(gpx_df.itertuples()):
-
-            # first step
-            if i == 0:
-                ad = 0.0
-
-            # no movement
-            elif r.step_distance < 3:
-                ad = 0.0
-
-            else:
-                lr = gpx_df.iloc[i - 1]
-                ad = round((r.altitude - lr.altitude) * 2.2, 2)
-                # ad = round(((r.altitude - lr.altitude) * 2.2) * ((step_distance_mean - r.step_distance) / 10 + 1), 2)
-
-            # set ad
-            gpx_df.loc[i, "altitude_delta"] = ad
+        # calc altitude delta, zero for first step and steps without movement
+        altitude = gpx_df.altitude.to_numpy(dtype=float)
+        step_distance = gpx_df.step_distance.to_numpy(dtype=float)
+        altitude_delta = np.zeros(len(altitude))
+        altitude_delta[1:] = np.round(np.diff(altitude) * 2.2, 2)
+        altitude_delta[~(step_distance >= 3)] = 0.0
+        altitude_delta[0] = 0.0
+        gpx_df["altitude_delta"] = altitude_delta
+
+        # bin by mark into chunks of segment_seconds; these become segments
+        segment_seconds = max(1, int(duration / 200))
+        starts = np.arange(0, int(duration), segment_seconds)
+        order = np.argsort(gpx_df.mark.to_numpy(), kind="stable")
+        marks = gpx_df.mark.to_numpy()[order]
+        deltas = altitude_delta[order]
+        left = np.searchsorted(marks, starts, side="left")
+        right = np.searchsorted(marks, starts + segment_seconds, side="left")
 
-        # loop through duration in chunks of segment_seconds; these become segments
-        segment_seconds = int(duration / 200)
         program = []
-        for x in range(0, int(duration), segment_seconds):
+        for x, start, end in zip(starts.tolist(), left.tolist(), right.tolist()):
 
             # get time span
             time_span = [x, x + segment_seconds]
 
-            # get cumulative altitude change
-            cum_altitude_delta = gpx_df[
-                (gpx_df.mark >= time_span[0]) & (gpx_df.mark < time_span[1])
-            ].altitude_delta.sum()
+            # get cumulative altitude change, summed pairwise as numpy does for a contiguous slice
+            cum_altitude_delta = deltas[start:end].sum()
 
             # equivalent level
             level = round(cum_altitude_delta, 0) + 8
@@ -798,21 +1015,18 @@ class Ride(db.Model):
         Extract segment from program
         """
 
-        t0 = time.time()
         segment = {"num": None, "level": None, "window": None, "is_new": False}
 
-        for seg_num, _segment in enumerate(self.program):
-            seg_level, seg_window = _segment[0], _segment[1]
-            if mark >= seg_window[0] and mark < seg_window[1]:
-                print(f"segment match for mark: {mark} in {seg_window}")
-                segment.update({"num": seg_num, "level": seg_level, "window": seg_window})
+        seg_num = self.program_index.lookup(mark) if self.program_index is not None else None
+        if seg_num is not None:
+            seg_level, seg_window = self.program[seg_num][0], self.program[seg_num][1]
+            segment.update({"num": seg_num, "level": seg_level, "window": seg_window})
 
-                # determine if new segment
-                if self.last_segment is None or segment["num"] != self.last_segment["num"]:
-                    segment["is_new"] = True
+            # determine if new segment
+            if self.last_segment is None or segment["num"] != self.last_segment["num"]:
+                segment["is_new"] = True
 
         # return segment
-        print(f"get_program_segment(): {time.time()-t0}")
         return segment
 
     def parse_recorded_timeseries(self):
@@ -820,88 +1034,59 @@ class Ride(db.Model):
         """
         Return program and recorded information by second
 
-        :return: [(program_level, recorded_level, rpm)], where index of list is second
+        Program segments are expanded with np.repeat and heartbeats scattered by mark, where the index of each
+        array is the second of the ride, less one.  Missing values are NaN; filling is left to the caller.
+
+        :return: RecordedTimeseries of float arrays, (program, recorded, rpm, mph)
         """
 
         t0 = time.time()
 
-        # init output
-        output = [[None, None, None, None] for x in range(0, int(self.duration))]
-
-        # handle no program
+        # expand program to per second
         if self.program is None:
-            pass
-            # output.extend([[None, None, None, None] for _ in range(0, len(self.heartbeats))])
-
-        # else, loop through segments and extend to per second
+            program = np.full(int(self.duration), np.nan)
         else:
-            output = []
-            for segment in self.program:
-                output.extend([[segment[0], None, None, None] for _ in range(segment[1][0], segment[1][1])])
-
-        # # DEBUG -- method 1: SQLAlchemy
-        # # interleave heartbeats
-        # _t0 = time.time()
-        # hbs = self.heartbeats
-        # print(f"hb retrieve: {time.time() - _t0}")
-        # _t1 = time.time()
-        # for hb in hbs:
-        #     try:
-        #         output[hb.mark - 1][1] = hb.level
-        #         output[hb.mark - 1][2] = hb.rpm
-        #         output[hb.mark - 1][3] = hb.mph
-        #     except:
-        #         output.append([hb.mark, hb.level, hb.rpm, hb.mph])
-        # print(f"interleave: {time.time() - _t1}")
-
-        # # DEBUG -- method 2: raw SQL
-        # # interleave heartbeats
-        # _t0 = time.time()
-        # hbs = db.session.execute(
-        #     f"""select level, rpm, data, mark from heartbeat where ride_uuid = '{str(self.ride_uuid)}';"""
-        # ).fetchall()
-        # print(f"hb retrieve: {time.time() - _t0}")
-        # _t1 = time.time()
-        # for hb in hbs:
-        #     try:
-        #         output[hb.mark - 1][1] = hb.level
-        #         output[hb.mark - 1][2] = hb.rpm
-        #         output[hb.mark - 1][3] = json.loads(hb.data).get("speed", {}).get("mph")
-        #     except:
-        #         output.append([hb.mark, hb.level, hb.rpm, hb.mph])
-        # print(f"interleave: {time.time() - _t1}")
-
-        # # DEBUG -- method 3: Pandas
-        # interleave heartbeats
-        _t0 = time.time()
+            levels = np.array([segment[0] for segment in self.program], dtype=float)
+            seconds = np.array([segment[1][1] - segment[1][0] for segment in self.program], dtype=int)
+            program = np.repeat(levels, seconds)
+
+        # retrieve heartbeats, flushing any pending
+        app.persistence.flush()
         hbs = pd.read_sql(
             f"""
-            select level, rpm, data, mark from heartbeat where ride_uuid = '{str(self.ride_uuid)}';
+            select level, rpm, json_extract(data, '$.speed.mph') as mph, mark
+            from heartbeat where ride_uuid = '{str(self.ride_uuid)}';
             """,
             db.engine,
         )
-        print(f"hb retrieve: {time.time() - _t0}")
-        _t1 = time.time()
-        hbs["mph"] = hbs.data.apply(lambda x: json.loads(x).get("speed", {}).get("mph"))
-        for hb in hbs.itertuples():
-            try:
-                output[hb.mark - 1][1] = hb.level
-                output[hb.mark - 1][2] = hb.rpm
-                output[hb.mark - 1][3] = hb.mph
-            except:
-                output.append([hb.mark, hb.level, hb.rpm, hb.mph])
-        print(f"interleave: {time.time() - _t1}")
+        marks = hbs["mark"].to_numpy(dtype=float)
+        valid = ~np.isnan(marks) & (marks >= 1)
+        idx = marks[valid].astype(int) - 1
+
+        # pad to heartbeats beyond program
+        length = max(len(program), int(idx.max()) + 1 if len(idx) else 0)
+        program = np.concatenate([program, np.full(length - len(program), np.nan)])
+
+        # scatter heartbeats by mark, where later heartbeats for a mark win
+        recorded = {}
+        for col in ["level", "rpm", "mph"]:
+            values = np.full(length, np.nan)
+            values[idx] = hbs[col].to_numpy(dtype=float)[valid]
+            recorded[col] = values
 
         print(f"full level data elapsed: {time.time()-t0}")
-        return output
+        return RecordedTimeseries(program, recorded["level"], recorded["rpm"], recorded["mph"])
 
-    def get_bucketed_level_data(self, buckets=60):
+    def get_bucketed_level_data(self, buckets=60, mode="lttb"):
 
         """
-        Bucket level data to provide n buckets of data
+        Bucket level data to provide at most n points per chart
+
+        :param buckets: int, maximum points per chart
+        :param mode: str, downsampling mode, "lttb" or "minmax"
         """
 
-        pass
+        return self.timeseries.chart_data(self.completed, max_points=buckets, mode=mode)
 
     @classmethod
     def create_random_duration_ride(cls, ride_uuid, payload, request):
@@ -933,71 +1118,72 @@ class Ride(db.Model):
             name=payload.get("name", None),
             duration=duration,
             program=program,
+            ride_type="random_duration",
         )
 
     @classmethod
-    def create_gpx_ride(cls, ride_uuid, payload, request):
+    def create_gpx_ride(cls, ride_uuid, payload, fileobj, progress=None):
 
         """
         Create GPX path ride
 
+        :param fileobj: binary file-like object, GPX file
+        :param progress: optional callable, progress(stage, percent) as each stage of ingestion starts
         :return: Ride
         """
 
-        # download file to tmp, then load as dataframe in memory
-        print("saving GPX to disk and loading as dataframe")
-        uf = request.files["gpx_file"]
-        tmp_filepath = f"/tmp/{uf.filename}"
-        with open(tmp_filepath, "wb") as f:
-            f.write(uf.read())
-        gpx_df = Converter(input_file=tmp_filepath).gpx_to_dataframe()
-        os.remove(tmp_filepath)
+        progress = progress or (lambda stage, percent=None: None)
+
+        # parse uploaded GPX as streamed, then load as dataframe
+        print("parsing GPX and loading as dataframe")
+        progress("parsing", 0)
+        track = parse_gpx(fileobj)
+        gpx_df = pd.DataFrame(track._asdict())
         print(f"GPX loaded with {len(gpx_df)} data points")
 
         # convert time to timestamp
         # NOTE: this sets to seconds, not milliseconds
-        gpx_df.time = gpx_df.time.apply(lambda x: int(x.timestamp()))
+        gpx_df.time = np.floor(gpx_df.time).astype(int)
+
+        # fill missing elevations from neighboring points
+        gpx_df.altitude = gpx_df.altitude.ffill().bfill().fillna(0.0)
 
-        # NOTE: slowish, consider reworking
         # calculate step and cumulative distances
-        gpx_df["step_distance"] = 0.0
-        for i, r in enumerate(gpx_df.itertuples()):
-            if i == 0:
-                d = 0.0
-            else:
-                lr = gpx_df.iloc[i - 1]
-                d = geopy_distance.distance((lr.latitude, lr.longitude), (r.latitude, r.longitude)).feet
-            gpx_df.loc[i, "step_distance"] = d
+        progress("distances", 50)
+        gpx_df["step_distance"] = step_distances(
+            gpx_df.latitude.to_numpy(), gpx_df.longitude.to_numpy(), method=app.config["TBOS_GPX_DISTANCE_METHOD"]
+        )
         gpx_df["cum_distance"] = gpx_df.step_distance.cumsum()
 
+        # rank points for route simplification
+        progress("simplifying", 60)
+        gpx_df["importance"] = douglas_peucker_importance(gpx_df.latitude.to_numpy(), gpx_df.longitude.to_numpy())
+
         # set mark for aligning
         min_time = gpx_df.time.min()
         gpx_df["mark"] = gpx_df.time - min_time
         gpx_df.mark = gpx_df.mark.astype(int)
 
-        # add ride UUID
-        gpx_df["ride_uuid"] = ride_uuid
-
-        # mint uuids
-        gpx_df["point_uuid"] = [str(uuid.uuid4()) for x in range(0, len(gpx_df))]
-
-        # save rows to GPXData
-        gpx_df.to_sql("gpx_data", con=db.engine, index=False, if_exists="append")
+        # add track, saved with ride
+        db.session.add(RideTrack.from_dataframe(ride_uuid, gpx_df))
 
         # handle duration
         duration = int((gpx_df.time.max() - gpx_df.time.min()))
 
         # set program to NULL initially
+        progress("program", 85)
         level_low = int(payload.get("level_low", 1))
         level_high = int(payload.get("level_high", 1))
         program = cls.generate_program_from_gpx(gpx_df, duration, level_low=level_low, level_high=level_high)
 
-        # init and return ride
+        # init and return ride, with track summary
         return cls(
             ride_uuid=ride_uuid,
             name=payload.get("name", None),
             duration=duration,
             program=program,
+            ride_type="gpx",
+            **summarize_track(gpx_df.latitude, gpx_df.longitude, gpx_df.altitude, gpx_df.cum_distance.to_numpy()),
         )
 
 
@@ -1018,17 +1204,19 @@ class Heartbeat(db.Model):
     ride = relationship("Ride", back_populates="heartbeats")
 
     def save(self):
-        try:
 
-            # attempt extract of rm.level and rpm.rpm
-            self.level = self.data.get("rm", {}).get("level", None)
-            self.rpm = self.data.get("rpm", {}).get("rpm", None)
+        """
+        Queue insert of heartbeat via write-behind persistence
+        """
 
-            app.db.session.add(self)
-            app.db.session.commit()
-        except Exception as e:
-            app.db.session.rollback()
-            raise e
+        # attempt extract of rm.level and rpm.rpm
+        self.level = self.data.get("rm", {}).get("level", None)
+        self.rpm = self.data.get("rpm", {}).get("rpm", None)
+
+        if self.timestamp_added is None:
+            self.timestamp_added = timestamp_now()
+
+        app.persistence.insert(self)
 
     @property
     def mph(self):
@@ -1037,33 +1225,54 @@ class Heartbeat(db.Model):
     @classmethod
     def perform_heartbeat(cls, request):
 
+        """
+        Class method to perform heartbeat for a request, where POST requests update the Ride
+        """
+
+        if request.method == "POST":
+            payload = parse_query_payload(request)
+        else:
+            payload = request.json or {}
+        validate_max_points(payload.get("max_points"))
+
+        return cls.heartbeat(payload, update_ride=request.method == "POST")
+
+    @classmethod
+    def heartbeat(cls, payload, update_ride=True):
+
         """
         Class method to perform heartbeat
+
+        :param payload: dict, heartbeat payload, as posted to /api/heartbeat
+        :param update_ride: bool, update Ride completed and distance from payload
         """
 
         try:
 
             print("\n♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥")
 
-            hbt = time.time()
+            hbt = time.perf_counter()
 
             # init heartbeat
             response = {}
 
-            # get bike
-            bike = Bike.current()
+            # get bike and ride from active context
+            bike = app.active.get_bike()
+            ride = app.active.get_ride()
+            ride_type = app.active.ride_type
 
             # get bike status
-            tb0 = time.time()
-            simulate_rpm = request.json.get("simulate_rpm")
-            response.update(bike.get_status(raise_exceptions=True, simulate_rpm=simulate_rpm))
-            print(f"bike status elapsed: {time.time()-tb0}")
+            with app.metrics.timer("bike_status"):
+                simulate_rpm = payload.get("simulate_rpm")
+                response.update(
+                    bike.get_sampled_status(
+                        max_age=app.config["TBOS_SAMPLER_MAX_AGE"], raise_exceptions=True, simulate_rpm=simulate_rpm
+                    )
+                )
 
             # get ride status
-            tr0 = time.time()
-            ride = Ride.current()
-            response.update(ride.get_status(include_heartbeats=False))
-            print(f"ride status elapsed: {time.time() - tr0}")
+            with app.metrics.timer("ride_status"):
+                response.update(ride.get_status(include_heartbeats=False))
 
             # set speed in data
             if response["rpm"]["rpm"] == 0:
@@ -1071,118 +1280,83 @@ class Heartbeat(db.Model):
                 fps = 0
             else:
                 rpm, level = response["rpm"]["rpm"], response["rm"]["level"]
-                if ride.ride_type == "gpx":
+                if ride_type == "gpx":
                     level = 8 + (8 - level)  # invert resistance and hill (QUESTION: is this inversion right?)
                 mph = round(rpm / ((20 / level) * 2.5), 2)
                 fps = round(((5280 * mph) / 60 / 60), 2)
             response["speed"] = {"mph": mph, "fps": fps}
 
-            # if POST request, update Ride information
-            if request.method == "POST":
-                ta0 = time.time()
-                payload = parse_query_payload(request)
+            # update Ride information
+            if update_ride:
 
                 # update completed
                 prev_completed = ride.completed
-                ride.completed = payload["localRide"]["completed"]
+                completed = payload["localRide"]["completed"]
 
                 # handle program segment if program exists
-                segment = ride.handle_program_segment(response, bike)
-                ride.last_segment = segment
+                with app.metrics.timer("program_segment"):
+                    segment = ride.handle_program_segment(response, bike)
 
                 # bump cumulative distance
-                ride.cum_distance += (payload["localRide"]["completed"] - prev_completed) * response["speed"]["fps"]
-                print(f"new cumulative distance: {ride.cum_distance}")
+                cum_distance = ride.cum_distance + (completed - prev_completed) * response["speed"]["fps"]
+                print(f"new cumulative distance: {cum_distance}")
 
-                ride.save()
-                print(f"ride update elapsed: {time.time() - ta0}")
+                # queue save to db
+                with app.metrics.timer("ride_save"):
+                    app.persistence.update(ride, completed=completed, last_segment=segment, cum_distance=cum_distance)
+                    response["ride"].update(
+                        {"completed": completed, "cum_distance": cum_distance, "last_segment": segment}
+                    )
 
             # record heartbeat
-            thb0 = time.time()
-            hb = Heartbeat(hb_uuid=str(uuid.uuid4()), ride_uuid=ride.ride_uuid, data=response, mark=int(ride.completed))
-            hb.save()
-            print(f"heartbeat recorded elapsed: {time.time() - thb0}")
-
-            # prepare chart data
-            ride_data = ride.parse_recorded_timeseries()
-            labels = [f"{str(x)}s" for x in range(1, len(ride_data) + 1)]
-            level_datasets = [
-                {
-                    "label": "program",
-                    "borderColor": "deeppink",
-                    "borderWidth": 3,
-                    "data": [n[0] for n in ride_data],
-                },
-                {
-                    "label": "recorded",
-                    "borderColor": "rgba(0,255,0,0.7)",
-                    "backgroundColor": "rgba(0,255,0,0.3)",
-                    "borderWidth": 1,
-                    "data": [n[1] for n in ride_data],
-                    "fill": True,
-                },
-            ]
-            speed_datasets = [
-                {
-                    "label": "rpm",
-                    "borderColor": "blue",
-                    "borderWidth": 1,
-                    "data": [{0: None}.get(n[2], n[2]) for n in ride_data],
-                },
-                {
-                    "label": "mph",
-                    "borderColor": "orange",
-                    "borderWidth": 1,
-                    "data": [{0: None}.get(n[3], n[3]) for n in ride_data],
-                },
-            ]
+            with app.metrics.timer("heartbeat_insert"):
+                hb = Heartbeat(
+                    hb_uuid=str(uuid.uuid4()), ride_uuid=ride.ride_uuid, data=response, mark=int(ride.completed)
+                )
+                hb.save()
+                ride.timeseries.record(hb.mark, hb.level, hb.rpm, hb.mph)
+
+            # prepare chart data, only changes since client cursor if provided
+            with app.metrics.timer("chart_assembly"):
+                # downsampled charts are always sent whole
+                chart_cursor = payload.get("chart_cursor")
+                max_points = payload.get("max_points")
+                if chart_cursor is None or ride.timeseries.is_downsampled(max_points):
+                    response["chart_data"] = ride.timeseries.chart_data(
+                        ride.completed, max_points=max_points, mode=payload.get("downsample") or "lttb"
+                    )
+                else:
+                    response["chart_delta"] = ride.timeseries.chart_delta(chart_cursor, ride.completed)
 
-            # fill missing values up until ride.completed
-            for datasets in [level_datasets, speed_datasets]:
-                for dataset in datasets:
-                    j = None
-                    for i, x in enumerate(dataset["data"][: int(ride.completed)]):
-                        if x is not None:
-                            j = x
-                        elif x is None:
-                            dataset["data"][i] = j
+            # determine location and adjust level for GPX ride (TODO: move to method)
+            if ride_type == "gpx":
 
-            response["chart_data"] = {"labels": labels, "datasets": level_datasets, "speed_datasets": speed_datasets}
+                with app.metrics.timer("gpx_position"):
 
-            # determine location and adjust level for GPX ride (TODO: move to method)
-            if ride.ride_type == "gpx":
-
-                t10 = time.time()
-
-                # TODO: turn these into generic closest Lat/Lon point by time or distance
-                # determine ghost rider position
-                nearest_ghost_gpx_point = ride.gpx_df.iloc[
-                    (ride.gpx_df["mark"] - ride.completed).abs().argsort()[:1]
-                ].iloc[0]
-                ghost_lat, ghost_lon = nearest_ghost_gpx_point.latitude, nearest_ghost_gpx_point.longitude
-
-                # determine active rider position
-                nearest_gpx_point = ride.gpx_df.iloc[
-                    (ride.gpx_df["cum_distance"] - ride.cum_distance).abs().argsort()[:1]
-                ].iloc[0]
-                active_lat, active_lon = nearest_gpx_point.latitude, nearest_gpx_point.longitude
-                # /TODO: turn these into generic closest Lat/Lon point by time or distance
-
-                response["map"] = {
-                    "ghost_rider": {"latitude": ghost_lat, "longitude": ghost_lon},
-                    "active_rider": {"latitude": active_lat, "longitude": active_lon},
-                }
+                    # determine ghost rider position, by time, and active rider position, by distance
+                    ghost_position = ride.get_gpx_position_at_mark(ride.completed)
+                    active_position = ride.get_gpx_position_at_distance(ride.cum_distance)
 
-                # adjust level to match active rider against program for that location
-                active_rider_segment = ride.get_program_segment(nearest_gpx_point.mark)
-                print(f"rider positions elapsed: {time.time() - t10}")
+                    response["map"] = {
+                        rider: {
+                            "latitude": position.latitude,
+                            "longitude": position.longitude,
+                            "bearing": position.bearing,
+                        }
+                        for rider, position in (("ghost_rider", ghost_position), ("active_rider", active_position))
+                    }
+
+                    # adjust level to match active rider against program for that location
+                    active_rider_segment = ride.get_program_segment(active_position.mark)
 
                 # adjust level when active rider in location
                 if int(response["rm"]["level"]) != active_rider_segment["level"]:
                     bike.adjust_level(active_rider_segment["level"])
 
             # return
-            print(f"heartbeat elapsed: {time.time()-hbt}")
+            heartbeat_elapsed = time.perf_counter() - hbt
+            app.metrics.observe("heartbeat", heartbeat_elapsed)
+            print(f"heartbeat elapsed: {heartbeat_elapsed}")
             print("♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥♥\n")
             return response
 
@@ -1195,7 +1369,7 @@ class Heartbeat(db.Model):
 class PybJobQueue(db.Model):
 
     """
-    Model for queued pyboard commands
+    Model for pyboard commands, an audit log of jobs run by the DeviceScheduler, see api.scheduler
 
     Columns
         - cmds: JSON array of commands, identical to what clients.PyboardClient.execute() expects
@@ -1205,8 +1379,17 @@ class PybJobQueue(db.Model):
             - "success": job completed successfully
             - "failed": job failed
             - "cancelled": job was cancelled
+            - "superseded": job was replaced by a newer queued job with the same coalescing key, and not run
+        - elapsed: seconds the job ran on the device, if it ran
+
+    Rows are pruned in the background by JobRetention, see api.retention.
     """
 
+    __table_args__ = (
+        db.Index("ix_pyb_job_queue_status_timestamp_added", "status", "timestamp_added"),
+        db.Index("ix_pyb_job_queue_timestamp_added", "timestamp_added"),
+    )
+
     job_uuid = db.Column(db.String, primary_key=True, default=str(uuid.uuid4()))
     timestamp_added = db.Column(db.Integer, nullable=False, default=timestamp_now)
     cmds = db.Column(db.JSON, nullable=False)
@@ -1214,146 +1397,89 @@ class PybJobQueue(db.Model):
     resp_idx = db.Column(db.Integer, nullable=True)
     status = db.Column(db.String, default="queued", nullable=False)
     priority = db.Column(db.Integer, nullable=True, default=1)
+    elapsed = db.Column(db.Float, nullable=True)
 
     @classmethod
-    def count_running_jobs(cls):
+    def filtered(cls, statuses=None, since=None, until=None):
 
         """
-        Return count of running jobs
+        Query jobs by status, and timestamp_added from since (inclusive) until (exclusive), epoch seconds
         """
 
-        return cls.query.filter(cls.status == "running").count()
-
-    def execute(self, raise_exceptions=False):
-
-        """
-        Execute a job
-        """
-
-        # bail if status is not queued
-        if self.status != "queued":
-            raise Exception(f"job status is {self.status}, skipping execution")
-
-        # mark as running
-        self.status = "running"
-        app.db.session.commit()
-
-        # init PyboardClient
-        pc = PyboardClient()
-
-        try:
-
-            # execute
-            response = pc.execute(self.cmds, resp_idx=self.resp_idx)
-
-            # mark as successful
-            self.status = "success"
-            self.resps = response
-            app.db.session.commit()
-
-            # return response
-            return response
-
-        except Exception as e:
-
-            # mark as failed
-            self.status = "failed"
-            app.db.session.commit()
-
-            # raise exception or return None
-            if raise_exceptions:
-                raise e
-            else:
-                return None
+        query = cls.query
+        if statuses:
+            query = query.filter(cls.status.in_(statuses))
+        if since is not None:
+            query = query.filter(cls.timestamp_added >= since)
+        if until is not None:
+            query = query.filter(cls.timestamp_added < until)
+        return query
 
     @classmethod
-    def execute_queued(cls):
+    def page(cls, query, limit=100, cursor=None):
 
         """
-        Method to retrieve and execute all queued jobs
+        Return a page of jobs from query, newest first, keyset paginated on (timestamp_added, job_uuid)
+
+        :param cursor: str, next_cursor of the previous page
+        :return: tuple, (jobs, next_cursor), next_cursor None on the last page
         """
 
-        # retrieve jobs ordered by timestamp added
-        queued_jobs = cls.query.filter(cls.status == "queued").order_by(asc("timestamp_added")).all()
+        if cursor is not None:
+            timestamp_added, job_uuid = cursor.split(":", 1)
+            timestamp_added = int(timestamp_added)
+            query = query.filter(
+                or_(
+                    cls.timestamp_added < timestamp_added,
+                    and_(cls.timestamp_added == timestamp_added, cls.job_uuid < job_uuid),
+                )
+            )
 
-        # loop through and execute
-        for job in queued_jobs:
-            print(f"executing job: {job.job_uuid}")
-            job.execute()
+        # fetch one extra row to know if there is a next page
+        jobs = query.order_by(cls.timestamp_added.desc(), cls.job_uuid.desc()).limit(limit + 1).all()
+        next_cursor = None
+        if len(jobs) > limit:
+            jobs = jobs[:limit]
+            next_cursor = f"{jobs[-1].timestamp_added}:{jobs[-1].job_uuid}"
+        return jobs, next_cursor
 
     @classmethod
-    def create_and_run_job(cls, cmds, resp_idx=None, timeout=30, raise_exceptions=False):
+    def aggregate(cls, query):
 
         """
-        Method to:
-            1) create new job
-            2) wait for any "running" jobs to complete
-            3) execute job
-            4) return results
+        Return counts by status, and elapsed stats, for jobs from query
         """
 
-        # create new job
-        job = PybJobQueue(job_uuid=str(uuid.uuid4()), cmds=cmds, resp_idx=resp_idx, status="queued")
-        app.db.session.add(job)
-        app.db.session.commit()
-
-        # poll for other jobs to be complete
-        timeout_start = time.time()
-        while True:
+        counts = dict(query.with_entities(cls.status, func.count()).group_by(cls.status).all())
 
-            # if timeout, mark job as failed
-            if (time.time() - timeout_start) > timeout:
-                job.status = "failed"
-                app.db.session.add(job)
-                app.db.session.commit()
-                raise Exception("timeout reached for creating and running new job")  # TODO: custom exception
+        timed = query.filter(cls.elapsed.isnot(None))
+        count, mean, minimum, maximum = timed.with_entities(
+            func.count(), func.avg(cls.elapsed), func.min(cls.elapsed), func.max(cls.elapsed)
+        ).one()
+        elapsed = {"count": count, "mean": mean, "min": minimum, "max": maximum}
 
-            # check if no jobs running
-            if cls.count_running_jobs() == 0:
+        # quantiles by offset into jobs ordered by elapsed
+        for name, q in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99)):
+            row = None
+            if count:
+                row = timed.with_entities(cls.elapsed).order_by(cls.elapsed).offset(int(q * (count - 1))).first()
+            elapsed[name] = row[0] if row is not None else None
 
-                # execute job
-                try:
-                    response = job.execute(raise_exceptions=raise_exceptions)
-                    return response
-                except IntegrityError as integrity_error:
-                    print(str(integrity_error))
-                    app.db.session.rollback()
-                    time.sleep(0.1)
-
-            # else, continue to poll
-            else:
-                time.sleep(0.1)
+        return {"total": sum(counts.values()), "counts": counts, "elapsed": elapsed}
 
     @classmethod
     def stop_all_jobs(cls):
 
         """
-        Method to cancel all running jobs
-        """
-
-        all_jobs = cls.query.filter(cls.status.in_(["queued", "running"])).all()
-        for job in all_jobs:
-            job.status = "cancelled"
-            app.db.session.add(job)
-            app.db.session.commit()
-        return len(all_jobs)
-
-    @classmethod
-    def get_next_queued(self):
-
-        """
-        Method to return the next queued job
+        Method to cancel all queued jobs, and mark jobs left queued or running by a previous process as cancelled
         """
 
-        # get next, ordered by priority and timestamp
-        next = (
-            PybJobQueue.query.filter(PybJobQueue.status == "queueud")
-            .order_by(PybJobQueue.priority.desc())
-            .order_by(PybJobQueue.timestamp_added.asc())
-            .first()
+        count = app.scheduler.cancel_pending()
+        count += cls.query.filter(cls.status.in_(["queued", "running"])).update(
+            {"status": "cancelled"}, synchronize_session=False
         )
-
-        return next
+        app.db.session.commit()
+        return count
 
 
 class LCD:
@@ -1367,8 +1493,10 @@ class LCD:
         Explicit two line message
         """
 
-        response = PybJobQueue.create_and_run_job(
+        response = app.scheduler.run_job(
             [{"lcd": {"l1": l1, "l2": l2}}],
+            priority=PRIORITY_LOW,
+            key="lcd",
             raise_exceptions=raise_exceptions,
         )
         return response
@@ -1445,6 +1573,21 @@ class PollyTTS:
         return self.full_filepath
 
 
+###############################################
+# WRITE-BEHIND
+###############################################
+@event.listens_for(Bike, "load")
+@event.listens_for(Ride, "load")
+def apply_pending_on_load(instance, context):
+    app.persistence.apply_pending(instance)
+
+
+@event.listens_for(Bike, "refresh")
+@event.listens_for(Ride, "refresh")
+def apply_pending_on_refresh(instance, context, attrs):
+    app.persistence.apply_pending(instance, attrs)
+
+
 ###############################################
 # SCHEMAS
 ###############################################
@@ -1462,6 +1605,10 @@ class RideSchema(SQLAlchemyAutoSchema):
         load_instance = True
 
 
+# shared for serializing, as building schemas is not free
+ride_schema = RideSchema()
+
+
 class PybJobQueueSchema(SQLAlchemyAutoSchema):
     class Meta:
         model = PybJobQueue
@@ -1476,28 +1623,73 @@ class HeartbeatSchema(SQLAlchemyAutoSchema):
         load_instance = True
 
 
-class GPXData(db.Model):
+class RideTrack(db.Model):
 
     """
-    Model for GPX data for a ride
+    Model for GPX track of a ride, one row per ride
+
+    Each column holds the whole track as a zlib compressed, little-endian array, see api.gpx.TRACK_DTYPES.
     """
 
-    __tablename__ = "gpx_data"
+    __tablename__ = "gpx_track"
 
     # linkage
-    point_uuid = db.Column(db.String, primary_key=True, default=str(uuid.uuid4()))
-    ride_uuid = db.Column(db.String, ForeignKey("ride.ride_uuid"), nullable=False)
+    ride_uuid = db.Column(db.String, ForeignKey("ride.ride_uuid"), primary_key=True)
+    point_count = db.Column(db.Integer, nullable=False)
 
     # GPX provided
-    time = db.Column(db.Integer, nullable=False)
-    latitude = db.Column(db.Float, nullable=False)
-    longitude = db.Column(db.Float, nullable=False)
-    altitude = db.Column(db.Float, nullable=False)
+    time = db.Column(db.LargeBinary, nullable=False)
+    latitude = db.Column(db.LargeBinary, nullable=False)
+    longitude = db.Column(db.LargeBinary, nullable=False)
+    altitude = db.Column(db.LargeBinary, nullable=False)
 
     # derived
-    step_distance = db.Column(db.Float, nullable=True)
-    cum_distance = db.Column(db.Float, nullable=True)
-    mark = db.Column(db.Integer, nullable=True)
+    step_distance = db.Column(db.LargeBinary, nullable=False)
+    cum_distance = db.Column(db.LargeBinary, nullable=False)
+    mark = db.Column(db.LargeBinary, nullable=False)
+    importance = db.Column(db.LargeBinary, nullable=False)
+
+    # resampled to one point per second of mark, see api.gpx.resample_track()
+    resampled_latitude = db.Column(db.LargeBinary, nullable=False)
+    resampled_longitude = db.Column(db.LargeBinary, nullable=False)
+    resampled_altitude = db.Column(db.LargeBinary, nullable=False)
+    resampled_cum_distance = db.Column(db.LargeBinary, nullable=False)
+
+    @classmethod
+    def from_dataframe(cls, ride_uuid, gpx_df):
+
+        """
+        Init from GPX dataframe, with a column for each of api.gpx.POINT_DTYPES, resampling to 1 Hz
+        """
+
+        columns = {name: gpx_df[name].to_numpy() for name in POINT_DTYPES}
+        columns.update(resample_track(gpx_df.mark.to_numpy(), {name: columns[name] for name in RESAMPLED_COLUMNS}))
+        return cls(ride_uuid=ride_uuid, point_count=len(gpx_df), **encode_track(columns))
+
+    @classmethod
+    def load_track(cls, ride_uuid):
+
+        """
+        Load and decode track for ride from a single row
+
+        :return: Track, or None if ride has no track
+        """
+
+        print(f"loading GPX track: {ride_uuid}")
+        row = db.engine.execute(cls.__table__.select().where(cls.ride_uuid == ride_uuid)).fetchone()
+        return decode_track(row) if row is not None else None
+
+
+###############################################
+# GPX TRACK CACHE
+###############################################
+@event.listens_for(RideTrack, "after_insert")
+@event.listens_for(RideTrack, "after_update")
+@event.listens_for(RideTrack, "after_delete")
+def invalidate_track_on_write(mapper, connection, target):
+    app.gpx_cache.invalidate(target.ride_uuid)
+
 
-    # relationships
-    # ride = relationship("Ride", back_populates="gpx_datas")
+@event.listens_for(Ride, "after_delete")
+def invalidate_track_on_ride_delete(mapper, connection, target):
+    app.gpx_cache.invalidate(target.ride_uuid)
@@ -0,0 +1,268 @@
+"""
+TBOS API write-behind persistence
+"""
+
+import copy
+import threading
+import time
+import traceback
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm.attributes import set_committed_value
+
+PERSIST_MODES = ["sync", "batched"]
+
+
+class WriteBehind:
+
+    """
+    Write-behind persistence for heartbeat inserts, and Ride / Bike state updates
+
+    Writes are queued in memory and flushed together in a single transaction.  Modes:
+        - "sync": flush on every write
+        - "batched": flush every flush_seconds, or once flush_records writes are queued
+
+    Queued state updates are applied to instances as they load, see apply_pending(), so reads stay consistent
+    with what has been written but not yet flushed.
+    """
+
+    def __init__(self, app, mode="batched", flush_seconds=5.0, flush_records=30):
+
+        if mode not in PERSIST_MODES:
+            raise Exception(f"persistence mode {mode} not recognized, expecting one of {PERSIST_MODES}")
+
+        self.app = app
+        self.mode = mode
+        self.flush_seconds = flush_seconds
+        self.flush_records = flush_records
+
+        # pending writes
+        self.inserts = []  # [(table, row)]
+        self.updates = {}  # {(table name, primary key): {column: value}}
+        self.tables = {}
+
+        self.lock = threading.RLock()
+        self.wakeup = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        # stats
+        self.flushes = 0
+        self.flushed_records = 0
+        self.dropped_records = 0
+        self.last_flush_elapsed = None
+
+    @property
+    def pending_count(self):
+        return len(self.inserts) + len(self.updates)
+
+    def insert(self, instance):
+
+        """
+        Queue insert of a new model instance
+
+        The instance is not added to the session, and all columns are written as currently set.  Values are
+        copied, so later changes to e.g. a JSON dict shared with the instance are not written, and do not race
+        the flush thread.
+        """
+
+        table = instance.__table__
+        row = {column.key: copy.deepcopy(getattr(instance, column.key)) for column in table.columns}
+        with self.lock:
+            self.inserts.append((table, row))
+        self._written()
+
+    def update(self, instance, **values):
+
+        """
+        Queue column updates for a model instance
+
+        Values are set on the instance as committed, so the session does not consider it dirty, and queued as
+        copies, as for insert().
+        """
+
+        for key, value in values.items():
+            set_committed_value(instance, key, value)
+        values = copy.deepcopy(values)
+
+        table = instance.__table__
+        key = (table.name, self._primary_key(instance))
+        with self.lock:
+            self.tables[table.name] = table
+            self.updates.setdefault(key, {}).update(values)
+        self._written()
+
+    def apply_pending(self, instance, attrs=None):
+
+        """
+        Apply queued, not yet flushed, updates to a loaded instance
+        """
+
+        if not self.updates:
+            return
+        pending = self.updates.get((instance.__table__.name, self._primary_key(instance)))
+        if pending is None:
+            return
+        for key, value in list(pending.items()):
+            if attrs is None or key in attrs:
+                set_committed_value(instance, key, value)
+
+    def _primary_key(self, instance):
+        return getattr(instance, instance.__mapper__.primary_key[0].key)
+
+    def _written(self):
+        if self.mode == "sync":
+            self.flush()
+        elif self.pending_count >= self.flush_records:
+            self.wakeup.set()
+
+    def flush(self):
+
+        """
+        Write all pending inserts and updates in a single transaction
+
+        If the transaction fails on a transient error, e.g. the database is locked, everything stays pending and
+        the error is raised.  On any other error records are retried one at a time, and those that still fail,
+        e.g. on an integrity error or a value that cannot be serialized, are logged and dropped, so one bad
+        record does not block every later flush.
+
+        :return: int, count of records flushed
+        """
+
+        with self.lock:
+            if self.pending_count == 0:
+                return 0
+
+            t0 = time.time()
+            inserts, updates = self.inserts, self.updates
+            count = len(inserts) + len(updates)
+
+            try:
+                # NOTE: engine retrieved for app explicitly, as pushing an app context here would remove the
+                # scoped session of the calling thread on teardown
+                with self.app.db.get_engine(self.app).begin() as conn:
+
+                    # inserts, batched per table
+                    batches = {}
+                    for table, row in inserts:
+                        batches.setdefault(table, []).append(row)
+                    for table, rows in batches.items():
+                        conn.execute(table.insert(), rows)
+
+                    # updates
+                    for (table_name, pk), values in updates.items():
+                        self._execute_update(conn, table_name, pk, values)
+
+                # clear pending
+                self.inserts, self.updates = [], {}
+
+            except OperationalError as e:
+                print({"error": str(e), "traceback": traceback.format_exc()})
+                raise e
+
+            except Exception as e:
+                print({"error": str(e), "traceback": traceback.format_exc()})
+                count = self._flush_each()
+
+            self.flushes += 1
+            self.flushed_records += count
+            self.last_flush_elapsed = time.time() - t0
+            print(f"write-behind flushed {count} records: {self.last_flush_elapsed}")
+            return count
+
+    def _execute_update(self, conn, table_name, pk, values):
+        table = self.tables[table_name]
+        pk_column = table.primary_key.columns.values()[0]
+        conn.execute(table.update().where(pk_column == pk).values(**values))
+
+    def _flush_each(self):
+
+        # write pending records one transaction each, keeping those that fail transiently, dropping the rest
+        engine = self.app.db.get_engine(self.app)
+        inserts, updates = self.inserts, self.updates
+        self.inserts, self.updates = [], {}
+
+        count = 0
+        for table, row in inserts:
+            written = self._write_one(engine, lambda conn: conn.execute(table.insert(), row), row)
+            if written is None:
+                self.inserts.append((table, row))
+            count += bool(written)
+        for key, values in updates.items():
+            written = self._write_one(engine, lambda conn: self._execute_update(conn, *key, values), values)
+            if written is None:
+                self.updates.setdefault(key, {}).update(values)
+            count += bool(written)
+        return count
+
+    def _write_one(self, engine, write, record):
+
+        # return True if written, None if kept for retry, False if dropped
+        try:
+            with engine.begin() as conn:
+                write(conn)
+            return True
+        except OperationalError as e:
+            print({"error": str(e), "traceback": traceback.format_exc()})
+            return None
+        except Exception as e:
+            self.dropped_records += 1
+            print(f"write-behind dropped record after error, {e}: {record}")
+            return False
+
+    def start(self):
+
+        """
+        Start flush thread, for batched mode
+        """
+
+        if self.mode != "batched" or (self.thread is not None and self.thread.is_alive()):
+            return False
+
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name="tbos-write-behind", daemon=True)
+        self.thread.start()
+        return True
+
+    def run(self):
+
+        """
+        Flush every flush_seconds, or when woken by queued writes, until stopped
+        """
+
+        while not self.stop_event.is_set():
+            self.wakeup.wait(self.flush_seconds)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                # pending writes are kept, retry next interval
+                pass
+
+    def shutdown(self):
+
+        """
+        Stop flush thread and flush remaining writes
+        """
+
+        self.stop_event.set()
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join(self.flush_seconds)
+        self.thread = None
+        return self.flush()
+
+    def stats(self):
+
+        """
+        Return persistence stats
+        """
+
+        return {
+            "mode": self.mode,
+            "pending": self.pending_count,
+            "flushes": self.flushes,
+            "flushed_records": self.flushed_records,
+            "dropped_records": self.dropped_records,
+            "last_flush_elapsed": self.last_flush_elapsed,
+        }
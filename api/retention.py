@@ -0,0 +1,157 @@
+"""
+TBOS API job retention
+"""
+
+import threading
+import time
+import traceback
+
+from sqlalchemy import and_, or_, select
+
+
+class JobRetention:
+
+    """
+    Prunes the PybJobQueue audit log in the background, keeping at most max_rows rows, none older than max_age
+    seconds
+
+    Rows are deleted oldest first, by (timestamp_added, job_uuid), batch_size at a time, each batch in its own
+    short transaction with a pause between batches, so write-behind flushes and requests are not held up behind
+    one large delete.  Either limit may be None to disable it.
+    """
+
+    def __init__(self, app, max_rows=10000, max_age=7 * 24 * 60 * 60, interval=60.0, batch_size=500, pause=0.05):
+        self.app = app
+        self.max_rows = max_rows
+        self.max_age = max_age
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        # stats
+        self.prunes = 0
+        self.pruned_rows = 0
+        self.last_prune_elapsed = None
+        self.last_cutoff = None
+
+    def _condition(self, conn, table):
+
+        # where clause of rows past retention limits, or None if there are no limits
+        conditions = []
+        self.last_cutoff = {"max_age": None, "max_rows": None}
+        if self.max_age is not None:
+            cutoff = int(time.time() - self.max_age)
+            conditions.append(table.c.timestamp_added < cutoff)
+            self.last_cutoff["max_age"] = cutoff
+        if self.max_rows is not None:
+
+            # first row past max_rows, newest first, keyed on (timestamp_added, job_uuid) as PybJobQueue.page,
+            # since many jobs share a second
+            row = conn.execute(
+                select([table.c.timestamp_added, table.c.job_uuid])
+                .order_by(table.c.timestamp_added.desc(), table.c.job_uuid.desc())
+                .limit(1)
+                .offset(self.max_rows)
+            ).fetchone()
+            if row is not None:
+                conditions.append(
+                    or_(
+                        table.c.timestamp_added < row[0],
+                        and_(table.c.timestamp_added == row[0], table.c.job_uuid <= row[1]),
+                    )
+                )
+                self.last_cutoff["max_rows"] = f"{row[0]}:{row[1]}"
+        return or_(*conditions) if conditions else None
+
+    def prune(self):
+
+        """
+        Delete rows past retention limits, in batches
+
+        :return: int, count of rows deleted
+        """
+
+        from api.models import PybJobQueue
+
+        table = PybJobQueue.__table__
+        engine = self.app.db.get_engine(self.app)
+
+        t0 = time.time()
+        with engine.connect() as conn:
+            condition = self._condition(conn, table)
+        if condition is None:
+            return 0
+
+        count = 0
+        while not self.stop_event.is_set():
+            batch = (
+                select([table.c.job_uuid])
+                .where(condition)
+                .order_by(table.c.timestamp_added, table.c.job_uuid)
+                .limit(self.batch_size)
+            )
+            with engine.begin() as conn:
+                deleted = conn.execute(table.delete().where(table.c.job_uuid.in_(batch))).rowcount
+            count += deleted
+            if deleted < self.batch_size:
+                break
+
+            # let waiting writers in, as SQLite busy waits back off and would otherwise lose to the next batch
+            self.stop_event.wait(self.pause)
+
+        self.prunes += 1
+        self.pruned_rows += count
+        self.last_prune_elapsed = time.time() - t0
+        if count:
+            print(f"pruned {count} pyb_job_queue rows past {self.last_cutoff}: {self.last_prune_elapsed}")
+        return count
+
+    def start(self):
+
+        """
+        Start prune thread, if not already running
+        """
+
+        if self.thread is not None and self.thread.is_alive():
+            return False
+
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name="tbos-job-retention", daemon=True)
+        self.thread.start()
+        return True
+
+    def run(self):
+
+        """
+        Prune every interval seconds until stopped
+        """
+
+        while not self.stop_event.is_set():
+            try:
+                self.prune()
+            except Exception as e:
+                print({"error": str(e), "traceback": traceback.format_exc()})
+            self.stop_event.wait(self.interval)
+
+    def stop(self, timeout=None):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+        self.thread = None
+
+    def stats(self):
+        return {
+            "running": self.thread is not None and self.thread.is_alive(),
+            "max_rows": self.max_rows,
+            "max_age": self.max_age,
+            "interval": self.interval,
+            "batch_size": self.batch_size,
+            "pause": self.pause,
+            "prunes": self.prunes,
+            "pruned_rows": self.pruned_rows,
+            "last_prune_elapsed": self.last_prune_elapsed,
+            "last_cutoff": self.last_cutoff,
+        }
@@ -0,0 +1,150 @@
+"""
+TBOS API ride runner
+"""
+
+import threading
+import time
+import traceback
+
+
+class RideRunner:
+
+    """
+    Background thread to run the current Ride, performing a heartbeat every second
+
+    Each heartbeat is published to the event broker as it is produced.  The ride clock follows wall time: a
+    heartbeat that runs long skips ticks, rather than queueing them.
+
+    The runner stops itself when the ride is finished, by distance for GPX rides and by duration otherwise, or
+    once the event broker has had no subscribers for idle_timeout seconds, e.g. the ride page was closed.
+    """
+
+    def __init__(self, app, events, interval=1.0, idle_timeout=60.0):
+        self.app = app
+        self.events = events
+        self.interval = interval
+        self.idle_timeout = idle_timeout
+        self.settings = {}
+        self.completed = None
+        self.chart_cursor = None
+        self.stopped_reason = None
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    @property
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive() and not self.stop_event.is_set()
+
+    def status(self):
+        return {
+            "running": self.is_running,
+            "completed": self.completed,
+            "settings": self.settings,
+            "stopped_reason": self.stopped_reason,
+        }
+
+    def start(self, ride, settings=None):
+
+        """
+        Start running Ride from its completed mark, or update settings if already running
+
+        :param settings: dict, heartbeat payload settings, e.g. simulate_rpm
+        """
+
+        self.settings = settings or {}
+        if self.is_running:
+            return False
+
+        # each run has its own stop event, so a run still finishing cannot be restarted by this one
+        self.completed = ride.completed
+        self.chart_cursor = int(ride.completed)
+        self.stopped_reason = None
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, args=(self.stop_event,), name="tbos-ride-runner", daemon=True)
+        self.thread.start()
+        self.events.publish("ride_state", self.status())
+        return True
+
+    def stop(self, reason="stopped"):
+
+        """
+        Stop running Ride
+        """
+
+        was_running = self.is_running
+        self.stop_event.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(self.interval * 5)
+        self.thread = None
+        if was_running:
+            self.stopped_reason = reason
+            self.events.publish("ride_state", self.status())
+        return was_running
+
+    @staticmethod
+    def is_finished(ride):
+
+        """
+        Return True if ride, as serialized in a heartbeat response, is finished
+
+        GPX rides finish at the end of the route, others at their duration; free rides, without a duration, do
+        not finish.
+        """
+
+        if ride.get("ride_type") == "gpx" and ride.get("total_distance"):
+            return ride.get("cum_distance", 0.0) >= ride["total_distance"]
+        if ride.get("duration"):
+            return ride.get("completed", 0.0) >= ride["duration"]
+        return False
+
+    def _finish(self, stop_event, reason):
+
+        # stop from within the run, publishing final state
+        stop_event.set()
+        self.stopped_reason = reason
+        print(f"ride runner stopped at {self.completed}: {reason}")
+        try:
+            self.app.persistence.flush()
+        except Exception as e:
+            print({"error": str(e), "traceback": traceback.format_exc()})
+        self.events.publish("ride_state", self.status())
+
+    def run(self, stop_event):
+
+        """
+        Perform heartbeat every interval until stopped, the ride is finished, or no one is subscribed
+        """
+
+        from api.models import Heartbeat
+
+        t0 = time.time()
+        base_completed = self.completed
+        ticks = 0
+        with self.app.app_context():
+            while True:
+
+                # wait for next tick, skipping any missed
+                ticks = max(ticks + 1, int((time.time() - t0) / self.interval))
+                if stop_event.wait(max(0.0, t0 + (ticks * self.interval) - time.time())):
+                    break
+
+                try:
+                    self.completed = base_completed + ticks
+                    payload = dict(self.settings)
+                    payload.update({"localRide": {"completed": self.completed}, "chart_cursor": self.chart_cursor})
+                    response = Heartbeat.heartbeat(payload)
+                    self.chart_cursor = (response.get("chart_delta") or response["chart_data"])["cursor"]
+                    self.events.publish("heartbeat", response)
+                    if self.is_finished(response["ride"]):
+                        self._finish(stop_event, "finished")
+                        break
+                except Exception as e:
+                    print({"error": str(e), "traceback": traceback.format_exc()})
+                    self.events.publish("heartbeat_error", {"error": str(e)})
+                finally:
+                    self.app.db.session.remove()
+
+                # no one watching since start, or for the grace period
+                if self.idle_timeout is not None and min(self.events.idle_for(), time.time() - t0) >= self.idle_timeout:
+                    self._finish(stop_event, "no_subscribers")
+                    break
@@ -0,0 +1,152 @@
+"""
+TBOS API device sampler
+"""
+
+from collections import deque, namedtuple
+import copy
+import threading
+import time
+import traceback
+
+DeviceSample = namedtuple("DeviceSample", ["bike_uuid", "timestamp", "status"])
+
+
+class DeviceSampler:
+
+    """
+    Background thread to poll status of the current Bike
+
+    The latest sample is a single reference, replaced whole on each poll, so readers never wait on the device
+    or a lock.  Recent samples are kept in a fixed size ring buffer.
+
+    Polls every interval seconds while active: a ride is running, a client is subscribed to events, or a sample
+    was asked for within idle_after seconds.  Otherwise polls every idle_interval seconds, or not at all if None,
+    so an idle bike does not log a device job and status write every second; asking for a sample wakes it.
+    """
+
+    def __init__(self, app, interval=1.0, history=300, idle_interval=30.0, idle_after=10.0):
+        self.app = app
+        self.interval = interval
+        self.idle_interval = idle_interval
+        self.idle_after = idle_after
+        self.latest = None
+        self.samples = deque(maxlen=history)
+        self.errors = 0
+        self.polls = 0
+        self.last_demand = None
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.wakeup = threading.Event()
+
+    @property
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+
+        """
+        Start sampler thread, if not already running
+        """
+
+        if self.is_running:
+            return False
+
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name="tbos-device-sampler", daemon=True)
+        self.thread.start()
+        return True
+
+    def stop(self, timeout=None):
+
+        """
+        Stop sampler thread
+        """
+
+        self.stop_event.set()
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+        self.thread = None
+
+    @property
+    def is_active(self):
+        if self.app.ride_runner.is_running or self.app.events.subscribers:
+            return True
+        return self.last_demand is not None and time.time() - self.last_demand < self.idle_after
+
+    def run(self):
+
+        """
+        Poll device at interval until stopped
+        """
+
+        print(f"device sampler started, interval: {self.interval}")
+        with self.app.app_context():
+            while not self.stop_event.is_set():
+                t0 = time.time()
+                self.wakeup.clear()
+                try:
+                    bike = self.app.active.get_bike()
+                    if bike is not None:
+                        self.polls += 1
+                        bike.get_status(raise_exceptions=True)
+                except Exception as e:
+                    self.errors += 1
+                    print({"error": str(e), "traceback": traceback.format_exc()})
+                finally:
+                    self.app.db.session.remove()
+
+                # wait for remainder of interval, or until woken by demand if idle
+                interval = self.interval if self.is_active else self.idle_interval
+                self.wakeup.wait(None if interval is None else max(0.0, interval - (time.time() - t0)))
+        print("device sampler stopped")
+
+    def publish(self, bike_uuid, status):
+
+        """
+        Publish status as latest sample
+        """
+
+        sample = DeviceSample(bike_uuid, time.time(), copy.deepcopy(status))
+        self.latest = sample
+        self.samples.append(sample)
+        return sample
+
+    def get_latest(self, bike_uuid=None, max_age=None):
+
+        """
+        Return latest sample, or None if not for bike or older than max_age seconds
+
+        Counts as demand, waking the sampler if idle.
+        """
+
+        if not self.is_active:
+            self.wakeup.set()
+        self.last_demand = time.time()
+
+        sample = self.latest
+        if sample is None:
+            return None
+        if bike_uuid is not None and sample.bike_uuid != bike_uuid:
+            return None
+        if max_age is not None and (time.time() - sample.timestamp) > max_age:
+            return None
+        return sample
+
+    def stats(self):
+
+        """
+        Return sampler stats
+        """
+
+        sample = self.latest
+        return {
+            "running": self.is_running,
+            "interval": self.interval,
+            "idle_interval": self.idle_interval,
+            "active": self.is_active,
+            "polls": self.polls,
+            "samples": len(self.samples),
+            "errors": self.errors,
+            "latest_age": None if sample is None else time.time() - sample.timestamp,
+        }
@@ -0,0 +1,336 @@
+"""
+TBOS API device scheduler
+"""
+
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+import heapq
+import itertools
+import threading
+import time
+import traceback
+import uuid
+
+from api.exceptions import DeviceJobTimeout
+
+# job priorities, higher runs first
+PRIORITY_LOW = 0
+PRIORITY_NORMAL = 1
+PRIORITY_HIGH = 2
+
+
+class DeviceJob:
+
+    """
+    Commands for the embedded controller, run by the DeviceScheduler
+
+    The result, or exception, is delivered through future.  Status follows PybJobQueue: "queued", "running",
+    "success", "failed", "cancelled" or "superseded".
+
+    Jobs with a coalescing key, e.g. "level", replace a queued job with the same key, see DeviceScheduler.submit.
+    """
+
+    def __init__(self, cmds, resp_idx=None, priority=PRIORITY_NORMAL, key=None):
+        self.job_uuid = str(uuid.uuid4())
+        self.cmds = cmds
+        self.resp_idx = resp_idx
+        self.priority = priority
+        self.key = key
+        self.superseded_by = None
+        self.timestamp_added = time.time()
+        self.timestamp_started = None
+        self.timestamp_finished = None
+        self.status = "queued"
+        self.resps = None
+        self.future = Future()
+
+    def cancel(self):
+
+        """
+        Cancel job if not yet running
+
+        :return: bool, True if cancelled
+        """
+
+        cancelled = self.future.cancel()
+        if cancelled:
+            self.status = "cancelled"
+        return cancelled
+
+    @property
+    def elapsed(self):
+        if self.timestamp_started is None:
+            return None
+        return (self.timestamp_finished or time.time()) - self.timestamp_started
+
+    def to_dict(self):
+        return {
+            "job_uuid": self.job_uuid,
+            "cmds": self.cmds,
+            "resp_idx": self.resp_idx,
+            "priority": self.priority,
+            "key": self.key,
+            "status": self.status,
+            "superseded_by": self.superseded_by,
+            "timestamp_added": self.timestamp_added,
+            "timestamp_started": self.timestamp_started,
+            "elapsed": self.elapsed,
+        }
+
+
+class DeviceScheduler:
+
+    """
+    Runs device jobs one at a time, on a single worker thread, highest priority first then oldest first
+
+    Callers submit jobs and wait on a future, and the worker is woken by a condition variable, so a job starts
+    as soon as the device is free.  Finished jobs are optionally written to PybJobQueue, via write-behind
+    persistence, as an audit log.
+    """
+
+    def __init__(self, app, runner=None, audit=True):
+        self.app = app
+        self.runner = runner or self.run_on_pyboard
+        self.audit = audit
+
+        # heap of (-priority, sequence, job)
+        self.heap = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.current = None
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        # stats
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.superseded = 0
+        self.timeouts = 0
+
+    def run_on_pyboard(self, job):
+        return self.app.device.execute(job.cmds, resp_idx=job.resp_idx)
+
+    @property
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+
+        """
+        Start worker thread, if not already running
+        """
+
+        with self.condition:
+            if self.is_running:
+                return False
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self.run, name="tbos-device-scheduler", daemon=True)
+            self.thread.start()
+            return True
+
+    def submit(self, cmds, resp_idx=None, priority=PRIORITY_NORMAL, key=None):
+
+        """
+        Queue job, starting worker if needed
+
+        If key is given, and a job with the same key is still queued, the new job takes its place in the queue,
+        at the higher of the two priorities, and the older job is superseded: it is never run, and its future
+        resolves with the new job's response.  So a burst of e.g. level changes collapses into one device action,
+        for the last requested level.
+
+        :return: DeviceJob, wait on job.future for the response
+        """
+
+        job = DeviceJob(cmds, resp_idx=resp_idx, priority=priority, key=key)
+        superseded = None
+        with self.condition:
+            idx = self._find_pending(key) if key is not None else None
+            if idx is None:
+                heapq.heappush(self.heap, (-priority, next(self.sequence), job))
+            else:
+                neg_priority, sequence, superseded = self.heap[idx]
+                self.heap[idx] = (min(neg_priority, -priority), sequence, job)
+                heapq.heapify(self.heap)
+                superseded.status = "superseded"
+                superseded.superseded_by = job.job_uuid
+                self.superseded += 1
+            self.condition.notify()
+
+        if superseded is not None:
+            job.future.add_done_callback(lambda future: self._chain(future, superseded.future))
+            self._audit(superseded)
+        self.start()
+        return job
+
+    def _find_pending(self, key):
+
+        # index in heap of queued job with key, not yet cancelled
+        for idx, (_, _, job) in enumerate(self.heap):
+            if job.key == key and not job.future.cancelled():
+                return idx
+        return None
+
+    @staticmethod
+    def _chain(source, target):
+
+        # resolve superseded job's future from the job that replaced it
+        if target.done():
+            return
+        if source.cancelled():
+            target.cancel()
+        elif source.exception() is not None:
+            target.set_exception(source.exception())
+        else:
+            target.set_result(source.result())
+
+    def run_job(self, cmds, resp_idx=None, priority=PRIORITY_NORMAL, key=None, timeout=None, raise_exceptions=False):
+
+        """
+        Queue job and wait for its response
+
+        If the job has not finished within timeout seconds, it is cancelled if still queued, and
+        DeviceJobTimeout raised regardless of raise_exceptions; a job already running on the device is left to
+        finish.
+
+        :return: response, or None if the job failed and raise_exceptions is False
+        """
+
+        if timeout is None:
+            timeout = self.app.config.get("TBOS_JOB_TIMEOUT", 30)
+        job = self.submit(cmds, resp_idx=resp_idx, priority=priority, key=key)
+        try:
+            return job.future.result(timeout=timeout)
+        except FutureTimeoutError:
+            self.timeouts += 1
+            self.cancel(job)
+            raise DeviceJobTimeout(f"job {job.job_uuid} did not complete within {timeout} seconds, {job.status}")
+        except Exception as e:
+            if raise_exceptions:
+                raise e
+            return None
+
+    def cancel(self, job):
+
+        """
+        Cancel job if not yet running, it is dropped when reached in the queue
+
+        A superseded job only stops waiting on the job that replaced it, which still runs.
+
+        :return: bool, True if cancelled
+        """
+
+        if job.superseded_by is not None:
+            return job.future.cancel()
+        if job.future.cancelled() or not job.cancel():
+            return False
+        self.cancelled += 1
+        self._audit(job)
+        return True
+
+    def cancel_pending(self):
+
+        """
+        Cancel all queued jobs, the running job is left to finish
+
+        :return: int, count of jobs cancelled
+        """
+
+        with self.condition:
+            jobs = [job for _, _, job in self.heap]
+            self.heap = []
+        return sum(1 for job in jobs if self.cancel(job))
+
+    def _next(self):
+
+        # wait for a job that has not been cancelled, or stop
+        with self.condition:
+            while not self.stop_event.is_set():
+                while self.heap:
+                    _, _, job = heapq.heappop(self.heap)
+                    if job.future.set_running_or_notify_cancel():
+                        self.current = job
+                        return job
+                self.condition.wait()
+        return None
+
+    def run(self):
+
+        """
+        Run jobs as queued until stopped
+        """
+
+        print("device scheduler started")
+        while True:
+            job = self._next()
+            if job is None:
+                break
+
+            job.status = "running"
+            job.timestamp_started = time.time()
+            try:
+                job.resps = self.runner(job)
+                job.status = "success"
+                self.completed += 1
+                job.future.set_result(job.resps)
+            except Exception as e:
+                print({"error": str(e), "traceback": traceback.format_exc()})
+                job.status = "failed"
+                self.failed += 1
+                job.future.set_exception(e)
+            finally:
+                job.timestamp_finished = time.time()
+                with self.condition:
+                    self.current = None
+                self._audit(job)
+
+    def _audit(self, job):
+
+        # queue audit log row, failure to record does not fail the job
+        if not self.audit:
+            return
+        try:
+            from api.models import PybJobQueue
+
+            self.app.persistence.insert(
+                PybJobQueue(
+                    job_uuid=job.job_uuid,
+                    timestamp_added=int(job.timestamp_added),
+                    cmds=job.cmds,
+                    resps=job.resps,
+                    resp_idx=job.resp_idx,
+                    status=job.status,
+                    priority=job.priority,
+                    elapsed=job.elapsed,
+                )
+            )
+        except Exception as e:
+            print({"error": str(e), "traceback": traceback.format_exc()})
+
+    def stop(self, timeout=None):
+
+        """
+        Stop worker thread, cancelling queued jobs
+        """
+
+        self.cancel_pending()
+        with self.condition:
+            self.stop_event.set()
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join(timeout)
+        self.thread = None
+
+    def stats(self):
+        with self.condition:
+            pending = sorted(self.heap)
+            current = self.current
+        return {
+            "running": self.is_running,
+            "current": current.to_dict() if current is not None else None,
+            "pending": [job.to_dict() for _, _, job in pending if not job.future.cancelled()],
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "superseded": self.superseded,
+            "timeouts": self.timeouts,
+        }
@@ -0,0 +1,278 @@
+"""
+TBOS API ride timeseries
+"""
+
+import threading
+
+import numpy as np
+
+from api.downsample import select_indices
+
+# Chart.js datasets, by column of timeseries row
+LEVEL_DATASETS = [
+    (0, {"label": "program", "borderColor": "deeppink", "borderWidth": 3}),
+    (
+        1,
+        {
+            "label": "recorded",
+            "borderColor": "rgba(0,255,0,0.7)",
+            "backgroundColor": "rgba(0,255,0,0.3)",
+            "borderWidth": 1,
+            "fill": True,
+        },
+    ),
+]
+SPEED_DATASETS = [
+    (2, {"label": "rpm", "borderColor": "blue", "borderWidth": 1}),
+    (3, {"label": "mph", "borderColor": "orange", "borderWidth": 1}),
+]
+
+
+def ffill(values):
+
+    """
+    Forward fill NaN values of an array, leading NaN values are left as is
+
+    Each position takes the index of the latest non-NaN value at or before it, via np.maximum.accumulate.
+    """
+
+    idx = np.where(np.isnan(values), 0, np.arange(len(values)))
+    np.maximum.accumulate(idx, out=idx)
+    return values[idx]
+
+
+def to_json_values(values, integer=False):
+
+    """
+    Return array as list for JSON, where NaN is None
+    """
+
+    if integer:
+        return [None if v != v else int(v) for v in values.tolist()]
+    return [None if v != v else v for v in values.tolist()]
+
+
+class RideTimeseries:
+
+    """
+    In-process, per-second timeseries for a single Ride
+
+    Columns mirror Ride.parse_recorded_timeseries(), [program_level, recorded_level, rpm, mph], where the row
+    index is the second of the ride, less one, and missing values are NaN.  Seeded once from the database,
+    then kept current by record(); the array grows by doubling, so recording is amortized O(1).
+    """
+
+    def __init__(self, ride_uuid, columns):
+        self.ride_uuid = ride_uuid
+        self.length = len(columns[0])
+        self.data = np.full((max(self.length, 1), len(columns)), np.nan)
+        for col, values in enumerate(columns):
+            self.data[: self.length, col] = values
+        self.lock = threading.Lock()
+        self.downsampled = {}
+
+    @classmethod
+    def from_ride(cls, ride):
+
+        """
+        Seed timeseries from recorded heartbeats of a Ride
+        """
+
+        return cls(ride.ride_uuid, ride.parse_recorded_timeseries())
+
+    def __len__(self):
+        return self.length
+
+    def record(self, mark, level, rpm, mph):
+
+        """
+        Record heartbeat values for a mark (second) of the ride
+
+        :return: bool, True if recorded
+        """
+
+        if mark is None or mark < 1:
+            return False
+
+        with self.lock:
+
+            # extend if heartbeat is beyond program
+            idx = int(mark) - 1
+            if idx >= len(self.data):
+                data = np.full((max(idx + 1, len(self.data) * 2), self.data.shape[1]), np.nan)
+                data[: self.length] = self.data[: self.length]
+                self.data = data
+            self.length = max(self.length, idx + 1)
+
+            self.data[idx, 1:] = [np.nan if v is None else v for v in (level, rpm, mph)]
+
+        return True
+
+    def _series(self, col, start, stop, completed):
+
+        """
+        Return charted values for rows [start, stop), filling missing values up until completed
+
+        Zero rpm / mph are dropped, so filled over from the last nonzero value.  Filling is seeded from the last
+        charted value before start, found by walking back from start; this is typically a single step, as
+        heartbeats are recorded every second.
+        """
+
+        seed = np.nan
+        for idx in range(min(start, completed) - 1, -1, -1):
+            value = self.data[idx, col]
+            if not np.isnan(value) and not (col >= 2 and value == 0):
+                seed = value
+                break
+
+        values = self.data[start:stop, col].copy()
+        if col >= 2:
+            values[values == 0] = np.nan
+        fill_stop = max(0, min(completed, stop) - start)
+        values[:fill_stop] = ffill(np.concatenate([[seed], values[:fill_stop]]))[1:]
+        return to_json_values(values, integer=col < 2)
+
+    def is_downsampled(self, max_points):
+
+        """
+        Return True if chart data for max_points would be downsampled
+        """
+
+        return max_points is not None and self.length > max_points
+
+    def chart_data(self, completed, max_points=None, mode="lttb"):
+
+        """
+        Return full chart data for ride
+
+        If the ride is longer than max_points, the level and speed charts are each downsampled to at most
+        max_points, with their own labels, as speed is noisier than level.  Downsampled charts cannot be
+        merged with deltas, so are resent whole; they are cached and only rebuilt once a bucket's worth of
+        seconds, length / max_points, has been completed, as a finer change would not be visible.
+
+        :param completed: seconds of ride completed, missing values are filled up until this mark
+        :param max_points: int, maximum points per chart, or None for every second
+        :param mode: str, downsampling mode, "lttb" or "minmax"
+        """
+
+        if max_points is not None and max_points < 1:
+            raise ValueError(f"max_points must be at least 1, not {max_points}")
+        completed = int(completed)
+
+        # decide on downsampling once, from the length the series are read at, as record() may extend it
+        with self.lock:
+            length = self.length
+            downsampled = max_points is not None and length > max_points
+
+            # return cached downsampled chart if still within bucket
+            if downsampled:
+                stamp = (length, completed // max(1, length // max_points))
+                cached = self.downsampled.get((max_points, mode))
+                if cached is not None and cached[0] == stamp:
+                    return cached[1]
+
+            level_series = [self._series(col, 0, length, completed) for col, _ in LEVEL_DATASETS]
+            speed_series = [self._series(col, 0, length, completed) for col, _ in SPEED_DATASETS]
+
+        chart_data = {"length": length, "cursor": min(completed, length), "downsampled": None}
+        for labels_key, datasets_key, datasets, series in [
+            ("labels", "datasets", LEVEL_DATASETS, level_series),
+            ("speed_labels", "speed_datasets", SPEED_DATASETS, speed_series),
+        ]:
+            if downsampled:
+                indices = select_indices(series, max_points, mode=mode)
+                series = [[values[idx] for idx in indices] for values in series]
+                chart_data["downsampled"] = {"mode": mode, "max_points": max_points}
+            else:
+                indices = range(length)
+            chart_data[labels_key] = [f"{str(idx + 1)}s" for idx in indices]
+            chart_data[datasets_key] = [dict(style, data=values) for (_, style), values in zip(datasets, series)]
+
+        if downsampled:
+            with self.lock:
+                self.downsampled[(max_points, mode)] = (stamp, chart_data)
+        return chart_data
+
+    def chart_delta(self, cursor, completed):
+
+        """
+        Return chart points changed since a client cursor
+
+        Rows before the cursor are final on the client.  Rows from the cursor, or the latest recorded mark if
+        earlier, up until completed are returned filled; rows after completed only change via program, which
+        the client already holds from chart_data().
+
+        :param cursor: int, rows the client already holds as final
+        :param completed: seconds of ride completed
+        """
+
+        completed = int(completed)
+        with self.lock:
+            length = self.length
+            stop = min(completed, length)
+            start = max(0, min(int(cursor), stop - 1))
+            delta = {
+                dataset["label"]: self._series(col, start, stop, completed)
+                for col, dataset in LEVEL_DATASETS + SPEED_DATASETS
+            }
+
+        delta.update({"start": start, "cursor": stop, "length": length})
+        return delta
+
+    def snapshot(self):
+
+        """
+        Return copy of data, safe to mutate
+        """
+
+        with self.lock:
+            return self.data[: self.length].copy()
+
+
+class RideTimeseriesRegistry:
+
+    """
+    Process-wide registry of RideTimeseries, keyed by ride_uuid
+
+    Only the current ride is buffered; seeding a ride drops any others.
+    """
+
+    def __init__(self):
+        self.buffers = {}
+        self.lock = threading.Lock()
+
+    def seed(self, ride):
+
+        """
+        (Re)build timeseries for Ride from the database
+        """
+
+        buffer = RideTimeseries.from_ride(ride)
+        with self.lock:
+            self.buffers = {ride.ride_uuid: buffer}
+        return buffer
+
+    def get(self, ride):
+
+        """
+        Return timeseries for Ride, seeding if not yet buffered
+
+        Rides that are not current are returned unbuffered.
+        """
+
+        buffer = self.buffers.get(ride.ride_uuid)
+        if buffer is None:
+            if ride.is_current:
+                buffer = self.seed(ride)
+            else:
+                buffer = RideTimeseries.from_ride(ride)
+        return buffer
+
+    def discard(self, ride_uuid):
+
+        """
+        Drop timeseries for ride, next access will re-seed
+        """
+
+        with self.lock:
+            self.buffers.pop(ride_uuid, None)
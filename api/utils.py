@@ -25,6 +25,19 @@ def parse_query_payload(request):
     return query_payload
 
 
+def validate_max_points(max_points):
+
+    """
+    Helper function to validate a requested maximum of chart points, None for no maximum
+    """
+
+    if max_points is None:
+        return None
+    if isinstance(max_points, bool) or not isinstance(max_points, int) or max_points < 1:
+        raise app.InvalidUsage(f"max_points must be an integer of at least 1, not {max_points}", status_code=400)
+    return max_points
+
+
 def tbos_state_clear():
 
     """"""
@@ -33,6 +46,13 @@ def tbos_state_clear():
 
     print("TBOS init")
 
+    # flush pending writes
+    print("flushing pending writes...")
+    try:
+        app.persistence.flush()
+    except Exception as e:
+        print({"error": str(e), "traceback": traceback.format_exc()})
+
     # clear job queue
     print("stopping all jobs...")
     try:
@@ -51,6 +71,10 @@ def tbos_state_clear():
     except Exception as e:
         print({"error": str(e), "traceback": traceback.format_exc()})
 
+    # commit, then reload active context
+    app.db.session.commit()
+    app.active.invalidate()
+
     # print current bike
     current_bike = Bike.current()
     print(f"Current bike: {current_bike}")
@@ -72,12 +96,12 @@ def tbos_state_clear():
     # except Exception as e:
     #     print({"error": str(e), "traceback": traceback.format_exc()})
 
-    # commit
-    app.db.session.commit()
-
-    # splash screen
+    # splash screen, in one batch frame with a status request to replace the cleared status
     try:
-        LCD.write("TBOS API", "ready!")
+        if current_bike is not None and not current_bike.is_virtual:
+            current_bike.get_status(raise_exceptions=True, lcd=("TBOS API", "ready!"))
+        else:
+            LCD.write("TBOS API", "ready!")
     except Exception as e:
         print({"error": str(e), "traceback": traceback.format_exc()})
 
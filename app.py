@@ -2,6 +2,7 @@
 TBOS API
 """
 
+import atexit
 import json
 import os
 import random
@@ -13,14 +14,12 @@ from flask import Flask, request, jsonify, render_template, redirect, Response
 from flask_cors import CORS
 from flask_migrate import Migrate
 import geopy.distance as geopy_distance
-from gpx_converter import Converter
 import pandas as pd
 
 from api.models import (
     Bike,
     BikeSchema,
     LCD,
-    PyboardClient,
     PybJobQueue,
     PybJobQueueSchema,
     Ride,
@@ -28,7 +27,20 @@ from api.models import (
     Heartbeat,
     PollyTTS,
 )
-from api.utils import parse_query_payload, tbos_state_clear
+from api.cache import TrackCache
+from api.context import ActiveContext
+from api.device import DeviceManager
+from api.downsample import MODES as DOWNSAMPLE_MODES
+from api.events import EventBroker
+from api.ingest import IngestManager
+from api.metrics import Metrics
+from api.persistence import WriteBehind
+from api.retention import JobRetention
+from api.runner import RideRunner
+from api.sampler import DeviceSampler
+from api.scheduler import DeviceScheduler
+from api.timeseries import RideTimeseriesRegistry
+from api.utils import parse_query_payload, tbos_state_clear, validate_max_points
 
 from api.db import db
 
@@ -43,6 +55,102 @@ def create_app():
     db.init_app(app)
     app.db = db
 
+    # GPX step distance method, "haversine" or "vincenty" (ellipsoidal)
+    app.config.setdefault("TBOS_GPX_DISTANCE_METHOD", "haversine")
+
+    # default point budget for simplified GPX routes
+    app.config.setdefault("TBOS_ROUTE_MAX_POINTS", 5000)
+
+    # setup decoded GPX track cache
+    app.config.setdefault("TBOS_GPX_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+    app.gpx_cache = TrackCache(max_bytes=app.config["TBOS_GPX_CACHE_MAX_BYTES"])
+
+    # setup background ride ingestion
+    app.config.setdefault("TBOS_INGEST_WORKERS", 1)
+    app.config.setdefault("TBOS_INGEST_SPOOL_MAX_BYTES", 16 * 1024 * 1024)
+    app.ingest = IngestManager(
+        app,
+        max_workers=app.config["TBOS_INGEST_WORKERS"],
+        spool_max_bytes=app.config["TBOS_INGEST_SPOOL_MAX_BYTES"],
+    )
+    atexit.register(app.ingest.shutdown)
+
+    # setup stage latency metrics
+    app.metrics = Metrics()
+
+    # setup write-behind persistence, flushed at shutdown
+    app.config.setdefault("TBOS_PERSIST_MODE", "batched")
+    app.config.setdefault("TBOS_PERSIST_FLUSH_SECONDS", 5.0)
+    app.config.setdefault("TBOS_PERSIST_FLUSH_RECORDS", 30)
+    app.persistence = WriteBehind(
+        app,
+        mode=app.config["TBOS_PERSIST_MODE"],
+        flush_seconds=app.config["TBOS_PERSIST_FLUSH_SECONDS"],
+        flush_records=app.config["TBOS_PERSIST_FLUSH_RECORDS"],
+    )
+    atexit.register(app.persistence.shutdown)
+
+    # setup in-process ride timeseries
+    app.timeseries = RideTimeseriesRegistry()
+
+    # setup active context, current Bike and Ride
+    app.active = ActiveContext(app)
+
+    # setup long-lived device connections, closed at shutdown
+    app.config.setdefault("TBOS_DEVICE_BAUDRATE", 115200)
+    app.config.setdefault("TBOS_DEVICE_SERIAL_TIMEOUT", 20)
+    app.device = DeviceManager(
+        app, baudrate=app.config["TBOS_DEVICE_BAUDRATE"], serial_timeout=app.config["TBOS_DEVICE_SERIAL_TIMEOUT"]
+    )
+    atexit.register(app.device.close)
+
+    # setup device job scheduler, jobs optionally recorded to pyb_job_queue
+    app.config.setdefault("TBOS_JOB_TIMEOUT", 30)
+    app.config.setdefault("TBOS_JOB_AUDIT", True)
+    app.scheduler = DeviceScheduler(app, audit=app.config["TBOS_JOB_AUDIT"])
+    atexit.register(app.scheduler.stop, 5)
+
+    # setup pyb_job_queue retention, pruned in the background from first request, limits of None disable
+    app.config.setdefault("TBOS_JOB_RETENTION_MAX_ROWS", 10000)
+    app.config.setdefault("TBOS_JOB_RETENTION_MAX_AGE", 7 * 24 * 60 * 60)
+    app.config.setdefault("TBOS_JOB_RETENTION_INTERVAL", 60.0)
+    app.config.setdefault("TBOS_JOB_RETENTION_BATCH", 500)
+    app.retention = JobRetention(
+        app,
+        max_rows=app.config["TBOS_JOB_RETENTION_MAX_ROWS"],
+        max_age=app.config["TBOS_JOB_RETENTION_MAX_AGE"],
+        interval=app.config["TBOS_JOB_RETENTION_INTERVAL"],
+        batch_size=app.config["TBOS_JOB_RETENTION_BATCH"],
+    )
+    atexit.register(app.retention.stop, 5)
+
+    # setup device sampler, started with first request
+    app.config.setdefault("TBOS_SAMPLER_ENABLED", True)
+    app.config.setdefault("TBOS_SAMPLER_INTERVAL", 1.0)
+    app.config.setdefault("TBOS_SAMPLER_HISTORY", 300)
+    app.config.setdefault("TBOS_SAMPLER_MAX_AGE", 5.0)
+    app.config.setdefault("TBOS_SAMPLER_IDLE_INTERVAL", 30.0)
+    app.config.setdefault("TBOS_SAMPLER_IDLE_AFTER", 10.0)
+    app.sampler = DeviceSampler(
+        app,
+        interval=app.config["TBOS_SAMPLER_INTERVAL"],
+        history=app.config["TBOS_SAMPLER_HISTORY"],
+        idle_interval=app.config["TBOS_SAMPLER_IDLE_INTERVAL"],
+        idle_after=app.config["TBOS_SAMPLER_IDLE_AFTER"],
+    )
+
+    # setup event broker and runner for live ride state, stopping a ride left running with no ride page open
+    app.config.setdefault("TBOS_RIDE_IDLE_TIMEOUT", 60.0)
+    app.events = EventBroker()
+    app.ride_runner = RideRunner(app, app.events, idle_timeout=app.config["TBOS_RIDE_IDLE_TIMEOUT"])
+
+    @app.before_first_request
+    def start_background():
+        app.persistence.start()
+        app.retention.start()
+        if app.config["TBOS_SAMPLER_ENABLED"]:
+            app.sampler.start()
+
     # setup alembic migrations
     migrate = Migrate(app, db)
 
@@ -123,10 +231,78 @@ def create_app():
         """
         Fire repl_ping from embedded controller
         """
-        pyb = PyboardClient()
-        resp = pyb.repl_ping()
+        resp = app.device.run(lambda client: client.repl_ping())
         return resp
 
+    @app.route("/api/debug/device", methods=["GET", "DELETE"])
+    def debug_device():
+        """
+        Device connection health and stats
+
+        DELETE closes connections, reopened by the next command.
+        """
+        if request.method == "DELETE":
+            app.device.close()
+        health = app.device.check()
+        return jsonify(dict(app.device.stats(), health=health))
+
+    @app.route("/api/debug/sampler", methods=["GET"])
+    def debug_sampler():
+        """
+        Device sampler stats
+        """
+        return jsonify(app.sampler.stats())
+
+    @app.route("/api/debug/persistence", methods=["GET"])
+    def debug_persistence():
+        """
+        Write-behind persistence stats
+        """
+        return jsonify(app.persistence.stats())
+
+    @app.route("/api/debug/scheduler", methods=["GET"])
+    def debug_scheduler():
+        """
+        Device scheduler stats, with running and queued jobs
+        """
+        return jsonify(app.scheduler.stats())
+
+    @app.route("/api/debug/retention", methods=["GET", "POST"])
+    def debug_retention():
+        """
+        Job retention stats
+
+        POST prunes now.
+        """
+        if request.method == "POST":
+            app.retention.prune()
+        return jsonify(app.retention.stats())
+
+    @app.route("/api/debug/gpx_cache", methods=["GET", "DELETE"])
+    def debug_gpx_cache():
+        """
+        Decoded GPX track cache stats
+
+        DELETE clears the cache.
+        """
+        if request.method == "DELETE":
+            app.gpx_cache.clear()
+        return jsonify(app.gpx_cache.stats())
+
+    @app.route("/api/debug/metrics", methods=["GET", "DELETE"])
+    def debug_metrics():
+        """
+        Stage latency histograms, as JSON or Prometheus text format with ?format=prometheus
+
+        DELETE resets all histograms.
+        """
+        if request.method == "DELETE":
+            app.metrics.reset()
+            return jsonify({"msg": "metrics reset", "success": True})
+        if request.args.get("format") == "prometheus":
+            return Response(app.metrics.to_prometheus(), mimetype="text/plain; version=0.0.4")
+        return jsonify(app.metrics.to_dict())
+
     @app.route("/api/debug/error", methods=["GET", "POST", "PATCH", "DELETE"])
     def debug_error():
         """
@@ -157,6 +333,8 @@ def create_app():
         try:
             response = Heartbeat.perform_heartbeat(request)
             return jsonify(response)
+        except app.InvalidUsage:
+            raise
         except Exception as e:
             return jsonify({"error": str(e)}), 500
 
@@ -232,7 +410,79 @@ def create_app():
             ride.set_as_current()
 
         # serialize and return
-        return jsonify(ride.serialize(include_heartbeats=True))
+        max_points = validate_max_points(request.args.get("max_points", type=int))
+        return jsonify(ride.serialize(include_heartbeats=True, max_points=max_points))
+
+    @app.route("/api/ride/<ride_uuid>/chart", methods=["GET"])
+    def ride_chart(ride_uuid):
+
+        """
+        Retrieve full chart data for a Ride
+
+        Clients load this once, then merge chart deltas from heartbeats.
+
+        Query params:
+            - max_points: int, downsample each chart to at most this many points
+            - mode: str, downsampling mode, "lttb" (default) or "minmax"
+        """
+
+        # retrieve a Ride
+        ride = Ride.query.get(ride_uuid)
+        if ride is None:
+            raise app.InvalidUsage(f"ride {ride_uuid} was not found", status_code=404)
+
+        # return chart data
+        mode = request.args.get("mode", "lttb")
+        if mode not in DOWNSAMPLE_MODES:
+            raise app.InvalidUsage(f"mode must be one of {DOWNSAMPLE_MODES}", status_code=400)
+        max_points = validate_max_points(request.args.get("max_points", type=int))
+        return jsonify(ride.timeseries.chart_data(ride.completed, max_points=max_points, mode=mode))
+
+    @app.route("/api/ride/<ride_uuid>/route", methods=["GET"])
+    def ride_route(ride_uuid):
+
+        """
+        Retrieve GPX route of a Ride, simplified for map rendering
+
+        Query params:
+            - zoom: int, map zoom level, drops points deviating less than a pixel at this zoom
+            - max_points: int, maximum points to return, default TBOS_ROUTE_MAX_POINTS
+        """
+
+        # retrieve a Ride
+        ride = Ride.query.get(ride_uuid)
+        if ride is None:
+            raise app.InvalidUsage(f"ride {ride_uuid} was not found", status_code=404)
+
+        # return route
+        route = ride.get_gpx_route(
+            zoom=request.args.get("zoom", type=int),
+            max_points=request.args.get("max_points", app.config["TBOS_ROUTE_MAX_POINTS"], type=int),
+        )
+        if route is None:
+            raise app.InvalidUsage(f"ride {ride_uuid} is not a GPX ride", status_code=404)
+        return jsonify(route)
+
+    @app.route("/api/ingest", methods=["GET"])
+    def ingest_list():
+
+        """
+        List ride ingestion jobs, most recent first
+        """
+
+        return jsonify([job.to_dict() for job in app.ingest.list()])
+
+    @app.route("/api/ingest/<job_id>", methods=["GET"])
+    def ingest_retrieve(job_id):
+
+        """
+        Retrieve ride ingestion job, with stage and percent complete
+        """
+
+        job = app.ingest.get(job_id)
+        if job is None:
+            raise app.InvalidUsage(f"ingest job {job_id} was not found", status_code=404)
+        return jsonify(job.to_dict())
 
     @app.route("/api/ride/current", methods=["GET"])
     def ride_retrieve_current():
@@ -247,7 +497,69 @@ def create_app():
             raise app.InvalidUsage(f"no rides found, cannot return current", status_code=404)
 
         # serialize and return
-        return jsonify(ride.serialize(include_heartbeats=True))
+        max_points = validate_max_points(request.args.get("max_points", type=int))
+        return jsonify(ride.serialize(include_heartbeats=True, max_points=max_points))
+
+    @app.route("/api/ride/current/start", methods=["POST"])
+    def ride_current_start():
+
+        """
+        Start running current Ride server side, heartbeats are pushed to /api/ride/current/stream
+
+        If already running, settings are updated.
+
+        POST body (optional):
+        {
+            "simulate_rpm": 80,
+            "override_program": false,
+            "max_points": 1000,
+            "downsample": "lttb"
+        }
+        """
+
+        # parse payload
+        payload = request.json or {}
+
+        # retrieve current Ride
+        ride = app.active.get_ride()
+        if ride is None:
+            raise app.InvalidUsage(f"no rides found, cannot start", status_code=404)
+
+        # start
+        settings = {k: payload.get(k) for k in ["simulate_rpm", "override_program", "max_points", "downsample"]}
+        validate_max_points(settings["max_points"])
+        app.ride_runner.start(ride, settings=settings)
+        return jsonify(app.ride_runner.status())
+
+    @app.route("/api/ride/current/stop", methods=["POST"])
+    def ride_current_stop():
+
+        """
+        Stop current Ride, flushing pending writes
+        """
+
+        app.ride_runner.stop()
+        flushed = app.persistence.flush()
+        return jsonify({"msg": "ride stopped", "flushed": flushed, "success": True})
+
+    @app.route("/api/ride/current/stream", methods=["GET"])
+    def ride_current_stream():
+
+        """
+        Server-sent events stream of live ride state
+
+        Events:
+            - heartbeat: heartbeat response, as returned by /api/heartbeat with chart_delta, or chart_data if
+              downsampled
+            - ride_state: running status of ride
+            - heartbeat_error: heartbeat error
+        """
+
+        return Response(
+            app.events.stream(initial=[("ride_state", app.ride_runner.status())]),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
 
     @app.route("/api/ride/current", methods=["PATCH"])
     def ride_current_update():
@@ -271,6 +583,10 @@ def create_app():
         # save ride
         ride.save()
 
+        # drop buffered timeseries and active context, program may have changed
+        app.timeseries.discard(ride.ride_uuid)
+        app.active.invalidate()
+
         # serialize and return
         return jsonify(ride.serialize())
 
@@ -296,6 +612,10 @@ def create_app():
         # save ride
         ride.save()
 
+        # drop buffered timeseries and active context, program may have changed
+        app.timeseries.discard(ride.ride_uuid)
+        app.active.invalidate()
+
         # serialize and return
         return jsonify(ride.serialize())
 
@@ -336,7 +656,7 @@ def create_app():
         Get full status from embedded controller
         """
 
-        response = Bike.current().get_status()
+        response = app.active.get_bike().get_sampled_status(max_age=app.config["TBOS_SAMPLER_MAX_AGE"])
         return jsonify(response)
 
     @app.route("/api/bike/rm/adjust/<level>", methods=["GET"])
@@ -346,7 +666,7 @@ def create_app():
         Adjust bike resistance motor level to explicit level
         """
 
-        response = Bike.current().adjust_level(int(level))
+        response = app.active.get_bike().adjust_level(int(level))
         return jsonify(response)
 
     @app.route("/api/bike/rm/adjust/decrease", methods=["GET"])
@@ -357,7 +677,7 @@ def create_app():
         """
 
         print("decreasing level")
-        response = Bike.current().adjust_level_down()
+        response = app.active.get_bike().adjust_level_down()
         return jsonify(response)
 
     @app.route("/api/bike/rm/adjust/increase", methods=["GET"])
@@ -368,18 +688,42 @@ def create_app():
         """
 
         print("increasing level")
-        response = Bike.current().adjust_level_up()
+        response = app.active.get_bike().adjust_level_up()
         return jsonify(response)
 
     @app.route("/api/jobs", methods=["GET"])
     def api_jobs_retrieve():
 
         """
-        Return all jobs
-        TODO: this needs some limits, as this could grow quickly
+        Return jobs, newest first, a page at a time
+
+        Query params:
+            - status: filter by status, repeated or comma separated
+            - since / until: filter by timestamp_added, epoch seconds, since inclusive and until exclusive
+            - limit: page size, default 100, at most 1000
+            - cursor: next_cursor from the previous page
+            - aggregate: if true, return counts by status and elapsed stats of matching jobs instead of jobs
         """
 
-        return jsonify(PybJobQueueSchema(many=True).dump(PybJobQueue.query.all()))
+        statuses = [status for value in request.args.getlist("status") for status in value.split(",") if status]
+        query = PybJobQueue.filtered(
+            statuses=statuses,
+            since=request.args.get("since", type=int),
+            until=request.args.get("until", type=int),
+        )
+
+        if request.args.get("aggregate", "false").lower() in ["true", "1"]:
+            return jsonify(PybJobQueue.aggregate(query))
+
+        limit = request.args.get("limit", 100, type=int)
+        if not 0 < limit <= 1000:
+            raise app.InvalidUsage("limit must be between 1 and 1000", status_code=400)
+        try:
+            jobs, next_cursor = PybJobQueue.page(query, limit=limit, cursor=request.args.get("cursor"))
+        except ValueError:
+            raise app.InvalidUsage("cursor is not valid", status_code=400)
+
+        return jsonify({"jobs": PybJobQueueSchema(many=True).dump(jobs), "next_cursor": next_cursor})
 
     ######################################################################
     # GUI Routes
@@ -397,8 +741,8 @@ def create_app():
         # get current bike
         rides = Ride.query.order_by(Ride.date_start).all()
 
-        # prepare variables
-        f = {"rides": rides}
+        # prepare variables, with rides still being ingested
+        f = {"rides": rides, "ingest_jobs": [job for job in app.ingest.list() if not job.finished]}
 
         return render_template("rides.html", title="TBOS", f=f, v=str(uuid.uuid4()))
 
@@ -425,7 +769,9 @@ def create_app():
         #########################################
         elif payload["ride_type"] == "gpx":
 
-            ride = Ride.create_gpx_ride(ride_uuid, payload, request)
+            # ingest in background, ride is saved when complete
+            job = app.ingest.submit_gpx(ride_uuid, payload, request.files["gpx_file"])
+            return redirect(f"/gui/ingest/{job.job_id}")
 
         # handle unknown ride_type
         else:
@@ -438,6 +784,17 @@ def create_app():
         # redirect
         return redirect(f"/gui/ride/{ride.ride_uuid}")
 
+    @app.route("/gui/ingest/<job_id>", methods=["GET"])
+    def gui_ingest(job_id):
+
+        job = app.ingest.get(job_id)
+        if job is None:
+            return redirect("/gui/rides")
+
+        f = {"job": job}
+
+        return render_template("ingest.html", title="TBOS", f=f, v=str(uuid.uuid4()))
+
     @app.route("/gui/ride/<ride_uuid>", methods=["GET"])
     def gui_ride(ride_uuid):
 
@@ -0,0 +1,114 @@
+"""
+TBOS API GPX ingest benchmark
+
+Times the stages of GPX ride ingestion on a synthetic track, including the per-point geopy loop step distances
+were computed with before, for comparison.  Runs without the app or database, from the repository root:
+
+    python benchmarks/bench_gpx_ingest.py --points 20000
+"""
+
+import argparse
+import io
+import os
+import sys
+import time
+
+from geopy import distance
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from api.geo import FEET_PER_METER, douglas_peucker_importance, step_distances  # noqa: E402
+from api.gpx import parse_gpx  # noqa: E402
+
+
+def generate_gpx(points, lat=42.3, lon=-71.1, seed=0):
+
+    """
+    Generate GPX of a random walk track, one point per second with 1-15 m steps
+
+    :return: bytes, GPX document
+    """
+
+    rng = np.random.default_rng(seed)
+    step = rng.uniform(1, 15, points)
+    bearing = np.cumsum(rng.normal(0, 0.2, points))
+    latitudes = lat + np.cumsum(step * np.cos(bearing) / 111320)
+    longitudes = lon + np.cumsum(step * np.sin(bearing) / (111320 * np.cos(np.radians(lat))))
+    altitudes = 50 + np.cumsum(rng.normal(0, 0.2, points))
+    start = pd.Timestamp("2021-06-01T12:00:00Z").timestamp()
+
+    lines = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        '<gpx version="1.1" creator="tbos-benchmark" xmlns="http://www.topografix.com/GPX/1/1">',
+        "<trk><name>benchmark</name><trkseg>",
+    ]
+    for i in range(points):
+        timestamp = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(start + i))
+        lines.append(
+            f'<trkpt lat="{latitudes[i]:.7f}" lon="{longitudes[i]:.7f}">'
+            f"<ele>{altitudes[i]:.1f}</ele><time>{timestamp}</time></trkpt>"
+        )
+    lines.append("</trkseg></trk></gpx>")
+    return "\n".join(lines).encode()
+
+
+def geopy_step_distances(latitudes, longitudes):
+
+    # per-point loop, as step distances were computed before vectorizing
+    steps = [0.0]
+    for i in range(1, len(latitudes)):
+        a = (latitudes[i - 1], longitudes[i - 1])
+        b = (latitudes[i], longitudes[i])
+        steps.append(distance.distance(a, b).m * FEET_PER_METER)
+    return np.array(steps)
+
+
+def timed(label, func, repeat=1):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"{label:<32}{best * 1000:>12.1f} ms")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--points", type=int, default=20000, help="track points, default 20000")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per vectorized stage, best is reported")
+    parser.add_argument("--skip-geopy", action="store_true", help="skip the slow geopy loop")
+    args = parser.parse_args()
+
+    gpx = generate_gpx(args.points)
+    print(f"GPX ingest, {args.points} points, {len(gpx) / 1e6:.1f} MB")
+
+    track = timed("parse_gpx", lambda: parse_gpx(io.BytesIO(gpx)), repeat=args.repeat)
+    gpx_df = timed("dataframe", lambda: pd.DataFrame(track._asdict()), repeat=args.repeat)
+    latitudes = gpx_df.latitude.to_numpy()
+    longitudes = gpx_df.longitude.to_numpy()
+
+    results = {}
+    for method in ("haversine", "vincenty"):
+        results[method] = timed(
+            f"step_distances, {method}",
+            lambda: step_distances(latitudes, longitudes, method=method),
+            repeat=args.repeat,
+        )
+    if not args.skip_geopy:
+        results["geopy"] = timed("step_distances, geopy loop", lambda: geopy_step_distances(latitudes, longitudes))
+    timed("douglas_peucker_importance", lambda: douglas_peucker_importance(latitudes, longitudes), repeat=args.repeat)
+
+    if "geopy" in results:
+        expected = results["geopy"]
+        for method in ("haversine", "vincenty"):
+            error = np.abs(results[method] - expected)
+            relative = (results[method].sum() - expected.sum()) / expected.sum()
+            print(f"{method} vs geopy: total {relative:+.1e} relative, max step error {error.max():.1e} ft")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+TBOS API ride timeseries benchmark
+
+Times Ride.parse_recorded_timeseries() and RideTimeseries.chart_data() for 1 h, 3 h and 10 h rides, with a
+heartbeat every second and 60 s random program segments, against the per-row assembly it replaced.  Heartbeats
+are written to a temporary SQLite database, so neither the app nor db/tbos.db is touched.  From the repository
+root:
+
+    python benchmarks/bench_timeseries.py
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+
+import flask
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from api.db import db  # noqa: E402
+from api.models import Heartbeat, Ride  # noqa: E402
+from api.timeseries import RideTimeseries  # noqa: E402
+
+HOURS = (1, 3, 10)
+
+
+class NoPersistence:
+
+    # heartbeats are written directly, so nothing is pending
+    def flush(self):
+        return 0
+
+
+def create_bench_app(path):
+    bench_app = flask.Flask(__name__)
+    bench_app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{path}"
+    bench_app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    bench_app.persistence = NoPersistence()
+    db.init_app(bench_app)
+    return bench_app
+
+
+def insert_ride(duration, seed=0):
+
+    """
+    Insert a heartbeat for every second of a ride
+
+    :return: Ride, not added to session
+    """
+
+    random.seed(seed)
+    ride_uuid = str(uuid.uuid4())
+    rows = []
+    for mark in range(1, duration + 1):
+        level = random.randint(1, 20)
+        rpm = random.choice([0.0, random.uniform(40, 110)])
+        mph = round(rpm / ((20 / level) * 2.5), 2)
+        rows.append(
+            {
+                "hb_uuid": str(uuid.uuid4()),
+                "timestamp_added": mark,
+                "ride_uuid": ride_uuid,
+                "mark": mark,
+                "data": {"speed": {"mph": mph}},
+                "level": level,
+                "rpm": rpm,
+            }
+        )
+    with db.engine.begin() as conn:
+        conn.execute(Heartbeat.__table__.insert(), rows)
+    return Ride(ride_uuid=ride_uuid, duration=duration, program=Ride.generate_random_program(duration))
+
+
+def fetch_heartbeats_before(ride):
+
+    # heartbeat read as it was, with the full data column
+    return pd.read_sql(
+        f"select level, rpm, data, mark from heartbeat where ride_uuid = '{str(ride.ride_uuid)}';", db.engine
+    )
+
+
+def assemble_before(ride, hbs):
+
+    """
+    Per-row assembly parse_recorded_timeseries() used before, as a list of [program, recorded, rpm, mph]
+    """
+
+    output = [[None, None, None, None] for x in range(0, int(ride.duration))]
+    if ride.program is not None:
+        output = []
+        for segment in ride.program:
+            output.extend([[segment[0], None, None, None] for _ in range(segment[1][0], segment[1][1])])
+
+    hbs = hbs.copy()
+    hbs["mph"] = hbs.data.apply(lambda x: json.loads(x).get("speed", {}).get("mph"))
+    for hb in hbs.itertuples():
+        if pd.isna(hb.mark) or hb.mark < 1:
+            continue
+        mark = int(hb.mark)
+        while len(output) < mark:
+            output.append([None, None, None, None])
+        output[mark - 1][1] = hb.level
+        output[mark - 1][2] = hb.rpm
+        output[mark - 1][3] = hb.mph
+    return output
+
+
+def best_of(func, repeat):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+
+        # parse_recorded_timeseries() prints its own timing
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = func()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--hours", type=float, nargs="+", default=HOURS, help="ride lengths, default 1 3 10")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per measurement, best is reported")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bench_app = create_bench_app(os.path.join(tmp, "bench.db"))
+        with bench_app.app_context():
+            Heartbeat.__table__.create(db.engine)
+
+            print(f"{'ride':<14}{'assembly':>14}{'before':>12}{'after':>12}{'chart_data':>14}")
+            for hours in args.hours:
+                duration = int(hours * 60 * 60)
+                ride = insert_ride(duration)
+
+                hbs = fetch_heartbeats_before(ride)
+                _, assembly_ms = best_of(lambda: assemble_before(ride, hbs), args.repeat)
+                before, before_ms = best_of(lambda: assemble_before(ride, fetch_heartbeats_before(ride)), args.repeat)
+                after, after_ms = best_of(ride.parse_recorded_timeseries, args.repeat)
+
+                # same values, where None is NaN
+                expected = np.array(before, dtype=float).T
+                if not np.allclose(np.array(after), expected, equal_nan=True):
+                    raise AssertionError(f"{hours:g} h timeseries differs from per-row assembly")
+
+                timeseries = RideTimeseries(ride.ride_uuid, after)
+                _, chart_ms = best_of(lambda: timeseries.chart_data(duration), args.repeat)
+
+                label = f"{hours:g} h ({duration})"
+                print(f"{label:<14}{assembly_ms:>11.1f} ms{before_ms:>9.1f} ms{after_ms:>9.1f} ms{chart_ms:>11.1f} ms")
+
+    print("assembly: per-row assembly alone, before / after: parse_recorded_timeseries() including the heartbeat query")
+
+
+if __name__ == "__main__":
+    main()
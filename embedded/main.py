@@ -27,6 +27,86 @@ def time_elapsed(t0):
     return (time.ticks_ms() / 1000) - (t0 / 1000)
 
 
+def handle_request(request):
+
+    """
+    Handle a single request, returning response and LCD lines
+    """
+
+    # init LCD outputs
+    l1 = None
+    l2 = None
+
+    # init response
+    response = {"error": None, "sender": "pyboard"}
+
+    try:
+
+        # handle LCD tasks
+        if request.get("lcd", None) is not None:
+            l1 = request["lcd"]["l1"]
+            l2 = request["lcd"]["l2"]
+
+        # handle level adjustments
+        elif request.get("level", None) is not None:
+            pyb.LED(2).on()
+            rm = goto_level(
+                request.get("level", None),
+                request.get("lower_bound", 100),
+                request.get("upper_bound", 3800),
+                request.get("pwm", 60),
+                request.get("sweep_delay", 0.006),
+                request.get("settle_threshold", 10),
+                request.get("explicit_target", None),
+                debug=False,
+            )
+            pyb.LED(2).off()
+
+            # log
+            l1 = "level adjust"
+            l2 = "l:%s s:%s" % (str(int(rm["level"])), str(int(rm["current"])))
+
+            # update response
+            response.update({"request": request, "rm": rm})
+
+        # else, assume heartbeat for status
+        else:
+
+            # tag as heartbeat
+            response["hb"] = True
+
+            # get rm status
+            pyb.LED(2).on()
+            rm = rm_status(
+                request.get("lower_bound", 100),
+                request.get("upper_bound", 3800),
+            )
+            pyb.LED(2).off()
+
+            # get rpm
+            pyb.LED(4).on()
+            rpm = get_rpm()
+            pyb.LED(4).off()
+
+            # log heartbeat
+            l1 = "hb l%s" % (str(int(rm["level"])))
+            l2 = "rpm%s" % (str(int(rpm["rpm"])))
+
+            # update response
+            response.update({"request": request, "rm": rm, "rpm": rpm})
+
+    except Exception as e:
+
+        # log error to LCD
+        l1 = "ERROR: %s" % str(e)[:9]
+        l2 = str(e)[9:]
+
+        # update response
+        response.update({"error": str(e), "request": request})
+
+    return response, l1, l2
+
+
 # init lcd
 lcd = init_lcd()
 lcd.clear()
@@ -58,11 +138,8 @@ while True:
         l1 = None
         l2 = None
 
-        # init raw_response
-        raw_response = None
-
-        # init response
-        response = {"error": None, "sender": "pyboard"}
+        # init raw_input
+        raw_input = None
 
         try:
             # toggle serial work LED
@@ -80,65 +157,29 @@ while True:
             except:
                 raise Exception("could not parse input JSON")
 
+            # handle batch frame, a JSON array of requests run in sequence until the first error, with one array
+            # of responses returned
+            if isinstance(request, list):
+                response = []
+                for item in request:
+                    t1 = time.ticks_ms()
+                    item_response, l1, l2 = handle_request(item)
+                    item_response.update({"elapsed": time_elapsed(t1)})
+                    response.append(item_response)
+                    if item_response["error"] is not None:
+                        break
+
             # if serial message is sent by pyboard, ignore
-            if request.get("sender", None) == "pyboard":
+            elif request.get("sender", None) == "pyboard":
                 lcd.simple_write("self serial:", "ignoring...")
                 pyb.delay(1000)
                 lcd.clear()
                 continue
 
-            # handle LCD tasks
-            elif request.get("lcd", None) is not None:
-                l1 = request["lcd"]["l1"]
-                l2 = request["lcd"]["l2"]
-
-            # handle level adjustments
-            elif request.get("level", None) is not None:
-                pyb.LED(2).on()
-                rm = goto_level(
-                    request.get("level", None),
-                    request.get("lower_bound", 100),
-                    request.get("upper_bound", 3800),
-                    request.get("pwm", 60),
-                    request.get("sweep_delay", 0.006),
-                    request.get("settle_threshold", 10),
-                    request.get("explicit_target", None),
-                    debug=False,
-                )
-                pyb.LED(2).off()
-
-                # log
-                l1 = "level adjust"
-                l2 = "l:%s s:%s" % (str(int(rm["level"])), str(int(rm["current"])))
-
-                # update response
-                response.update({"request": request, "rm": rm})
-
-            # else, assume heartbeat for status
+            # handle single request
             else:
-
-                # tag as heartbeat
-                response["hb"] = True
-
-                # get rm status
-                pyb.LED(2).on()
-                rm = rm_status(
-                    request.get("lower_bound", 100),
-                    request.get("upper_bound", 3800),
-                )
-                pyb.LED(2).off()
-
-                # get rpm
-                pyb.LED(4).on()
-                rpm = get_rpm()
-                pyb.LED(4).off()
-
-                # log heartbeat
-                l1 = "hb l%s" % (str(int(rm["level"])))
-                l2 = "rpm%s" % (str(int(rpm["rpm"])))
-
-                # update response
-                response.update({"request": request, "rm": rm, "rpm": rpm})
+                response, l1, l2 = handle_request(request)
+                response.update({"elapsed": time_elapsed(t0)})
 
         except Exception as e:
 
@@ -146,11 +187,8 @@ while True:
             l1 = "ERROR: %s" % str(e)[:9]
             l2 = str(e)[9:]
 
-            # update response
-            response.update({"error": str(e), "raw_input": raw_input})
-
-        # append elapsed
-        response.update({"elapsed": time_elapsed(t0)})
+            # error response
+            response = {"error": str(e), "sender": "pyboard", "raw_input": raw_input, "elapsed": time_elapsed(t0)}
 
         # write response over serial
         serial_response(response)
@@ -0,0 +1,81 @@
+"""ride summary columns
+
+Revision ID: 3f6b9c0d1e82
+Revises: e2a7d5b83c19
+Create Date: 2026-10-17 11:26:53.904127
+
+"""
+import json
+import zlib
+
+from alembic import op
+import numpy as np
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "3f6b9c0d1e82"
+down_revision = "e2a7d5b83c19"
+branch_labels = None
+depends_on = None
+
+# copied from api.geo and api.gpx, as of this revision
+FEET_PER_METER = 1 / 0.3048
+
+
+def summarize_track(latitude, longitude, altitude, cum_distance):
+
+    """
+    Summary of a track, point_count, total_distance (feet), bbox and elevation_gain (feet), see api.gpx
+    """
+
+    if len(latitude) == 0:
+        return {"point_count": 0, "total_distance": 0.0, "bbox": None, "elevation_gain": 0.0}
+
+    latitude, longitude = np.asarray(latitude, dtype=float), np.asarray(longitude, dtype=float)
+    climbs = np.diff(np.asarray(altitude, dtype=float))
+    return {
+        "point_count": len(latitude),
+        "total_distance": float(cum_distance[-1]),
+        "bbox": [[float(latitude.max()), float(longitude.min())], [float(latitude.min()), float(longitude.max())]],
+        "elevation_gain": float(climbs[climbs > 0].sum() * FEET_PER_METER),
+    }
+
+
+def upgrade():
+    with op.batch_alter_table("ride") as batch_op:
+        batch_op.add_column(sa.Column("ride_type", sa.String(), nullable=False, server_default="random_duration"))
+        batch_op.add_column(sa.Column("point_count", sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column("total_distance", sa.Float(), nullable=False, server_default="0.0"))
+        batch_op.add_column(sa.Column("bbox", sa.JSON(), nullable=True))
+        batch_op.add_column(sa.Column("elevation_gain", sa.Float(), nullable=True))
+
+    # backfill summary for rides with a GPX track
+    conn = op.get_bind()
+    tracks = conn.execute(
+        sa.text("select ride_uuid, latitude, longitude, altitude, cum_distance from gpx_track")
+    ).fetchall()
+    for track in tracks:
+        summary = summarize_track(
+            *(
+                np.frombuffer(zlib.decompress(track[name]), dtype="<f8")
+                for name in ("latitude", "longitude", "altitude", "cum_distance")
+            )
+        )
+        conn.execute(
+            sa.text(
+                "update ride set ride_type = 'gpx', point_count = :point_count, total_distance = :total_distance, "
+                "bbox = :bbox, elevation_gain = :elevation_gain where ride_uuid = :ride_uuid"
+            ),
+            dict(summary, bbox=json.dumps(summary["bbox"]), ride_uuid=track["ride_uuid"]),
+        )
+        print(f"summarized GPX ride {track['ride_uuid']}")
+
+
+def downgrade():
+    with op.batch_alter_table("ride") as batch_op:
+        batch_op.drop_column("elevation_gain")
+        batch_op.drop_column("bbox")
+        batch_op.drop_column("total_distance")
+        batch_op.drop_column("point_count")
+        batch_op.drop_column("ride_type")
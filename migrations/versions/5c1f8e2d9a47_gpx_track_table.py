@@ -0,0 +1,108 @@
+"""gpx_track table
+
+Revision ID: 5c1f8e2d9a47
+Revises: a4403b8279da
+Create Date: 2026-10-17 08:12:41.204311
+
+"""
+import uuid
+import zlib
+
+from alembic import op
+import numpy as np
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "5c1f8e2d9a47"
+down_revision = "a4403b8279da"
+branch_labels = None
+depends_on = None
+
+# copied from api.gpx.TRACK_DTYPES, as of this revision
+TRACK_DTYPES = {
+    "time": "<i8",
+    "latitude": "<f8",
+    "longitude": "<f8",
+    "altitude": "<f8",
+    "step_distance": "<f8",
+    "cum_distance": "<f8",
+    "mark": "<i8",
+}
+
+
+def upgrade():
+    gpx_track = op.create_table(
+        "gpx_track",
+        sa.Column("ride_uuid", sa.String(), nullable=False),
+        sa.Column("point_count", sa.Integer(), nullable=False),
+        sa.Column("time", sa.LargeBinary(), nullable=False),
+        sa.Column("latitude", sa.LargeBinary(), nullable=False),
+        sa.Column("longitude", sa.LargeBinary(), nullable=False),
+        sa.Column("altitude", sa.LargeBinary(), nullable=False),
+        sa.Column("step_distance", sa.LargeBinary(), nullable=False),
+        sa.Column("cum_distance", sa.LargeBinary(), nullable=False),
+        sa.Column("mark", sa.LargeBinary(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["ride_uuid"],
+            ["ride.ride_uuid"],
+        ),
+        sa.PrimaryKeyConstraint("ride_uuid"),
+    )
+
+    # convert gpx_data points, one ride at a time
+    conn = op.get_bind()
+    columns = ", ".join(TRACK_DTYPES)
+    ride_uuids = [row[0] for row in conn.execute(sa.text("select distinct ride_uuid from gpx_data"))]
+    for ride_uuid in ride_uuids:
+        rows = conn.execute(
+            sa.text(f"select {columns} from gpx_data where ride_uuid = :ride_uuid order by time"),
+            {"ride_uuid": ride_uuid},
+        ).fetchall()
+        values = {"ride_uuid": ride_uuid, "point_count": len(rows)}
+        for idx, (name, dtype) in enumerate(TRACK_DTYPES.items()):
+            array = np.array([np.nan if row[idx] is None else row[idx] for row in rows], dtype=float)
+            values[name] = zlib.compress(np.ascontiguousarray(array, dtype=dtype).tobytes())
+        conn.execute(gpx_track.insert(), values)
+        print(f"converted {len(rows)} GPX points for ride {ride_uuid}")
+
+    op.drop_table("gpx_data")
+
+
+def downgrade():
+    gpx_data = op.create_table(
+        "gpx_data",
+        sa.Column("point_uuid", sa.String(), nullable=False),
+        sa.Column("ride_uuid", sa.String(), nullable=False),
+        sa.Column("time", sa.Integer(), nullable=False),
+        sa.Column("latitude", sa.Float(), nullable=False),
+        sa.Column("longitude", sa.Float(), nullable=False),
+        sa.Column("altitude", sa.Float(), nullable=False),
+        sa.Column("step_distance", sa.Float(), nullable=True),
+        sa.Column("cum_distance", sa.Float(), nullable=True),
+        sa.Column("mark", sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(
+            ["ride_uuid"],
+            ["ride.ride_uuid"],
+        ),
+        sa.PrimaryKeyConstraint("point_uuid"),
+    )
+
+    # expand tracks back to one row per point
+    conn = op.get_bind()
+    for track in conn.execute(sa.text(f"select ride_uuid, {', '.join(TRACK_DTYPES)} from gpx_track")).fetchall():
+        arrays = {
+            name: np.frombuffer(zlib.decompress(track[name]), dtype=dtype) for name, dtype in TRACK_DTYPES.items()
+        }
+        rows = [
+            dict(
+                {name: arrays[name][idx].item() for name in TRACK_DTYPES},
+                point_uuid=str(uuid.uuid4()),
+                ride_uuid=track["ride_uuid"],
+            )
+            for idx in range(len(arrays["time"]))
+        ]
+        if rows:
+            conn.execute(gpx_data.insert(), rows)
+
+    op.drop_table("gpx_track")
@@ -0,0 +1,40 @@
+"""pyb_job_queue elapsed and indexes for retention and paging
+
+Revision ID: 8d5a2c7e4f60
+Revises: 3f6b9c0d1e82
+Create Date: 2026-10-17 14:12:40.318506
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "8d5a2c7e4f60"
+down_revision = "3f6b9c0d1e82"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # NOTE: not batch mode, as recreating the table would lose the where clause of partial index pyb_job_running_idx
+    op.add_column("pyb_job_queue", sa.Column("elapsed", sa.Float(), nullable=True))
+    op.create_index("ix_pyb_job_queue_status_timestamp_added", "pyb_job_queue", ["status", "timestamp_added"])
+    op.create_index("ix_pyb_job_queue_timestamp_added", "pyb_job_queue", ["timestamp_added"])
+
+
+def downgrade():
+    op.drop_index("ix_pyb_job_queue_timestamp_added", table_name="pyb_job_queue")
+    op.drop_index("ix_pyb_job_queue_status_timestamp_added", table_name="pyb_job_queue")
+
+    # drop and recreate partial index around batch mode, see upgrade
+    op.execute("drop index if exists pyb_job_running_idx")
+    with op.batch_alter_table("pyb_job_queue") as batch_op:
+        batch_op.drop_column("elapsed")
+    op.execute(
+        """
+        create unique index if not exists
+        pyb_job_running_idx on pyb_job_queue (status)
+        where status = 'running'
+    """
+    )
@@ -0,0 +1,105 @@
+"""gpx_track importance
+
+Revision ID: 9b3e71c04d2f
+Revises: 5c1f8e2d9a47
+Create Date: 2026-10-17 09:02:17.551903
+
+"""
+import math
+import zlib
+
+from alembic import op
+import numpy as np
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "9b3e71c04d2f"
+down_revision = "5c1f8e2d9a47"
+branch_labels = None
+depends_on = None
+
+# copied from api.geo, as of this revision
+EARTH_RADIUS = 6371008.8
+SHORT_SPAN = 32
+
+
+def douglas_peucker_importance(latitudes, longitudes):
+
+    """
+    Douglas-Peucker importance of each point of a track, in meters, see api.geo
+    """
+
+    latitudes = np.asarray(latitudes, dtype=float)
+    longitudes = np.asarray(longitudes, dtype=float)
+    n = len(latitudes)
+    importance = np.zeros(n)
+    if n == 0:
+        return importance
+    importance[0] = importance[-1] = np.inf
+    if n < 3:
+        return importance
+
+    # project to meters
+    lat0 = np.radians(np.nanmean(latitudes))
+    x = np.radians(longitudes) * EARTH_RADIUS * np.cos(lat0)
+    y = np.radians(latitudes) * EARTH_RADIUS
+
+    # spans of (start, end, importance of splitting point), end inclusive
+    spans = [(0, n - 1, np.inf)]
+    xs, ys = x.tolist(), y.tolist()
+    while spans:
+        start, end, cap = spans.pop()
+        if end - start < 2:
+            continue
+
+        # perpendicular distance of interior points to chord, or distance to start if chord is a point
+        dx, dy = xs[end] - xs[start], ys[end] - ys[start]
+        chord = math.hypot(dx, dy)
+        if end - start <= SHORT_SPAN:
+            # plain loop, cheaper than numpy for the many short spans
+            split, distance = start + 1, -1.0
+            for idx in range(start + 1, end):
+                px, py = xs[idx] - xs[start], ys[idx] - ys[start]
+                d = abs(dx * py - dy * px) / chord if chord > 0 else math.hypot(px, py)
+                if d > distance:
+                    split, distance = idx, d
+        else:
+            px, py = x[start + 1 : end] - x[start], y[start + 1 : end] - y[start]
+            if chord > 0:
+                distances = np.abs(dx * py - dy * px) / chord
+            else:
+                distances = np.hypot(px, py)
+            idx = int(np.argmax(distances))
+            split, distance = start + 1 + idx, float(distances[idx])
+
+        value = min(distance, cap)
+        importance[split] = value
+        spans.append((start, split, value))
+        spans.append((split, end, value))
+
+    return importance
+
+
+def upgrade():
+    with op.batch_alter_table("gpx_track") as batch_op:
+        batch_op.add_column(sa.Column("importance", sa.LargeBinary(), nullable=True))
+
+    # backfill Douglas-Peucker importance for existing tracks
+    conn = op.get_bind()
+    for track in conn.execute(sa.text("select ride_uuid, latitude, longitude from gpx_track")).fetchall():
+        latitudes = np.frombuffer(zlib.decompress(track["latitude"]), dtype="<f8")
+        longitudes = np.frombuffer(zlib.decompress(track["longitude"]), dtype="<f8")
+        importance = douglas_peucker_importance(latitudes, longitudes).astype("<f4")
+        conn.execute(
+            sa.text("update gpx_track set importance = :importance where ride_uuid = :ride_uuid"),
+            {"importance": zlib.compress(importance.tobytes()), "ride_uuid": track["ride_uuid"]},
+        )
+
+    with op.batch_alter_table("gpx_track") as batch_op:
+        batch_op.alter_column("importance", existing_type=sa.LargeBinary(), nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table("gpx_track") as batch_op:
+        batch_op.drop_column("importance")
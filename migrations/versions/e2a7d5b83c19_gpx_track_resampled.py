@@ -0,0 +1,76 @@
+"""gpx_track resampled to 1 Hz
+
+Revision ID: e2a7d5b83c19
+Revises: 9b3e71c04d2f
+Create Date: 2026-10-17 10:41:08.117245
+
+"""
+import zlib
+
+from alembic import op
+import numpy as np
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "e2a7d5b83c19"
+down_revision = "9b3e71c04d2f"
+branch_labels = None
+depends_on = None
+
+# copied from api.gpx, as of this revision
+RESAMPLED_COLUMNS = ["latitude", "longitude", "altitude", "cum_distance"]
+
+
+def resample_track(mark, columns):
+
+    """
+    Resample track columns to one point per second of mark, by linear interpolation, see api.gpx
+    """
+
+    mark = np.asarray(mark)
+    if len(mark) == 0:
+        return {f"resampled_{name}": np.empty(0) for name in columns}
+
+    # first point of each second, in time order
+    order = np.argsort(mark, kind="stable")
+    seconds, first = np.unique(mark[order], return_index=True)
+    points = order[first]
+
+    grid = np.arange(int(seconds[-1]) + 1)
+    return {
+        f"resampled_{name}": np.interp(grid, seconds, np.asarray(values, dtype=float)[points])
+        for name, values in columns.items()
+    }
+
+
+def upgrade():
+    with op.batch_alter_table("gpx_track") as batch_op:
+        for name in RESAMPLED_COLUMNS:
+            batch_op.add_column(sa.Column(f"resampled_{name}", sa.LargeBinary(), nullable=True))
+
+    # backfill resampled columns for existing tracks
+    conn = op.get_bind()
+    tracks = conn.execute(sa.text(f"select ride_uuid, mark, {', '.join(RESAMPLED_COLUMNS)} from gpx_track")).fetchall()
+    for track in tracks:
+        mark = np.frombuffer(zlib.decompress(track["mark"]), dtype="<i8")
+        columns = {name: np.frombuffer(zlib.decompress(track[name]), dtype="<f8") for name in RESAMPLED_COLUMNS}
+        resampled = resample_track(mark, columns)
+        values = {name: zlib.compress(array.astype("<f8").tobytes()) for name, array in resampled.items()}
+        conn.execute(
+            sa.text(
+                f"update gpx_track set {', '.join(f'{name} = :{name}' for name in values)} where ride_uuid = :ride_uuid"
+            ),
+            dict(values, ride_uuid=track["ride_uuid"]),
+        )
+        print(f"resampled GPX track for ride {track['ride_uuid']} to {len(resampled['resampled_latitude'])} points")
+
+    with op.batch_alter_table("gpx_track") as batch_op:
+        for name in RESAMPLED_COLUMNS:
+            batch_op.alter_column(f"resampled_{name}", existing_type=sa.LargeBinary(), nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table("gpx_track") as batch_op:
+        for name in RESAMPLED_COLUMNS:
+            batch_op.drop_column(f"resampled_{name}")
@@ -0,0 +1,33 @@
+"""
+TBOS API test fixtures
+"""
+
+import flask
+import pytest
+
+from api.db import db
+
+# register all tables for create_all()
+import api.models  # noqa: F401
+from api.persistence import WriteBehind
+
+
+@pytest.fixture
+def app(tmp_path):
+
+    """
+    Bare app on a temporary SQLite database with all tables, without the background services of create_app()
+    """
+
+    app = flask.Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{tmp_path / 'tbos.db'}"
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    db.init_app(app)
+    app.db = db
+
+    # Ride and Bike apply pending writes as they load
+    app.persistence = WriteBehind(app, mode="sync")
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
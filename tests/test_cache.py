@@ -0,0 +1,85 @@
+"""
+TBOS API cache tests
+"""
+
+import numpy as np
+
+from api.cache import TrackCache
+
+
+def track(n):
+
+    # n float64 points, 8 * n bytes
+    return (np.zeros(n),)
+
+
+class Loader:
+
+    """
+    Returns tracks by ride_uuid, counting loads
+    """
+
+    def __init__(self, tracks):
+        self.tracks = tracks
+        self.loads = []
+
+    def __call__(self, ride_uuid):
+        self.loads.append(ride_uuid)
+        return self.tracks.get(ride_uuid)
+
+
+def test_hit_does_not_reload():
+    loader = Loader({"a": track(10)})
+    cache = TrackCache(max_bytes=1000)
+    first = cache.get("a", loader)
+    assert cache.get("a", loader) is first
+    assert loader.loads == ["a"]
+    assert (cache.stats()["hits"], cache.stats()["misses"]) == (1, 1)
+
+
+def test_missing_track_cached_as_none():
+    loader = Loader({})
+    cache = TrackCache(max_bytes=1000)
+    assert cache.get("a", loader) is None
+    assert cache.get("a", loader) is None
+    assert loader.loads == ["a"]
+    assert cache.stats()["entries"] == 1 and cache.stats()["tracks"] == 0
+
+
+def test_least_recently_used_evicted():
+    loader = Loader({name: track(40) for name in "abcd"})
+    cache = TrackCache(max_bytes=1000)
+    cache.get("a", loader)
+    cache.get("b", loader)
+    cache.get("c", loader)
+    cache.get("a", loader)
+
+    # b is least recently used
+    cache.get("d", loader)
+    assert list(cache.entries) == ["c", "a", "d"]
+    assert cache.stats()["bytes"] == 3 * 320
+    assert cache.stats()["evictions"] == 1
+
+
+def test_track_larger_than_cache_not_kept():
+    loader = Loader({"a": track(10), "big": track(200)})
+    cache = TrackCache(max_bytes=1000)
+    cache.get("a", loader)
+    assert len(cache.get("big", loader)[0]) == 200
+    assert list(cache.entries) == ["a"]
+    assert cache.stats()["bytes"] == 80
+
+
+def test_invalidate_and_put_keep_bytes():
+    loader = Loader({"a": track(10)})
+    cache = TrackCache(max_bytes=1000)
+    cache.get("a", loader)
+    cache.put("a", track(20))
+    assert cache.stats()["bytes"] == 160
+    cache.invalidate("a")
+    cache.invalidate("missing")
+    assert cache.stats()["bytes"] == 0
+    cache.get("a", loader)
+    assert loader.loads == ["a", "a"]
+    cache.clear()
+    assert cache.stats()["entries"] == 0 and cache.stats()["bytes"] == 0
@@ -0,0 +1,78 @@
+"""
+TBOS API downsampling tests
+"""
+
+import math
+import random
+
+import pytest
+
+from api.downsample import MODES, lttb, minmax, select_indices
+
+
+def noisy_series(n, seed=0):
+    rng = random.Random(seed)
+    return [10 + 5 * math.sin(i / 50) + rng.uniform(-1, 1) for i in range(n)]
+
+
+@pytest.mark.parametrize("func", [lttb, minmax])
+@pytest.mark.parametrize("threshold", [0, 1, 2, 3, 4, 5, 10, 99, 500])
+def test_at_most_threshold(func, threshold):
+    kept = func(noisy_series(1000), threshold)
+    assert len(kept) <= threshold
+    assert kept == sorted(set(kept))
+
+
+@pytest.mark.parametrize("func", [lttb, minmax])
+def test_keeps_first_and_last(func):
+    kept = func(noisy_series(1000), 50)
+    assert kept[0] == 0
+    assert kept[-1] == 999
+
+
+@pytest.mark.parametrize("func", [lttb, minmax])
+def test_short_series_kept_whole(func):
+    assert func([1, 2, 3], 10) == [0, 1, 2]
+    assert func([1, 2], 1) == [0, 1]
+
+
+def test_lttb_keeps_spike():
+    values = [0.0] * 1000
+    values[537] = 100.0
+    assert 537 in lttb(values, 20)
+
+
+def test_minmax_keeps_bucket_extremes():
+    values = [0.0] * 1000
+    values[300], values[301] = 100.0, -100.0
+    kept = minmax(values, 20)
+    assert 300 in kept and 301 in kept
+
+
+@pytest.mark.parametrize("func", [lttb, minmax])
+def test_gaps_skipped(func):
+    values = [v if i % 2 == 0 else None for i, v in enumerate(noisy_series(1001))]
+    kept = func(values, 60)
+    assert all(values[i] is not None for i in kept)
+
+
+@pytest.mark.parametrize("mode", MODES)
+@pytest.mark.parametrize("max_points", [1, 2, 3, 4, 5, 6, 7, 60, 999])
+def test_select_indices_at_most_max_points(mode, max_points):
+    series = [noisy_series(1000, seed=0), noisy_series(1000, seed=1)]
+    kept = select_indices(series, max_points, mode=mode)
+    assert 0 < len(kept) <= max_points
+    assert kept == sorted(set(kept))
+    assert kept[0] == 0
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_select_indices_not_downsampled(mode):
+    series = [noisy_series(100), noisy_series(100, seed=1)]
+    assert select_indices(series, None, mode=mode) == list(range(100))
+    assert select_indices(series, 100, mode=mode) == list(range(100))
+
+
+def test_select_indices_unknown_mode():
+    with pytest.raises(ValueError):
+        select_indices([noisy_series(100)], 10, mode="mean")
@@ -0,0 +1,177 @@
+"""
+TBOS API geo tests
+"""
+
+from geopy import distance
+import numpy as np
+import pytest
+
+from api.geo import FEET_PER_METER, TrackPositioner, haversine, step_distances, vincenty
+
+
+def random_walk(lat, lon, n=2000, seed=0):
+
+    # track of n points with 1-15 m steps in random directions, as recorded by a GPS
+    rng = np.random.default_rng(seed)
+    step = rng.uniform(1, 15, n - 1)
+    bearing = rng.uniform(0, 2 * np.pi, n - 1)
+    dlat = step * np.cos(bearing) / 111320
+    dlon = step * np.sin(bearing) / (111320 * np.cos(np.radians(lat)))
+    latitudes = lat + np.concatenate([[0.0], np.cumsum(dlat)])
+    longitudes = lon + np.concatenate([[0.0], np.cumsum(dlon)])
+    return latitudes, longitudes
+
+
+def geopy_steps(latitudes, longitudes, func):
+    points = list(zip(latitudes, longitudes))
+    return np.array([func(a, b).m * FEET_PER_METER for a, b in zip(points[:-1], points[1:])])
+
+
+@pytest.mark.parametrize("lat, lon", [(42.3, -71.1), (0.0, 10.0), (64.8, -147.7)])
+def test_haversine_matches_geopy_great_circle(lat, lon):
+    latitudes, longitudes = random_walk(lat, lon)
+    expected = geopy_steps(latitudes, longitudes, distance.great_circle)
+    actual = haversine(latitudes[:-1], longitudes[:-1], latitudes[1:], longitudes[1:])
+    np.testing.assert_allclose(actual, expected, rtol=1e-6, atol=1e-6)
+
+
+@pytest.mark.parametrize("lat, lon", [(42.3, -71.1), (0.0, 10.0), (64.8, -147.7)])
+def test_haversine_within_half_percent_of_geopy_geodesic(lat, lon):
+    latitudes, longitudes = random_walk(lat, lon)
+    expected = geopy_steps(latitudes, longitudes, distance.geodesic)
+    actual = haversine(latitudes[:-1], longitudes[:-1], latitudes[1:], longitudes[1:])
+    assert abs(actual.sum() - expected.sum()) / expected.sum() < 0.005
+
+
+@pytest.mark.parametrize("lat, lon", [(42.3, -71.1), (0.0, 10.0), (64.8, -147.7)])
+def test_vincenty_matches_geopy_geodesic(lat, lon):
+    latitudes, longitudes = random_walk(lat, lon)
+    expected = geopy_steps(latitudes, longitudes, distance.geodesic)
+    actual = vincenty(latitudes[:-1], longitudes[:-1], latitudes[1:], longitudes[1:])
+
+    # within a thousandth of an inch per step
+    np.testing.assert_allclose(actual, expected, rtol=1e-9, atol=1e-4)
+
+
+def test_vincenty_long_distances_match_geopy_geodesic():
+    pairs = [((42.3, -71.1), (51.5, -0.1)), ((-33.9, 151.2), (35.7, 139.7)), ((0.0, 0.0), (0.0, 90.0))]
+    expected = np.array([distance.geodesic(a, b).m * FEET_PER_METER for a, b in pairs])
+    (lat1, lon1), (lat2, lon2) = (np.array(points).T for points in zip(*pairs))
+    np.testing.assert_allclose(vincenty(lat1, lon1, lat2, lon2), expected, rtol=1e-9)
+
+
+def test_vincenty_falls_back_to_haversine_when_nearly_antipodal():
+    actual = vincenty([0.0], [0.0], [0.5], [179.7])
+    assert np.isfinite(actual).all()
+    np.testing.assert_allclose(actual, haversine([0.0], [0.0], [0.5], [179.7]))
+
+
+@pytest.mark.parametrize("method, func", [("haversine", distance.great_circle), ("vincenty", distance.geodesic)])
+def test_step_distances(method, func):
+    latitudes, longitudes = random_walk(42.3, -71.1, n=100)
+    steps = step_distances(latitudes, longitudes, method=method)
+    assert steps.shape == (100,)
+    assert steps[0] == 0.0
+    np.testing.assert_allclose(steps[1:], geopy_steps(latitudes, longitudes, func), rtol=1e-6, atol=1e-4)
+
+
+def test_step_distances_short_tracks():
+    assert step_distances([], []).tolist() == []
+    assert step_distances([42.3], [-71.1]).tolist() == [0.0]
+
+
+def test_step_distances_unknown_method():
+    with pytest.raises(ValueError):
+        step_distances([42.3, 42.4], [-71.1, -71.1], method="flat")
+
+
+def track(n=500, seed=0, stops=True):
+
+    # track with irregular marks, where repeated points are stops
+    rng = np.random.default_rng(seed)
+    latitudes, longitudes = random_walk(42.3, -71.1, n=n, seed=seed)
+    if stops:
+        moving = np.concatenate([[True], rng.random(n - 1) >= 0.1])
+        latitudes, longitudes = (
+            x[np.maximum.accumulate(np.where(moving, np.arange(n), 0))] for x in (latitudes, longitudes)
+        )
+    steps = haversine(latitudes[:-1], longitudes[:-1], latitudes[1:], longitudes[1:])
+    mark = np.cumsum(rng.choice([1, 1, 2, 5], n)) - 1
+    altitude = 100 + np.cumsum(rng.normal(0, 0.5, n))
+    return np.concatenate([[0.0], np.cumsum(steps)]), latitudes, longitudes, altitude, mark
+
+
+def scan_at_distance(cum_distance, distance):
+
+    # linear scan positioning, the last point before distance, as a stop is positioned at its arrival
+    idx = 0
+    for i in range(len(cum_distance) - 1):
+        if cum_distance[i] < distance:
+            idx = i
+    span = cum_distance[idx + 1] - cum_distance[idx]
+    return idx, min(max((distance - cum_distance[idx]) / span, 0.0), 1.0) if span > 0 else 0.0
+
+
+def test_positioner_at_distance_matches_scan():
+    cum_distance, latitudes, longitudes, altitude, mark = track()
+    positioner = TrackPositioner(cum_distance, latitudes, longitudes, altitude, mark)
+    rng = np.random.default_rng(1)
+    for distance in np.concatenate([rng.uniform(0, cum_distance[-1], 200), cum_distance[::25]]):
+        idx, fraction = scan_at_distance(cum_distance, distance)
+        position = positioner.at_distance(distance)
+        assert (position.segment, position.fraction) == (idx, pytest.approx(fraction))
+        assert position.distance == pytest.approx(distance)
+        expected = latitudes[idx] + (latitudes[idx + 1] - latitudes[idx]) * fraction
+        assert position.latitude == pytest.approx(expected)
+
+
+def test_positioner_stop_at_arrival():
+    cum_distance = np.array([0.0, 10.0, 10.0, 10.0, 20.0])
+    latitudes = np.array([42.0, 42.001, 42.001, 42.001, 42.002])
+    longitudes = np.full(5, -71.0)
+    positioner = TrackPositioner(cum_distance, latitudes, longitudes)
+    position = positioner.at_distance(10.0)
+    assert (position.segment, position.fraction) == (0, 1.0)
+    assert position.latitude == pytest.approx(42.001)
+
+    # heading north into and through the stop
+    assert positioner.bearing(0) == pytest.approx(0.0, abs=1e-6)
+    assert positioner.bearing(2) == pytest.approx(0.0, abs=1e-6)
+
+
+def test_positioner_at_mark():
+    cum_distance, latitudes, longitudes, altitude, mark = track()
+    positioner = TrackPositioner(cum_distance, latitudes, longitudes, altitude, mark)
+    for i in range(0, len(mark) - 1, 7):
+        position = positioner.at_mark(mark[i])
+        assert position.latitude == pytest.approx(latitudes[i])
+        assert position.mark == pytest.approx(mark[i])
+        halfway = positioner.at_mark((mark[i] + mark[i + 1]) / 2)
+        assert (halfway.segment, halfway.fraction) == (i, pytest.approx(0.5))
+        assert halfway.altitude == pytest.approx((altitude[i] + altitude[i + 1]) / 2)
+
+
+def test_positioner_at_mark_one_second_points():
+    cum_distance, latitudes, longitudes, altitude, _ = track(stops=False)
+    positioner = TrackPositioner(cum_distance, latitudes, longitudes, altitude)
+    position = positioner.at_mark(10.25)
+    assert (position.segment, position.fraction, position.mark) == (10, 0.25, 10.25)
+    assert position.distance == pytest.approx(cum_distance[10] + (cum_distance[11] - cum_distance[10]) * 0.25)
+
+
+def test_positioner_clamped_to_track():
+    cum_distance, latitudes, longitudes, altitude, mark = track()
+    positioner = TrackPositioner(cum_distance, latitudes, longitudes, altitude, mark)
+    for position in (positioner.at_distance(-5.0), positioner.at_mark(-5.0)):
+        assert position.latitude == pytest.approx(latitudes[0])
+    for position in (positioner.at_distance(cum_distance[-1] + 100), positioner.at_mark(mark[-1] + 100)):
+        assert position.latitude == pytest.approx(latitudes[-1])
+        assert position.fraction == 1.0
+
+
+def test_positioner_short_tracks():
+    empty = TrackPositioner(np.array([]), np.array([]), np.array([]))
+    assert empty.at_distance(0.0) is None and empty.at_mark(0.0) is None
+    single = TrackPositioner(np.array([0.0]), np.array([42.0]), np.array([-71.0]))
+    position = single.at_distance(10.0)
+    assert (position.latitude, position.longitude, position.bearing) == (42.0, -71.0, None)
@@ -0,0 +1,103 @@
+"""
+TBOS API GPX track storage tests
+"""
+
+import uuid
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from api.cache import TrackCache
+from api.gpx import POINT_DTYPES, TRACK_DTYPES, Track, decode_array, decode_track, encode_array, encode_track
+from api.models import Ride, RideTrack
+
+
+def gpx_dataframe(points, seed=0):
+    rng = np.random.default_rng(seed)
+    step_distance = rng.uniform(0, 20, points)
+    return pd.DataFrame(
+        {
+            "time": 1600000000 + np.arange(points) * 2,
+            "latitude": 42.3 + np.cumsum(rng.normal(0, 1e-5, points)),
+            "longitude": -71.1 + np.cumsum(rng.normal(0, 1e-5, points)),
+            "altitude": 100 + np.cumsum(rng.normal(0, 0.5, points)),
+            "step_distance": step_distance,
+            "cum_distance": np.cumsum(step_distance),
+            "mark": np.arange(points) * 2,
+            "importance": rng.uniform(0, 50, points).astype(np.float32),
+        }
+    )
+
+
+@pytest.mark.parametrize("dtype", sorted(set(TRACK_DTYPES.values())))
+def test_array_round_trip(dtype):
+    values = np.arange(-500, 500) * 1.5
+    decoded = decode_array(encode_array(values, dtype), dtype)
+    np.testing.assert_array_equal(decoded, values.astype(dtype))
+    assert decoded.dtype == np.dtype(dtype)
+    assert not decoded.flags.writeable
+
+
+def test_array_little_endian():
+
+    # bytes are portable, whatever the byte order of the writer
+    assert decode_array(encode_array(np.array([1], dtype=">i8"), "<i8"), "<i8")[0] == 1
+    assert len(encode_array(np.zeros(10000), "<f8")) < 1000
+
+
+def test_track_round_trip():
+    columns = {name: np.arange(10) + i for i, name in enumerate(TRACK_DTYPES)}
+    track = decode_track(encode_track(columns))
+    assert isinstance(track, Track)
+    for name, values in columns.items():
+        np.testing.assert_array_equal(getattr(track, name), values)
+
+
+def test_empty_track_round_trip():
+    track = decode_track(encode_track({name: np.empty(0) for name in TRACK_DTYPES}))
+    assert all(len(values) == 0 for values in track)
+
+
+@pytest.fixture
+def track_app(app):
+    app.gpx_cache = TrackCache()
+    return app
+
+
+def test_ride_track_stored_as_one_row(track_app):
+    db = track_app.db
+    gpx_df = gpx_dataframe(1000)
+    ride_uuid = str(uuid.uuid4())
+    db.session.add(Ride(ride_uuid=ride_uuid, name="gpx", ride_type="gpx"))
+    db.session.add(RideTrack.from_dataframe(ride_uuid, gpx_df))
+    db.session.commit()
+    assert RideTrack.query.count() == 1
+
+    track = RideTrack.load_track(ride_uuid)
+    for name, dtype in POINT_DTYPES.items():
+        np.testing.assert_array_equal(getattr(track, name), gpx_df[name].to_numpy().astype(dtype))
+
+    # resampled to one point per second of mark
+    assert len(track.resampled_latitude) == gpx_df.mark.max() + 1
+    np.testing.assert_array_equal(track.resampled_latitude[::2], gpx_df.latitude.to_numpy())
+    assert RideTrack.load_track(str(uuid.uuid4())) is None
+
+
+def test_track_write_invalidates_cache(track_app):
+    db = track_app.db
+    ride_uuid = str(uuid.uuid4())
+    db.session.add(Ride(ride_uuid=ride_uuid, name="gpx", ride_type="gpx"))
+    db.session.commit()
+    assert Ride.query.get(ride_uuid).gpx_track is None
+
+    # cached as None, until the track is written
+    db.session.add(RideTrack.from_dataframe(ride_uuid, gpx_dataframe(100)))
+    db.session.commit()
+    db.session.remove()
+    assert len(Ride.query.get(ride_uuid).gpx_track.latitude) == 100
+    assert track_app.gpx_cache.stats()["misses"] == 2
+
+    db.session.delete(RideTrack.query.get(ride_uuid))
+    db.session.commit()
+    assert track_app.gpx_cache.stats()["entries"] == 0
@@ -0,0 +1,114 @@
+"""
+TBOS API job audit log paging and retention tests
+"""
+
+import time
+
+import pytest
+
+from api.models import PybJobQueue
+from api.retention import JobRetention
+
+
+def add_jobs(db, seconds, per_second, status="success"):
+
+    # jobs sharing each second, as several run per heartbeat
+    now = int(time.time())
+    for second in seconds:
+        for i in range(per_second):
+            db.session.add(
+                PybJobQueue(
+                    job_uuid=f"{second:04d}-{i:03d}",
+                    timestamp_added=now - 1000 + second,
+                    cmds=[{"level": None}],
+                    status=status,
+                    elapsed=0.01 * (i + 1),
+                )
+            )
+    db.session.commit()
+
+
+def job_keys():
+    return sorted(
+        ((job.timestamp_added, job.job_uuid) for job in PybJobQueue.query.all()),
+        reverse=True,
+    )
+
+
+def test_page_walks_all_jobs_newest_first(app):
+    add_jobs(app.db, range(5), per_second=7)
+    seen, cursor = [], None
+    while True:
+        jobs, cursor = PybJobQueue.page(PybJobQueue.query, limit=10, cursor=cursor)
+        seen.extend((job.timestamp_added, job.job_uuid) for job in jobs)
+        if cursor is None:
+            break
+    assert seen == job_keys()
+    assert len(seen) == 35
+
+
+def test_page_exact_multiple_of_limit(app):
+    add_jobs(app.db, range(2), per_second=5)
+    jobs, cursor = PybJobQueue.page(PybJobQueue.query, limit=10)
+    assert len(jobs) == 10
+    assert cursor is None
+
+
+def test_filtered(app):
+    add_jobs(app.db, range(3), per_second=2)
+    add_jobs(app.db, range(100, 101), per_second=3, status="failed")
+    assert PybJobQueue.filtered(statuses=["failed"]).count() == 3
+    since = PybJobQueue.query.order_by(PybJobQueue.timestamp_added).first().timestamp_added + 1
+    assert PybJobQueue.filtered(since=since).count() == 7
+    assert PybJobQueue.filtered(since=since, until=since + 1).count() == 2
+
+
+def test_aggregate(app):
+    add_jobs(app.db, range(2), per_second=4)
+    aggregate = PybJobQueue.aggregate(PybJobQueue.query)
+    assert aggregate["total"] == 8
+    assert aggregate["counts"] == {"success": 8}
+    assert aggregate["elapsed"]["count"] == 8
+    assert aggregate["elapsed"]["min"] == pytest.approx(0.01)
+    assert aggregate["elapsed"]["max"] == pytest.approx(0.04)
+
+
+@pytest.mark.parametrize("max_rows", [1, 10, 12, 25, 29])
+def test_retention_keeps_exactly_max_rows(app, max_rows):
+
+    # boundary falls inside a second shared by several jobs
+    add_jobs(app.db, range(3), per_second=10)
+    expected = job_keys()[:max_rows]
+    retention = JobRetention(app, max_rows=max_rows, max_age=None, batch_size=4, pause=0)
+    assert retention.prune() == 30 - max_rows
+    assert job_keys() == expected
+
+
+def test_retention_under_max_rows(app):
+    add_jobs(app.db, range(3), per_second=10)
+    retention = JobRetention(app, max_rows=30, max_age=None)
+    assert retention.prune() == 0
+    assert len(job_keys()) == 30
+
+
+def test_retention_max_age(app):
+    add_jobs(app.db, range(3), per_second=10)
+    oldest = min(job_keys())[0]
+    retention = JobRetention(app, max_rows=100, max_age=time.time() - oldest - 1)
+    assert retention.prune() == 10
+    assert min(job_keys())[0] == oldest + 1
+
+
+def test_retention_both_limits(app):
+    add_jobs(app.db, range(3), per_second=10)
+    expected = job_keys()[:5]
+    oldest = min(job_keys())[0]
+    retention = JobRetention(app, max_rows=5, max_age=time.time() - oldest - 1, batch_size=7, pause=0)
+    assert retention.prune() == 25
+    assert job_keys() == expected
+
+
+def test_retention_no_limits(app):
+    add_jobs(app.db, range(3), per_second=10)
+    assert JobRetention(app, max_rows=None, max_age=None).prune() == 0
+    assert len(job_keys()) == 30
@@ -0,0 +1,148 @@
+"""
+TBOS API write-behind persistence tests
+"""
+
+import uuid
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from api.models import Heartbeat, Ride
+from api.persistence import WriteBehind
+
+
+@pytest.fixture
+def persistence(app):
+    app.persistence = WriteBehind(app, mode="batched", flush_records=1000)
+    yield app.persistence
+    app.persistence.stop_event.set()
+
+
+def heartbeat(ride_uuid, mark, **kwargs):
+    return Heartbeat(
+        hb_uuid=kwargs.pop("hb_uuid", str(uuid.uuid4())),
+        timestamp_added=mark,
+        ride_uuid=ride_uuid,
+        mark=mark,
+        data=kwargs.pop("data", {"speed": {"mph": 10.0}}),
+        level=kwargs.pop("level", 8),
+        rpm=kwargs.pop("rpm", 60.0),
+    )
+
+
+def add_ride(db):
+    ride = Ride(ride_uuid=str(uuid.uuid4()), name="test", duration=60.0)
+    db.session.add(ride)
+    db.session.commit()
+    return ride.ride_uuid
+
+
+def test_inserts_pending_until_flushed(app, persistence):
+    ride_uuid = add_ride(app.db)
+    for mark in range(1, 6):
+        persistence.insert(heartbeat(ride_uuid, mark))
+    assert persistence.pending_count == 5
+    assert Heartbeat.query.count() == 0
+
+    assert persistence.flush() == 5
+    assert persistence.pending_count == 0
+    assert sorted(hb.mark for hb in Heartbeat.query.all()) == [1, 2, 3, 4, 5]
+    assert persistence.flush() == 0
+
+
+def test_insert_snapshots_values(app, persistence):
+    ride_uuid = add_ride(app.db)
+    data = {"speed": {"mph": 10.0}}
+    persistence.insert(heartbeat(ride_uuid, 1, data=data))
+
+    # changed after queueing, as the shared status dict is on the next heartbeat
+    data["speed"]["mph"] = 99.0
+    persistence.flush()
+    assert Heartbeat.query.one().data == {"speed": {"mph": 10.0}}
+
+
+def test_update_applied_before_flush(app, persistence):
+    ride_uuid = add_ride(app.db)
+    ride = Ride.query.get(ride_uuid)
+    persistence.update(ride, completed=12.0, cum_distance=0.1)
+    persistence.update(ride, completed=13.0)
+    assert persistence.pending_count == 1
+    assert ride not in app.db.session.dirty
+
+    # a fresh load sees the queued values
+    app.db.session.remove()
+    assert Ride.query.get(ride_uuid).completed == 13.0
+    with app.db.engine.connect() as conn:
+        assert conn.execute(Ride.__table__.select()).fetchone()["completed"] == 0.0
+
+    assert persistence.flush() == 1
+    app.db.session.remove()
+    with app.db.engine.connect() as conn:
+        row = conn.execute(Ride.__table__.select()).fetchone()
+    assert (row["completed"], row["cum_distance"]) == (13.0, 0.1)
+
+
+def test_failed_record_dropped_others_written(app, persistence):
+    ride_uuid = add_ride(app.db)
+    duplicate = str(uuid.uuid4())
+    persistence.insert(heartbeat(ride_uuid, 1, hb_uuid=duplicate))
+    persistence.flush()
+
+    # primary key already written fails the batch, then alone
+    persistence.insert(heartbeat(ride_uuid, 2))
+    persistence.insert(heartbeat(ride_uuid, 3, hb_uuid=duplicate))
+    persistence.insert(heartbeat(ride_uuid, 4))
+    persistence.update(Ride.query.get(ride_uuid), completed=4.0)
+    assert persistence.flush() == 3
+    assert persistence.pending_count == 0
+    assert persistence.stats()["dropped_records"] == 1
+    assert sorted(hb.mark for hb in Heartbeat.query.all()) == [1, 2, 4]
+
+    # later flushes are not blocked
+    persistence.insert(heartbeat(ride_uuid, 5))
+    assert persistence.flush() == 1
+
+
+def test_operational_error_keeps_pending(app, persistence):
+    ride_uuid = add_ride(app.db)
+    for mark in range(1, 4):
+        persistence.insert(heartbeat(ride_uuid, mark))
+    persistence.update(Ride.query.get(ride_uuid), completed=3.0)
+
+    Heartbeat.__table__.drop(app.db.engine)
+    with pytest.raises(OperationalError):
+        persistence.flush()
+    assert persistence.pending_count == 4
+    assert persistence.stats()["dropped_records"] == 0
+
+    Heartbeat.__table__.create(app.db.engine)
+    assert persistence.flush() == 4
+    assert Heartbeat.query.count() == 3
+
+
+def test_sync_mode_flushes_each_write(app):
+    app.persistence = WriteBehind(app, mode="sync")
+    ride_uuid = add_ride(app.db)
+    app.persistence.insert(heartbeat(ride_uuid, 1))
+    assert app.persistence.pending_count == 0
+    assert Heartbeat.query.count() == 1
+    assert not app.persistence.start()
+
+
+def test_batched_flushes_at_flush_records(app):
+    app.persistence = WriteBehind(app, mode="batched", flush_seconds=60.0, flush_records=3)
+    assert app.persistence.start()
+    ride_uuid = add_ride(app.db)
+    for mark in range(1, 4):
+        app.persistence.insert(heartbeat(ride_uuid, mark))
+    for _ in range(50):
+        if app.persistence.pending_count == 0:
+            break
+        app.persistence.stop_event.wait(0.1)
+    assert app.persistence.shutdown() == 0
+    assert Heartbeat.query.count() == 3
+
+
+def test_unknown_mode():
+    with pytest.raises(Exception):
+        WriteBehind(None, mode="eventual")
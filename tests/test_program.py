@@ -0,0 +1,103 @@
+"""
+TBOS API ride program tests
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from api.models import Ride
+
+
+def generate_program_from_gpx_loop(gpx_df, duration, level_low=1, level_high=20):
+
+    """
+    Ride.generate_program_from_gpx as it was before vectorizing, the baseline programs are pinned against
+    """
+
+    gpx_df["altitude_delta"] = 0.0
+    for i, r in enumerate(gpx_df.itertuples()):
+        if i == 0:
+            ad = 0.0
+        elif r.step_distance < 3:
+            ad = 0.0
+        else:
+            lr = gpx_df.iloc[i - 1]
+            ad = round((r.altitude - lr.altitude) * 2.2, 2)
+        gpx_df.loc[i, "altitude_delta"] = ad
+
+    segment_seconds = int(duration / 200)
+    program = []
+    for x in range(0, int(duration), segment_seconds):
+        time_span = [x, x + segment_seconds]
+        cum_altitude_delta = gpx_df[(gpx_df.mark >= time_span[0]) & (gpx_df.mark < time_span[1])].altitude_delta.sum()
+        level = round(cum_altitude_delta, 0) + 8
+        if level > level_high:
+            level = level_high
+        if level < level_low:
+            level = level_low
+        program.append([level, time_span])
+    program[-1][1][1] = int(duration)
+    return program
+
+
+def gpx_dataframe(points, seed=0, irregular=False, climb=0.5):
+
+    # track as create_gpx_ride builds it, with some stationary steps
+    rng = np.random.default_rng(seed)
+    if irregular:
+        seconds = np.cumsum(rng.choice([0, 1, 1, 2, 5], points))
+    else:
+        seconds = np.arange(points)
+    step_distance = rng.uniform(0, 20, points)
+    step_distance[0] = 0.0
+    step_distance[rng.random(points) < 0.1] = 1.0
+    altitude = 100 + np.cumsum(rng.normal(0, climb, points))
+    return pd.DataFrame(
+        {
+            "time": 1600000000 + seconds,
+            "latitude": 42.3 + np.cumsum(rng.normal(0, 1e-5, points)),
+            "longitude": -71.1 + np.cumsum(rng.normal(0, 1e-5, points)),
+            "altitude": altitude,
+            "step_distance": step_distance,
+            "cum_distance": np.cumsum(step_distance),
+            "mark": seconds.astype(int),
+        }
+    )
+
+
+@pytest.mark.parametrize(
+    "points, irregular, climb, levels",
+    [
+        (3600, False, 0.5, (1, 20)),
+        (3600, False, 3.0, (4, 12)),
+        (2000, True, 0.5, (1, 20)),
+        (250, False, 1.0, (1, 20)),
+        (8000, True, 0.2, (1, 12)),
+    ],
+)
+def test_generate_program_from_gpx_matches_loop(points, irregular, climb, levels):
+    gpx_df = gpx_dataframe(points, irregular=irregular, climb=climb)
+    duration = int(gpx_df.mark.max())
+    expected = generate_program_from_gpx_loop(gpx_df.copy(), duration, *levels)
+    actual = Ride.generate_program_from_gpx(gpx_df.copy(), duration, *levels)
+    assert actual == expected
+    assert len({level for level, _ in actual}) > 1
+
+
+def test_generate_program_from_gpx_sets_altitude_delta():
+    gpx_df = gpx_dataframe(500)
+    expected = gpx_df.copy()
+    generate_program_from_gpx_loop(expected, int(gpx_df.mark.max()))
+    Ride.generate_program_from_gpx(gpx_df, int(gpx_df.mark.max()))
+    np.testing.assert_array_equal(gpx_df.altitude_delta.to_numpy(), expected.altitude_delta.to_numpy())
+
+
+def test_generate_program_from_gpx_short_duration():
+
+    # shorter than 200 seconds, where the loop had zero length segments
+    gpx_df = gpx_dataframe(120)
+    program = Ride.generate_program_from_gpx(gpx_df, 119)
+    assert len(program) == 119
+    assert program[0][1] == [0, 1]
+    assert program[-1][1] == [118, 119]
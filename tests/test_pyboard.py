@@ -0,0 +1,108 @@
+"""
+TBOS API pyboard client tests
+"""
+
+import json
+
+import pytest
+
+from api.exceptions import PybReplRespError
+from api.models import PyboardClient
+
+
+class FakeSerial:
+
+    """
+    Serial port of a fake pyboard, recording frames written
+    """
+
+    def __init__(self, board):
+        self.board = board
+        self.port = "/dev/fake"
+        self.in_waiting = 0
+
+    def flushInput(self):
+        self.in_waiting = 0
+
+    def write(self, data):
+        self.board.frames.append(json.loads(data.decode()))
+        self.in_waiting = 3
+        return len(data)
+
+    def read(self, size):
+        self.in_waiting = 0
+        return b"BOM"
+
+
+class FakePyboard:
+
+    """
+    Answers each request with its index in the frame, as the embedded controller runs a batch in sequence
+    """
+
+    def __init__(self, error_at=None):
+        self.frames = []
+        self.error_at = error_at
+        self.serial = FakeSerial(self)
+
+    def respond(self, request, idx):
+        if idx == self.error_at:
+            return {"error": "bad request", "sender": "pyboard"}
+        return {"idx": idx, "request": {k: v for k, v in request.items() if k != "sender"}, "sender": "pyboard"}
+
+    def read_until(self, min_num_bytes, ending, timeout=10):
+        frame = self.frames[-1]
+        if isinstance(frame, list):
+            response = [self.respond(request, idx) for idx, request in enumerate(frame)]
+        else:
+            response = self.respond(frame, 0)
+        return json.dumps(response).encode() + ending
+
+
+@pytest.fixture
+def board():
+    return FakePyboard()
+
+
+def status_cmds():
+    return [{"level": None, "lower_bound": 2, "upper_bound": 95}, {"lcd": {"l1": "TBOS", "l2": "ready"}}]
+
+
+def test_multiple_commands_one_frame(board):
+    client = PyboardClient(pyb=board)
+    responses = client.execute(status_cmds(), debug=False)
+    assert len(board.frames) == 1
+    assert [request["sender"] for request in board.frames[0]] == ["client", "client"]
+    assert [response["idx"] for response in responses] == [0, 1]
+    assert responses[1]["request"] == {"lcd": {"l1": "TBOS", "l2": "ready"}}
+
+
+def test_resp_idx_from_batch(board):
+    client = PyboardClient(pyb=board)
+    response = client.execute(status_cmds(), resp_idx=0, debug=False)
+    assert response["request"] == {"level": None, "lower_bound": 2, "upper_bound": 95}
+    with pytest.raises(PybReplRespError):
+        client.execute(status_cmds(), resp_idx=5, debug=False)
+
+
+def test_unbatched_round_trip_per_command(board):
+    client = PyboardClient(pyb=board)
+    batched = client.execute(status_cmds(), debug=False)
+    unbatched = client.execute(status_cmds(), batch=False, debug=False)
+    assert len(board.frames) == 3
+    assert [response["request"] for response in unbatched] == [response["request"] for response in batched]
+
+
+def test_single_command_not_framed(board):
+    client = PyboardClient(pyb=board)
+    response = client.execute([{"level": 5}], resp_idx=0, debug=False)
+    assert isinstance(board.frames[0], dict)
+    assert response["request"] == {"level": 5}
+
+
+def test_error_in_batch_raised():
+    board = FakePyboard(error_at=1)
+    client = PyboardClient(pyb=board)
+    with pytest.raises(Exception, match="ERROR WITH SERIAL JOB WRITE") as e:
+        client.execute(status_cmds(), debug=False)
+    assert "bad request" in str(e.value.__cause__)
@@ -0,0 +1,181 @@
+"""
+TBOS API device scheduler tests
+"""
+
+from types import SimpleNamespace
+import threading
+
+import pytest
+
+from api.exceptions import DeviceJobTimeout
+from api.scheduler import PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_NORMAL, DeviceScheduler
+
+
+class FakeRunner:
+
+    """
+    Runs jobs in place of the device, recording their commands in order
+
+    A job of ["block"] holds the worker until release(), so jobs queue up behind it; ["fail"] raises.
+    """
+
+    def __init__(self):
+        self.ran = []
+        self.blocking = threading.Event()
+        self.gate = threading.Event()
+
+    def __call__(self, job):
+        if job.cmds == ["block"]:
+            self.blocking.set()
+            self.gate.wait(5)
+        self.ran.append(job.cmds)
+        if job.cmds == ["fail"]:
+            raise RuntimeError("device error")
+        return {"cmds": job.cmds}
+
+    def release(self):
+        self.gate.set()
+
+
+@pytest.fixture
+def runner():
+    return FakeRunner()
+
+
+@pytest.fixture
+def scheduler(runner):
+    scheduler = DeviceScheduler(SimpleNamespace(config={"TBOS_JOB_TIMEOUT": 5}), runner=runner, audit=False)
+    yield scheduler
+    runner.release()
+    scheduler.stop(timeout=5)
+
+
+def block(scheduler, runner):
+
+    # occupy the worker, so following jobs stay queued
+    job = scheduler.submit(["block"])
+    assert runner.blocking.wait(5)
+    return job
+
+
+def test_run_job_returns_response(scheduler):
+    assert scheduler.run_job(["status"]) == {"cmds": ["status"]}
+    assert scheduler.stats()["completed"] == 1
+
+
+def test_priority_then_submission_order(scheduler, runner):
+    block(scheduler, runner)
+    jobs = [
+        scheduler.submit(["low"], priority=PRIORITY_LOW),
+        scheduler.submit(["normal 1"], priority=PRIORITY_NORMAL),
+        scheduler.submit(["high"], priority=PRIORITY_HIGH),
+        scheduler.submit(["normal 2"], priority=PRIORITY_NORMAL),
+    ]
+    assert [job["cmds"] for job in scheduler.stats()["pending"]] == [["high"], ["normal 1"], ["normal 2"], ["low"]]
+    runner.release()
+    for job in jobs:
+        job.future.result(5)
+    assert runner.ran == [["block"], ["high"], ["normal 1"], ["normal 2"], ["low"]]
+    assert all(job.status == "success" for job in jobs)
+
+
+def test_failed_job(scheduler):
+    assert scheduler.run_job(["fail"]) is None
+    with pytest.raises(RuntimeError):
+        scheduler.run_job(["fail"], raise_exceptions=True)
+    assert scheduler.stats()["failed"] == 2
+
+    # worker carries on after a failure
+    assert scheduler.run_job(["status"]) == {"cmds": ["status"]}
+
+
+def test_timeout_cancels_queued_job(scheduler, runner):
+    block(scheduler, runner)
+    with pytest.raises(DeviceJobTimeout):
+        scheduler.run_job(["status"], timeout=0.05)
+    runner.release()
+    assert scheduler.run_job(["after"]) == {"cmds": ["after"]}
+    assert runner.ran == [["block"], ["after"]]
+    assert scheduler.stats()["cancelled"] == 1
+    assert scheduler.stats()["timeouts"] == 1
+
+
+def test_cancel_pending(scheduler, runner):
+    blocked = block(scheduler, runner)
+    jobs = [scheduler.submit([f"job {i}"]) for i in range(3)]
+    assert scheduler.cancel_pending() == 3
+    runner.release()
+    assert blocked.future.result(5) == {"cmds": ["block"]}
+    assert all(job.future.cancelled() and job.status == "cancelled" for job in jobs)
+    assert scheduler.run_job(["after"]) == {"cmds": ["after"]}
+    assert runner.ran == [["block"], ["after"]]
+
+
+def test_coalesced_jobs_run_once_for_last(scheduler, runner):
+    block(scheduler, runner)
+    jobs = [scheduler.submit([f"level {level}"], key="level") for level in (3, 4, 5)]
+    other = scheduler.submit(["status"])
+    assert [job["cmds"] for job in scheduler.stats()["pending"]] == [["level 5"], ["status"]]
+    runner.release()
+
+    # superseded jobs resolve with the response of the job that replaced them
+    assert [job.future.result(5) for job in jobs] == [{"cmds": ["level 5"]}] * 3
+    other.future.result(5)
+    assert runner.ran == [["block"], ["level 5"], ["status"]]
+    assert [job.status for job in jobs] == ["superseded", "superseded", "success"]
+    assert jobs[0].superseded_by == jobs[1].job_uuid
+    assert jobs[1].superseded_by == jobs[2].job_uuid
+    assert scheduler.stats()["superseded"] == 2
+
+
+def test_coalesced_job_keeps_place_at_higher_priority(scheduler, runner):
+    block(scheduler, runner)
+    scheduler.submit(["lcd a"], key="lcd", priority=PRIORITY_LOW)
+    scheduler.submit(["status"], priority=PRIORITY_NORMAL)
+    scheduler.submit(["lcd b"], key="lcd", priority=PRIORITY_HIGH)
+    scheduler.submit(["lcd c"], key="lcd", priority=PRIORITY_LOW)
+    runner.release()
+    scheduler.run_job(["after"], priority=PRIORITY_LOW)
+    assert runner.ran == [["block"], ["lcd c"], ["status"], ["after"]]
+
+
+def test_running_job_not_superseded(scheduler, runner):
+    running = scheduler.submit(["block"], key="level")
+    assert runner.blocking.wait(5)
+    queued = scheduler.submit(["level 5"], key="level")
+    runner.release()
+    assert running.future.result(5) == {"cmds": ["block"]}
+    assert queued.future.result(5) == {"cmds": ["level 5"]}
+    assert running.status == "success"
+
+
+def test_superseded_jobs_share_failure(scheduler, runner):
+    block(scheduler, runner)
+    first = scheduler.submit(["level 3"], key="level")
+    last = scheduler.submit(["fail"], key="level")
+    runner.release()
+    for job in (first, last):
+        with pytest.raises(RuntimeError):
+            job.future.result(5)
+
+
+def test_cancel_superseded_job_leaves_replacement(scheduler, runner):
+    block(scheduler, runner)
+    first = scheduler.submit(["level 3"], key="level")
+    last = scheduler.submit(["level 4"], key="level")
+    assert scheduler.cancel(first)
+    runner.release()
+    assert last.future.result(5) == {"cmds": ["level 4"]}
+    assert first.future.cancelled()
+    assert runner.ran == [["block"], ["level 4"]]
+
+
+def test_cancelled_job_not_coalesced_into(scheduler, runner):
+    block(scheduler, runner)
+    first = scheduler.submit(["level 3"], key="level")
+    scheduler.cancel(first)
+    last = scheduler.submit(["level 4"], key="level")
+    runner.release()
+    assert last.future.result(5) == {"cmds": ["level 4"]}
+    assert first.status == "cancelled"
+    assert last.superseded_by is None and first.superseded_by is None
@@ -0,0 +1,144 @@
+"""
+TBOS API ride timeseries tests
+"""
+
+import numpy as np
+import pytest
+
+from api.timeseries import RideTimeseries, ffill, to_json_values
+
+
+def recorded_timeseries(length, recorded=None):
+    program = np.repeat(np.arange(1, length // 60 + 2, dtype=float), 60)[:length]
+    recorded = length if recorded is None else recorded
+    columns = [program] + [np.full(length, np.nan) for _ in range(3)]
+    timeseries = RideTimeseries("ride", columns)
+    for mark in range(1, recorded + 1):
+        timeseries.record(mark, mark % 20 + 1, 60 + mark % 30, 10.0)
+    return timeseries
+
+
+@pytest.mark.parametrize("mode", ["lttb", "minmax"])
+@pytest.mark.parametrize("max_points", [1, 2, 3, 5, 60, 500])
+def test_chart_data_labels_at_most_max_points(mode, max_points):
+    chart_data = recorded_timeseries(3600).chart_data(3600, max_points=max_points, mode=mode)
+    assert chart_data["downsampled"] == {"mode": mode, "max_points": max_points}
+    for labels_key, datasets_key in (("labels", "datasets"), ("speed_labels", "speed_datasets")):
+        assert 0 < len(chart_data[labels_key]) <= max_points
+        assert all(len(dataset["data"]) == len(chart_data[labels_key]) for dataset in chart_data[datasets_key])
+
+
+@pytest.mark.parametrize("max_points", [0, -1])
+def test_chart_data_rejects_max_points_below_one(max_points):
+    with pytest.raises(ValueError):
+        recorded_timeseries(120).chart_data(120, max_points=max_points)
+
+
+def test_chart_data_downsampled_when_record_extends_past_max_points():
+
+    # length at the max_points boundary, then extended, as by a concurrent record()
+    timeseries = recorded_timeseries(60)
+    assert timeseries.chart_data(60, max_points=60)["downsampled"] is None
+    timeseries.record(61, 5, 70, 10.0)
+    chart_data = timeseries.chart_data(61, max_points=60)
+    assert chart_data["downsampled"] is not None
+    assert len(chart_data["labels"]) <= 60
+
+
+def test_ffill():
+    values = np.array([np.nan, np.nan, 1.0, np.nan, 3.0, np.nan, np.nan])
+    np.testing.assert_array_equal(ffill(values), [np.nan, np.nan, 1.0, 1.0, 3.0, 3.0, 3.0])
+
+
+def test_to_json_values():
+    values = np.array([np.nan, 1.0, 2.5])
+    assert to_json_values(values) == [None, 1.0, 2.5]
+    assert to_json_values(values, integer=True) == [None, 1, 2]
+
+
+def test_record_extends_past_program():
+    timeseries = recorded_timeseries(10, recorded=0)
+    assert not timeseries.record(0, 5, 60, 10.0)
+    assert not timeseries.record(None, 5, 60, 10.0)
+    assert timeseries.record(25, 5, 60, 10.0)
+    assert len(timeseries) == 25
+    data = timeseries.snapshot()
+    assert np.isnan(data[10:24]).all()
+    np.testing.assert_array_equal(data[24, 1:], [5, 60, 10.0])
+
+
+def test_chart_data_fills_until_completed():
+    timeseries = recorded_timeseries(10, recorded=0)
+    timeseries.record(2, 4, 60, 10.0)
+    timeseries.record(5, 6, 70, 12.0)
+    chart_data = timeseries.chart_data(7)
+    program, recorded = (dataset["data"] for dataset in chart_data["datasets"])
+    rpm, mph = (dataset["data"] for dataset in chart_data["speed_datasets"])
+    assert program == [1] * 10
+    assert recorded == [None, 4, 4, 4, 6, 6, 6, None, None, None]
+    assert rpm == [None, 60, 60, 60, 70, 70, 70, None, None, None]
+    assert chart_data["labels"] == [f"{i}s" for i in range(1, 11)]
+    assert chart_data["cursor"] == 7
+    assert chart_data["length"] == 10
+    assert chart_data["downsampled"] is None
+
+
+def test_chart_data_zero_speed_dropped():
+
+    # as charted before buffering, zero speeds are dropped, then filled over like any missing value
+    timeseries = recorded_timeseries(6, recorded=0)
+    timeseries.record(1, 4, 60, 10.0)
+    timeseries.record(3, 4, 0, 0.0)
+    timeseries.record(4, 4, 0, 0.0)
+    rpm, mph = (dataset["data"] for dataset in timeseries.chart_data(5)["speed_datasets"])
+    assert rpm == [60, 60, 60, 60, 60, None]
+    assert mph == [10.0, 10.0, 10.0, 10.0, 10.0, None]
+    assert timeseries.chart_data(2)["speed_datasets"][0]["data"] == [60, 60, None, None, None, None]
+
+
+def test_chart_delta_from_cursor():
+    timeseries = recorded_timeseries(120, recorded=30)
+    delta = timeseries.chart_delta(25, 30)
+    assert (delta["start"], delta["cursor"], delta["length"]) == (25, 30, 120)
+    assert delta["recorded"] == [mark % 20 + 1 for mark in range(26, 31)]
+    assert delta["program"] == [1] * 5
+
+
+def test_chart_delta_cursor_past_completed():
+
+    # a client ahead of the server still gets the latest row
+    timeseries = recorded_timeseries(120, recorded=30)
+    delta = timeseries.chart_delta(50, 30)
+    assert (delta["start"], delta["cursor"]) == (29, 30)
+    assert len(delta["recorded"]) == 1
+
+
+def test_chart_delta_seeds_fill_from_before_cursor():
+    timeseries = recorded_timeseries(20, recorded=0)
+    timeseries.record(3, 7, 80, 15.0)
+    timeseries.record(9, 8, 85, 16.0)
+    delta = timeseries.chart_delta(5, 9)
+    assert delta["recorded"] == [7, 7, 7, 8]
+    assert delta["rpm"] == [80, 80, 80, 85]
+
+
+def test_chart_deltas_merge_to_chart_data():
+
+    # a client merging each delta into its chart holds what a fresh chart_data() returns
+    timeseries = recorded_timeseries(300, recorded=0)
+    chart_data = timeseries.chart_data(0)
+    client = {
+        dataset["label"]: list(dataset["data"]) for dataset in chart_data["datasets"] + chart_data["speed_datasets"]
+    }
+    cursor = chart_data["cursor"]
+    for mark in range(1, 301):
+        if mark % 7:
+            timeseries.record(mark, mark % 20 + 1, 0 if mark % 11 == 0 else 60 + mark % 30, 10.0)
+        delta = timeseries.chart_delta(cursor, mark)
+        for label in client:
+            client[label][delta["start"] : delta["cursor"]] = delta[label]
+        cursor = delta["cursor"]
+
+    expected = timeseries.chart_data(300)
+    for dataset in expected["datasets"] + expected["speed_datasets"]:
+        assert client[dataset["label"]] == dataset["data"]